@@ -0,0 +1,522 @@
+"""
+The recorder's frontends, a menu of recording, preview, export, replay, profile and jitter screens on urwid, or on
+an asyncio event loop, run by main.py
+
+The frontends are kept out of main.py, so recorders can be run without urwid, see headless.py
+"""
+import os
+import time
+from functools import partial
+from multiprocessing import Barrier
+from urwid_app import UrwidFrontend
+from asyncio_app import AsyncioFrontend
+from main import start_recording, _counter, RECORDING_DIR, PREVIEW_HEIGHT, PREVIEW_WIDTH, PREVIEW_FPS, \
+    PREFLIGHT_BYTES, STALL_SECONDS, INTERRUPT_SECONDS, KILL_SECONDS, READ_BUDGET, METRICS_INTERVAL
+from preview import FrameRing
+from stats import GrabStats
+from scheduling import Scheduling, describe, jitter_report
+from disk import preflight, DiskMonitor
+from export import export_main, ExportProgress
+from replay import replay_main, ReplayProgress, latest_recording
+from profiles import load_profiles, profile_camera, profile_text, DEFAULT_PROFILE
+from watchdog import Watchdog
+from dashcam import DashcamProgress, POST_SECONDS
+from motion import MOTION_PRE_SECONDS
+from metrics import RecorderMetrics, MetricsServer, TextfileWriter, TEXTFILE_INTERVAL
+
+
+class RecordingApp(UrwidFrontend):
+    def __init__(self, serials=None, cpus=None, segment_seconds=None, segment_bytes=None,
+                 preflight_bytes=PREFLIGHT_BYTES, standby=False, stall_seconds=STALL_SECONDS,
+                 interrupt_seconds=INTERRUPT_SECONDS, kill_seconds=KILL_SECONDS, export_format='mp4',
+                 export_processes=None, replay=None, profiles=None, profile=DEFAULT_PROFILE, metrics_port=None,
+                 metrics_textfile=None, metrics_interval=TEXTFILE_INTERVAL, pre_seconds=None,
+                 post_seconds=POST_SECONDS, ring_directory=None, motion=None, scheduling=None):
+        """
+        :param serials: serial numbers of the cameras to record, each in its own process, if None the first
+            camera found is recorded
+        :param cpus: list of cpu sets, one per camera, to pin each recorder to
+        :param segment_seconds: split recordings into segments of this many seconds
+        :param segment_bytes: split recordings into segments of this many bytes
+        :param preflight_bytes: bytes to write when measuring the disk's bandwidth before the first recording,
+            0 to skip the measurement
+        :param standby: if True, recorders are started and their cameras opened ahead of time, at startup and
+            after each recording stops, so recording starts as soon as it is requested
+        :param stall_seconds: kill and restart a recorder under a new run id when it records no frames for
+            this many seconds, None to never restart
+        :param interrupt_seconds: seconds a stopping recorder gets to finalize its recording before it is sent
+            SIGINT, None to wait forever
+        :param kill_seconds: seconds after SIGINT before a stopping recorder is sent SIGKILL, None to wait forever
+        :param export_format: format the Export menu exports recordings to, see export.FORMATS
+        :param export_processes: recordings to export at once, defaults to half the cpus
+        :param replay: recording the Replay menu plays back, defaults to the most recent recording
+        :param profiles: dict of name -> profiles.Profile that can be chosen in the Profiles menu, defaults to the
+            built in profiles
+        :param profile: name of the profile to record with until another is chosen
+        :param metrics_port: serve OpenMetrics on this local port, None to not serve them
+        :param metrics_textfile: write OpenMetrics to this file every metrics_interval seconds, for the
+            node_exporter textfile collector, None to not write them
+        :param pre_seconds: if set, record in dashcam mode, keeping this many seconds in a ring until Trigger is
+            pressed in the Recording menu, see dashcam.py
+        :param post_seconds: seconds to record after a trigger in dashcam mode
+        :param ring_directory: where recorders keep their ring in dashcam mode, defaults to dashcam.RING_DIR
+        :param motion: motion.MotionDetector, if set, motion triggers recording in dashcam mode, see motion.py
+        :param scheduling: scheduling.Scheduling to run the recorders with, each pinned to its cpus, the Jitter
+            menu compares the frame intervals of recordings made with each scheduling
+        """
+        super().__init__('SVO Recorder', colors=256)
+        if motion is not None and pre_seconds is None:
+            pre_seconds = MOTION_PRE_SECONDS
+        choices = ['Stop Recording'] + (['Trigger'] if pre_seconds is not None else [])
+        shared = {'preview': partial(FrameRing, PREVIEW_HEIGHT, PREVIEW_WIDTH), 'stats': GrabStats}
+        self.serials = serials or [None]
+        self.cpus = cpus or [None] * len(self.serials)
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.preflight_bytes = preflight_bytes
+        self.bandwidth = None
+        self.disk = None
+        self.profiles = profiles or load_profiles(None)
+        self.profile = self.profiles[profile]
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.ring_directory = ring_directory
+        self.motion = motion
+        self.scheduling = scheduling or Scheduling()
+        if serials is None:
+            self.cameras = ['Recording']
+            self.add_subprocess('Recording', start_recording, choices, status=True, shared=shared, preview=True)
+        else:
+            self.cameras = [f'Camera {serial}' for serial in serials]
+            for camera in self.cameras:
+                self.add_subprocess(camera, start_recording, None, status=True, shared=shared)
+            self.add_menu('Recording', choices, preview=True)
+        self.add_subprocess('Export', partial(export_main, format=export_format,
+                                              processes=export_processes), ['Start Export', 'Stop Export'])
+        self.export = ExportProgress()
+        self.dashcam = {camera: DashcamProgress() for camera in self.cameras}
+        self.add_menu('Profiles', list(self.profiles))
+        self.add_menu('Jitter', ['Refresh'])
+        self.add_subprocess('Replay', replay_main, ['Replay Real Time', 'Replay Max Speed', 'Stop Replay'],
+                            status=True, shared=shared, preview=True)
+        self.replay = replay
+        self.replay_progress = ReplayProgress()
+        self.current_menu = None
+        self.next_preview = 0.0
+        self.rates = {}
+        self.standby = standby
+        self.stall_seconds = stall_seconds
+        self.watchdog = None
+        self.interrupt_seconds = interrupt_seconds
+        self.kill_seconds = kill_seconds
+        self.finalizing = set()
+        self.after_stop = None
+        self.restandby = False
+        self.metrics = RecorderMetrics()
+        self.next_metrics = 0.0
+        self.metrics_server = MetricsServer(self.metrics.registry, metrics_port) if metrics_port else None
+        self.metrics_writer = TextfileWriter(self.metrics.registry, metrics_textfile, metrics_interval) \
+            if metrics_textfile else None
+        if standby:
+            self.measure_disk()
+            self.fork_recorders(standby=True)
+
+    @property
+    def directory(self):
+        return self.profile.directory or RECORDING_DIR
+
+    def measure_disk(self):
+        if self.bandwidth is None and self.preflight_bytes > 0:
+            os.makedirs(self.directory, exist_ok=True)
+            self.bandwidth, _ = preflight(self.directory, size=self.preflight_bytes)
+
+    def select_profile(self, name):
+        """
+        records with the named profile from the next recording on, recorders in standby are restarted with it
+        """
+        profile = self.profiles[name]
+        if profile.directory != self.profile.directory:
+            # the bandwidth was measured on the old directory's disk
+            self.bandwidth = None
+        self.profile = profile
+        if self.standby and not self.finalizing:
+            self.stop(standby=True)
+
+    def fork_recorders(self, cameras=None, **kwargs):
+        """
+        forks a recorder per camera, all start grabbing once every camera is open
+        :param cameras: names of the cameras to fork, defaults to all of them
+        """
+        cameras = cameras or self.cameras
+        barrier = Barrier(len(cameras)) if len(cameras) > 1 else None
+        for camera, serial, cpus in zip(self.cameras, self.serials, self.cpus):
+            if camera not in cameras:
+                continue
+            self.subprocess[camera].fork(camera=profile_camera(self.profile, serial), directory=self.directory,
+                                         tag=serial, barrier=barrier, scheduling=self.scheduling.pinned(cpus),
+                                         segment_seconds=self.segment_seconds, segment_bytes=self.segment_bytes,
+                                         pre_seconds=self.pre_seconds, post_seconds=self.post_seconds,
+                                         ring_directory=self.ring_directory, motion=self.motion, **kwargs)
+
+    def start(self):
+        """
+        starts a recorder per camera under a shared run id
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if self.bandwidth is None and self.preflight_bytes > 0:
+            self.subprocess_menu['Recording'].update('Measuring disk write speed ...')
+            self.loop.draw_screen()
+            self.measure_disk()
+        self.disk = DiskMonitor(self.directory, bandwidth=self.bandwidth)
+
+        run_id = _counter(self.directory)
+        requested = time.monotonic_ns()
+        self.rates = {}
+        self.watchdog = Watchdog(self.directory, run_id, stall_seconds=self.stall_seconds)
+        if self.standby:
+            for camera in self.cameras:
+                self.subprocess[camera].write_pipe(('start', run_id, requested))
+        else:
+            self.fork_recorders(run_id=run_id, requested_ns=requested)
+
+    def stop(self, standby=None, then=None):
+        """
+        signals every recorder at once, so they stop together, and returns without waiting for them to finalize
+        their recordings, the recording menu shows their progress until they have all stopped
+        :param standby: if True, start new recorders in standby once they have stopped, defaults to self.standby
+        :param then: called with no arguments once every recorder has stopped
+        """
+        self.restandby = self.standby if standby is None else standby
+        if then is not None:
+            self.after_stop = then
+        if self.finalizing:
+            return
+        self.finalizing = {camera for camera in self.cameras if self.subprocess[camera].is_alive()}
+        if not self.finalizing:
+            self.all_stopped()
+        for camera in list(self.finalizing):
+            self.stop_subprocess(camera, on_stopped=self.recorder_stopped, interrupt_after=self.interrupt_seconds,
+                                 kill_after=self.kill_seconds)
+
+    def recorder_stopped(self, camera):
+        self.finalizing.discard(camera)
+        if self.watchdog is not None:
+            shutdown = self.subprocess[camera].shutdown
+            self.watchdog.stopped(camera, shutdown.timings if shutdown is not None else {})
+        if not self.finalizing:
+            self.all_stopped()
+
+    def all_stopped(self):
+        self.update_metrics()
+        self.watchdog = None
+        if self.restandby:
+            self.fork_recorders(standby=True)
+        then, self.after_stop = self.after_stop, None
+        if then is not None:
+            then()
+
+    def show_main_menu(self):
+        self.main.original_widget = self.main_menu.menu()
+
+    def restart(self, camera):
+        """
+        kills a stalled recorder and restarts it under a new run id, the other cameras keep recording
+        """
+        subprocess = self.subprocess[camera]
+        subprocess.kill()
+        frames = subprocess.read_status().frames
+        summary = subprocess.blocks['stats'].summary() if 'stats' in subprocess.blocks else None
+        run_id = _counter(self.directory)
+        self.fork_recorders(cameras=[camera], run_id=run_id, requested_ns=time.monotonic_ns())
+        self.rates.pop(camera, None)
+        self.watchdog.restarted(camera, run_id, frames, summary)
+
+    def supervise(self, now):
+        """
+        restarts any recorder that has stopped recording frames
+        """
+        if self.watchdog is None or self.finalizing:
+            return
+        for camera in self.cameras:
+            if self.watchdog.stalled(camera, self.subprocess[camera].read_status(), now):
+                self.restart(camera)
+
+    def handle_button(self, button, choice):
+
+        if choice in self.subprocess_menu:
+            self.current_menu = choice
+
+        if choice == 'Recording':
+            self.main.original_widget = self.subprocess_menu['Recording'].menu()
+            # while the last recording is finalizing, the menu shows its progress instead
+            if not self.finalizing:
+                self.start()
+
+        if choice == 'Profiles':
+            self.main.original_widget = self.subprocess_menu['Profiles'].menu()
+            self.subprocess_menu['Profiles'].update([f'recording with {profile_text(self.profile)}\n'])
+
+        if choice in self.profiles and self.current_menu == 'Profiles':
+            self.select_profile(choice)
+            self.subprocess_menu['Profiles'].update([f'recording with {profile_text(self.profile)}\n'])
+            return
+
+        if choice == 'Return to Main' and self.current_menu == 'Profiles':
+            self.show_main_menu()
+            return
+
+        if choice == 'Jitter':
+            self.main.original_widget = self.subprocess_menu['Jitter'].menu()
+
+        if choice in ('Jitter', 'Refresh'):
+            self.subprocess_menu['Jitter'].update(self.jitter_text())
+            return
+
+        if choice == 'Return to Main' and self.current_menu == 'Jitter':
+            self.show_main_menu()
+            return
+
+        if choice == 'Export':
+            self.main.original_widget = self.subprocess_menu['Export'].menu()
+            self.subprocess_menu['Export'].update(self.export.text())
+
+        if choice == 'Start Export' and not self.subprocess['Export'].is_alive():
+            self.export = ExportProgress()
+            self.subprocess['Export'].fork(directory=self.directory)
+
+        if choice == 'Stop Export' and self.subprocess['Export'].is_alive():
+            self.stop_subprocess('Export', interrupt_after=self.interrupt_seconds, kill_after=self.kill_seconds)
+
+        if choice == 'Return to Main' and self.current_menu == 'Export':
+            # the export carries on in the background
+            self.show_main_menu()
+            return
+
+        if choice == 'Replay':
+            self.main.original_widget = self.subprocess_menu['Replay'].menu()
+            filename = self.replay or latest_recording(self.directory)
+            self.subprocess_menu['Replay'].update(self.replay_progress.text() or
+                                                  [f'{filename or "no recordings"}\n'])
+
+        if choice in ('Replay Real Time', 'Replay Max Speed') and not self.subprocess['Replay'].is_alive():
+            filename = self.replay or latest_recording(self.directory)
+            if filename is not None:
+                self.replay_progress = ReplayProgress()
+                self.rates.pop('Replay', None)
+                self.subprocess['Replay'].fork(filename=filename, realtime=choice == 'Replay Real Time')
+
+        if choice == 'Stop Replay' and self.subprocess['Replay'].is_alive():
+            self.stop_subprocess('Replay', interrupt_after=self.interrupt_seconds, kill_after=self.kill_seconds)
+
+        if choice == 'Return to Main' and self.current_menu == 'Replay':
+            self.stop_subprocess('Replay', interrupt_after=self.interrupt_seconds, kill_after=self.kill_seconds)
+            self.show_main_menu()
+            return
+
+        if choice == 'Trigger':
+            self.trigger()
+            return
+
+        if choice == 'Stop Recording' or choice == 'Return to Main':
+            self.stop(then=self.show_main_menu)
+            return
+
+        if choice == 'Quit':
+            for name in ('Export', 'Replay'):
+                if self.subprocess[name].is_alive():
+                    self.stop_subprocess(name, interrupt_after=self.interrupt_seconds, kill_after=self.kill_seconds)
+            self.stop(standby=False, then=partial(self.exit_program, button))
+            return
+
+        super().handle_button(button, choice)
+
+    def fps(self, camera, frames, now):
+        """
+        frame rate of a camera, measured over about a second
+        """
+        last, last_frames, fps = self.rates.get(camera, (now, frames, 0.0))
+        if now - last >= 1.0:
+            fps = (frames - last_frames) / (now - last)
+            last, last_frames = now, frames
+        self.rates[camera] = (last, last_frames, fps)
+        return fps
+
+    def camera_text(self, camera, now):
+        status = self.subprocess[camera].read_status()
+        stats = self.subprocess[camera].blocks.get('stats')
+        summary = stats.summary()
+        fps = self.fps(camera, status.frames, now)
+        return [f'{camera}: {status.frames} frames {fps:.1f} fps {status.bytes_written / 1e6:.1f} MB '
+                f'{summary["dropped"]} dropped {summary["failed"]} failed '
+                f'first frame {summary["start_latency_ms"]:.0f} ms\n']
+
+    def jitter_text(self):
+        """
+        the scheduling each recorder runs with, and the frame intervals of the recordings in the directory, by
+        the scheduling they were recorded with
+        """
+        text = []
+        for camera in self.cameras:
+            settings = self.subprocess[camera].read_scheduling()
+            if settings is not None:
+                missing = self.subprocess[camera].scheduling.check(settings)
+                text += [f'{camera}: {describe(settings)}' + (f', not permitted {", ".join(missing)}'
+                                                              if missing else '') + '\n']
+        return text + jitter_report(self.directory)
+
+    def update_export(self):
+        self.export = self.subprocess['Export'].read_pipe(max_seconds=READ_BUDGET, reduce=ExportProgress.update,
+                                                          initial=self.export)
+        text = self.export.text()
+        shutdown = self.subprocess['Export'].shutdown
+        if shutdown is not None:
+            text += [f'{shutdown.text()}\n']
+        self.subprocess_menu['Export'].update(text)
+
+    def update_replay(self, now):
+        replay = self.subprocess['Replay']
+        self.replay_progress = replay.read_pipe(max_seconds=READ_BUDGET, reduce=ReplayProgress.update,
+                                                initial=self.replay_progress)
+        status = replay.read_status()
+        if status is None or self.current_menu != 'Replay':
+            return
+        summary = replay.blocks['stats'].summary()
+        fps = self.fps('Replay', status.frames, now)
+        text = self.replay_progress.text() + [
+            f'{status.frames} frames {fps:.1f} fps\n',
+            f'decode {summary["latency_p50_ms"]:.1f} / {summary["latency_p99_ms"]:.1f} / '
+            f'{summary["latency_max_ms"]:.1f} ms p50/p99/max\n']
+        if replay.shutdown is not None:
+            text += [f'{replay.shutdown.text()}\n']
+        self.subprocess_menu['Replay'].update(text)
+        if now >= self.next_preview:
+            self.next_preview = now + 1 / PREVIEW_FPS
+            frame = replay.blocks['preview'].latest()
+            if frame is not None:
+                self.subprocess_menu['Replay'].update_preview(frame)
+
+    def trigger(self):
+        """
+        keeps the seconds before now in every recorder's ring, and records for post_seconds, in dashcam mode
+        """
+        requested = time.monotonic_ns()
+        for camera in self.cameras:
+            if self.subprocess[camera].is_alive():
+                self.subprocess[camera].write_pipe(('trigger', requested))
+
+    def update_dashcam(self):
+        """
+        reads the recorders' flush and event messages, in dashcam mode
+        """
+        if self.pre_seconds is None:
+            return []
+        text = []
+        for camera in self.cameras:
+            self.dashcam[camera] = self.subprocess[camera].read_pipe(
+                max_seconds=READ_BUDGET, reduce=DashcamProgress.update, initial=self.dashcam[camera])
+            prefix = f'{camera} ' if len(self.cameras) > 1 else ''
+            text += [prefix + line for line in self.dashcam[camera].text(self.pre_seconds)]
+        return text
+
+    def update_metrics(self, now=None):
+        """
+        copies the recorders' telemetry into the metrics, from the shared memory the heartbeat reads anyway
+        """
+        now = time.monotonic() if now is None else now
+        self.next_metrics = now + METRICS_INTERVAL
+        for camera in self.cameras:
+            self.metrics.update(camera, self.subprocess[camera], now)
+        if self.disk is not None:
+            self.metrics.update_disk(self.disk)
+        if self.watchdog is not None:
+            self.metrics.update_watchdog(self.watchdog)
+
+    def heartbeat(self):
+        """
+        heartbeat that runs while recording, at up to 24 times per second
+        """
+        now = time.monotonic()
+        self.supervise(now)
+        self.update_export()
+        self.update_replay(now)
+        first = self.subprocess[self.cameras[0]]
+
+        # read the latest status of the process
+        status = first.read_status()
+        ring = first.blocks.get('preview')
+        stats = first.blocks.get('stats')
+
+        # display it
+        if status is not None and len(self.cameras) == 1:
+            text = ['Recording...\n', f'{status.frames} frames\n', f'{status.bytes_written / 1e6:.1f} MB\n']
+            if ring is not None:
+                _, stride, _, max_cost, mean_cost = ring.stats()
+                text += [f'preview every {stride} frames, cost {mean_cost / 1e6:.2f} ms mean '
+                         f'{max_cost / 1e6:.2f} ms max\n']
+            if stats is not None:
+                summary = stats.summary()
+                text += [f'grab {summary["latency_p50_ms"]:.1f} / {summary["latency_p99_ms"]:.1f} / '
+                         f'{summary["latency_max_ms"]:.1f} ms p50/p99/max\n',
+                         f'interval {summary["interval_p50_ms"]:.1f} / {summary["interval_p99_ms"]:.1f} / '
+                         f'{summary["interval_max_ms"]:.1f} ms p50/p99/max\n',
+                         f'{summary["dropped"]} dropped, {summary["failed"]} failed grabs {summary["errors"]}\n',
+                         f'time to first frame {summary["start_latency_ms"]:.0f} ms\n']
+
+        elif status is not None:
+            text = ['Recording...\n']
+            for camera in self.cameras:
+                text += self.camera_text(camera, now)
+            firsts = [self.subprocess[camera].blocks['stats'].summary()['first_timestamp']
+                      for camera in self.cameras]
+            if all(firsts):
+                text += [f'start skew {(max(firsts) - min(firsts)) / 1e6:.1f} ms\n']
+
+        dashcam = self.update_dashcam()
+        if status is not None and self.disk is not None:
+            text += dashcam
+            self.disk.update(sum(self.subprocess[camera].read_status().bytes_written for camera in self.cameras))
+            text += self.disk.text()
+            if self.watchdog is not None:
+                text += self.watchdog.text()
+            if self.finalizing:
+                text = ['Finalizing...\n'] + [f'{camera}: {self.subprocess[camera].shutdown.text()}\n'
+                                              for camera in self.cameras if camera in self.finalizing and
+                                              self.subprocess[camera].shutdown is not None] + text[1:]
+            self.subprocess_menu['Recording'].update(text)
+
+        # the preview is rendered at PREVIEW_FPS, however fast the recorder writes it
+        if ring is not None and now >= self.next_preview:
+            self.next_preview = now + 1 / PREVIEW_FPS
+            frame = ring.latest()
+            if frame is not None:
+                self.subprocess_menu['Recording'].update_preview(frame)
+        if now >= self.next_metrics:
+            self.update_metrics(now)
+        self.loop.draw_screen()
+        super().heartbeat()
+
+    def run(self):
+        try:
+            super().run()
+        finally:
+            if self.metrics_server is not None:
+                self.metrics_server.close()
+            if self.metrics_writer is not None:
+                self.metrics_writer.close()
+
+
+class AsyncioRecordingApp(AsyncioFrontend, RecordingApp):
+    """
+    RecordingApp on the asyncio frontend, the disk is measured in a worker thread before the first recording,
+    so the UI stays live while it runs
+    """
+    def handle_button(self, button, choice):
+        if choice == 'Recording' and self.bandwidth is None and self.preflight_bytes > 0 and not self.finalizing:
+            return self.measure_then_record(button, choice)
+        return super().handle_button(button, choice)
+
+    async def measure_then_record(self, button, choice):
+        self.main.original_widget = self.subprocess_menu['Recording'].menu()
+        self.subprocess_menu['Recording'].update('Measuring disk write speed ...')
+        await self.aloop.run_in_executor(None, self.measure_disk)
+        super().handle_button(button, choice)
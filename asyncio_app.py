@@ -0,0 +1,86 @@
+import asyncio
+import inspect
+import urwid
+from urwid_app import UrwidFrontend
+
+
+class AsyncioFrontend(UrwidFrontend):
+    """
+    UrwidFrontend on urwid's asyncio event loop, so the frontend can run coroutines alongside the UI, eg: file
+    offload, disk monitoring or socket control
+
+    Subprocess pipes and the heartbeat work as in UrwidFrontend, so subclasses like RecordingApp run unchanged,
+    and can be put on asyncio by mixing this in first, eg: class AsyncioRecordingApp(AsyncioFrontend, RecordingApp)
+
+    On top of that
+        queue(name) returns an asyncio.Queue the subprocess's messages are put on as soon as its pipe is readable
+        spawn(coroutine) runs a coroutine as a task on the UI's loop
+        handle_button can be an async def, or return a coroutine, which is spawned
+    """
+    def __init__(self, *args, read_budget=0.005, **kwargs):
+        """
+        :param read_budget: most seconds spent reading a pipe into its queue each time it becomes readable
+        other arguments are passed on to UrwidFrontend
+        """
+        self.queues = {}
+        self.tasks = set()
+        self.read_budget = read_budget
+        self.aloop = None
+        super().__init__(*args, **kwargs)
+
+    def make_event_loop(self):
+        self.aloop = asyncio.new_event_loop()
+        return urwid.AsyncioEventLoop(loop=self.aloop)
+
+    def queue(self, name):
+        """
+        Reads the subprocess's pipe into an asyncio.Queue, from then on its messages go to the queue, so
+        read_pipe returns nothing
+        :param name: name of the subprocess
+        :return: the queue
+        """
+        if name not in self.queues:
+            self.queues[name] = asyncio.Queue()
+        return self.queues[name]
+
+    def readable(self, name):
+        """
+        a queued pipe is read straight away, one budget's worth at a time, and stays watched
+        """
+        if name not in self.queues:
+            super().readable(name)
+            return
+        for message in self.subprocess[name].read_pipe(max_seconds=self.read_budget):
+            self.queues[name].put_nowait(message)
+
+    def spawn(self, coroutine):
+        """
+        Runs a coroutine on the UI's loop, if it raises the frontend exits with the exception, like a callback
+        :return: the asyncio.Task running it
+        """
+        task = self.aloop.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.task_done)
+        return task
+
+    def task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # hand it to urwid's exception handler, which stops the loop and raises it from run()
+            self.aloop.call_exception_handler({'message': 'frontend task failed', 'exception': task.exception()})
+        self.wake()
+
+    def button_pressed(self, button, choice):
+        result = self.handle_button(button, choice)
+        if inspect.iscoroutine(result):
+            self.spawn(result)
+
+    def run(self):
+        try:
+            super().run()
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            if self.tasks:
+                self.aloop.run_until_complete(asyncio.gather(*self.tasks, return_exceptions=True))
+            self.aloop.close()
@@ -0,0 +1,1222 @@
+"""
+Benchmarks for the recorder, runnable on machines without ZED hardware
+
+    python benchmark.py soak --duration 600 --fps 60
+    python benchmark.py run_id --processes 16 --ids 500
+    python benchmark.py ipc --messages 200000
+    python benchmark.py backlog --duration 5
+    python benchmark.py watchdog --hang_after 120 --stall_seconds 1
+    python benchmark.py stop --interrupt_seconds 1 --kill_seconds 1
+    python benchmark.py export --recordings 8 --frames 300
+    python benchmark.py index --frames 1000000 --queries 100000
+    python benchmark.py replay --frames 600 --fps 60
+    python benchmark.py profiles --duration 30 --camera zed
+    python benchmark.py control --clients 48 --queries 2000
+    python benchmark.py metrics --cameras 4 --duration 10
+    python benchmark.py dashcam --pre_seconds 5 --post_seconds 2 --duration 30
+    python benchmark.py motion --episodes 3 --motion_seconds 2 --duration 30
+    python benchmark.py jitter --load 4 --duration 20 --cpu 3
+    python benchmark.py segments --segment_seconds 2 --duration 20
+
+soak: runs start_recording against a SyntheticCamera in a real SubProcess, and reads its StatusBlock from a
+UrwidFrontend heartbeat, reporting sustained frames/s, end to end counter latency, and RSS / fd growth
+of both processes, on the select or asyncio frontend
+
+run_id: stress test of the run id allocator, allocates ids from many processes at once, checks they are all
+unique and reports allocations/s, corrupting the state file part way through if asked to
+
+ipc: sends timestamped messages from a subprocess to the parent over each transport, a pickled Pipe,
+a Queue, ipc.BatchWriter struct framing unbatched and batched, and an ipc.MessageRing in shared memory,
+reporting messages/s and latency
+
+backlog: a subprocess floods its pipe with frame counts while the parent reads it once per UI tick with
+SubProcess.read_pipe, unbounded and with a per-tick budget, reporting how long each tick spent reading
+
+watchdog: records from a SyntheticCamera whose grab hangs after a number of frames, supervised by a
+watchdog.Watchdog that kills and restarts the recorder, reporting restarts and the seconds of each gap
+
+stop: stops recorders with UrwidFrontend.stop_subprocess, one that sees its event, one hung in grab that needs
+SIGINT, and one that ignores SIGINT and needs SIGKILL, reporting the time in each shutdown phase and the longest
+the frontend's event loop went without a heartbeat while they stopped
+
+export: writes synthetic recordings and exports them with export.run_export in pools of increasing size,
+reporting frames/s, then interrupts an export part way, resumes it, and checks every recording was exported
+once and the already exported ones were skipped
+
+index: writes a frame index of a long synthetic recording, reporting the cost of appending a frame, then
+compares vectorized nearest frame lookups in the memory mapped index with scanning the recording itself
+
+replay: replays a synthetic recording through replay.replay_main in a real SubProcess, read from a UrwidFrontend
+heartbeat, in real time and at max speed, reporting the replay and decode frames/s and the end to end counter
+latency, then loops the recording at max speed for a fixed time as a repeatable load on the frontend
+
+profiles: records with each recording profile for a fixed time, tabulating achieved frames/s, dropped frames,
+bytes/s written and recorder CPU%, to choose a profile for a rig, on the ZED camera or a SyntheticCamera of the
+profile's resolution and frame rate
+
+control: runs a daemon.ControlDaemon recording from a SyntheticCamera, and times status queries over its socket
+with no subscribers and with dozens of clients subscribed to live frame counts, reporting query latency, and the
+rate and lag of the telemetry each subscriber receives
+
+metrics: records from several SyntheticCameras, updating a metrics.RecorderMetrics from their shared memory at the
+UI rate while the metrics are scraped over HTTP and written to a textfile, killing and restarting one recorder part
+way, reporting the cost of an update, a render, a scrape and a textfile write, and checking the counters never
+went backwards across the restart
+
+dashcam: records from a SyntheticCamera in dashcam mode, with the ring on tmpfs and on the recording disk, and
+triggers it at intervals, reporting the ring's peak size and the recorder's RSS, the flush latency from trigger to
+the pre-trigger segments being in place, the seconds of each pre-trigger window, the p99 frame interval, and the
+bytes kept against recording continuously
+
+motion: records from a SyntheticCamera showing a still scene with a square that moves during a few episodes, with
+a motion.MotionDetector triggering dashcam mode, and without one, recording continuously, reporting the motion
+episodes found, the fraction of frames recorded, the storage saved, the detector's stride and cost a frame, and the
+frames/s and p99 frame interval of each, to show motion detection doesn't limit the grab rate
+
+jitter: records from a SyntheticCamera while other processes keep every cpu busy, with the recorder's default
+scheduling, pinned to a cpu, pinned at a raised nice level, and pinned under SCHED_FIFO, reporting what each got,
+what wasn't permitted, and its frame interval distribution, then prints scheduling.jitter_report of the recordings,
+as the frontends show it
+
+segments: records from a SyntheticCamera rolling over into short segments, and reads the manifest, reporting the
+camera time gap across each rollover against the frame interval, and the frames each rollover lost
+"""
+import os
+import sys
+import glob
+import time
+import signal
+import argparse
+import shutil
+import tempfile
+import asyncio
+import json
+import urllib.request
+from functools import partial
+from collections import deque
+import urwid
+import numpy as np
+from urwid_app import UrwidFrontend, SubProcess
+from asyncio_app import AsyncioFrontend
+from camera import SyntheticCamera
+from preview import FrameRing
+from stats import GrabStats
+from multiprocessing import Pool, Pipe, Queue, Process, Event
+from ipc import FRAME, BatchWriter, MessageRing, read_messages
+from main import start_recording
+from run_id import allocate_run_id, STATE
+from watchdog import Watchdog
+from export import run_export, output_path, ExportProgress
+from frame_index import FrameIndexWriter, FrameIndex, index_filename
+from camera import SYNTHETIC_HEADER, SYNTHETIC_RECORD, SYNTHETIC_MAGIC
+from replay import replay_main, ReplayProgress
+from profiles import load_profiles, profile_camera, synthetic_camera, PROFILES_FILE, Profile
+from daemon import ControlDaemon, ControlClient
+from metrics import RecorderMetrics, MetricsServer
+from dashcam import DashcamProgress
+from motion import MotionDetector
+from scheduling import Scheduling, describe, jitter, jitter_report
+
+
+def percentile(samples, q):
+    """
+    :param samples: list of numbers
+    :param q: percentile in the range 0 - 100
+    :return: the nearest rank percentile of samples, or 0 if there are none
+    """
+    if len(samples) == 0:
+        return 0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def proc_stats(pid):
+    """
+    :param pid: process id
+    :return: resident set size in kB and number of open file descriptors of the process (linux only)
+    """
+    rss = 0
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+    fds = len(os.listdir(f'/proc/{pid}/fd'))
+    return rss, fds
+
+
+def headless_screen():
+    """
+    urwid screen that renders into /dev/null, so the frontend can be driven without a terminal
+    """
+    read_fd, write_fd = os.pipe()
+    return urwid.raw_display.Screen(input=os.fdopen(read_fd), output=open(os.devnull, 'w'))
+
+
+class SoakApp(UrwidFrontend):
+    def __init__(self, camera, directory, duration, warmup=5.0, sample_interval=10.0, screen=None, max_fps=24,
+                 preview=False):
+        """
+        Records from the camera for duration seconds, measuring the recorder as it goes
+        :param camera: CameraBackend to record from
+        :param directory: directory to write recordings to
+        :param duration: seconds to run for
+        :param warmup: seconds to wait before taking the baseline for rates and resource growth
+        :param sample_interval: seconds between resource samples
+        :param max_fps: maximum heartbeat rate of the frontend
+        :param preview: if True the recorder also writes preview frames, and their cost is reported
+        """
+        super().__init__('Soak Benchmark', screen=screen, max_fps=max_fps)
+        recorder = partial(start_recording, camera=camera, directory=directory)
+        shared = {'stats': GrabStats}
+        if preview:
+            shared['preview'] = FrameRing
+        self.add_subprocess('Recording', recorder, ['Stop Recording'], status=True, shared=shared, preview=preview)
+        self.preview_stats = None
+        self.grab_summary = None
+
+        self.duration = duration
+        self.warmup = warmup
+        self.sample_interval = sample_interval
+        self.latency = deque(maxlen=100000)
+        self.max_latency = 0
+        self.frames = 0
+        self.baseline = None
+        self.samples = []
+        self.next_sample = 0
+        self.beats = 0
+
+        self.main.original_widget = self.subprocess_menu['Recording'].menu()
+        self.subprocess['Recording'].fork()
+        self.start = time.monotonic()
+
+    def sample(self, now):
+        """
+        records frames and resource use of both processes at time now
+        """
+        recorder = self.subprocess['Recording']
+        ui_rss, ui_fds = proc_stats(os.getpid())
+        rec_rss, rec_fds = proc_stats(recorder.proc.pid) if recorder.is_alive() else (0, 0)
+        times = os.times()
+        self.samples += [(now, self.frames, ui_rss, ui_fds, rec_rss, rec_fds, times.user + times.system, self.beats)]
+        self.next_sample = now + self.sample_interval
+
+    def heartbeat(self):
+        now = time.monotonic()
+        self.beats += 1
+        status = self.subprocess['Recording'].read_status()
+        if status.frames != self.frames:
+            # time from the recorder publishing the frame to the frontend seeing it
+            latency = (time.monotonic_ns() - status.timestamp) / 1e6
+            self.frames = status.frames
+            self.latency.append(latency)
+            self.max_latency = max(self.max_latency, latency)
+
+        elapsed = now - self.start
+        if self.baseline is None and elapsed >= self.warmup:
+            self.sample(now)
+            self.baseline = self.samples[-1]
+            self.latency.clear()
+            self.max_latency = 0
+        elif self.baseline is not None and now >= self.next_sample:
+            self.sample(now)
+
+        self.subprocess_menu['Recording'].update(['Soak benchmark...\n', f'{self.frames} frames\n',
+                                                  f'{elapsed:.0f} / {self.duration:.0f} s\n'])
+        self.loop.draw_screen()
+
+        ring = self.subprocess['Recording'].blocks.get('preview')
+        if ring is not None:
+            frame = ring.latest()
+            if frame is not None:
+                self.subprocess_menu['Recording'].update_preview(frame)
+            self.preview_stats = ring.stats()
+
+        if elapsed >= self.duration:
+            self.sample(now)
+            self.subprocess['Recording'].stop()
+            self.grab_summary = self.subprocess['Recording'].blocks['stats'].summary()
+            raise urwid.ExitMainLoop()
+        super().heartbeat()
+
+    def report(self):
+        """
+        :return: dict of the measurements taken over the run
+        """
+        if self.baseline is None or len(self.samples) < 2:
+            return {}
+        t0, frames0, ui_rss0, ui_fds0, rec_rss0, rec_fds0, cpu0, beats0 = self.baseline
+        t1, frames1, ui_rss1, ui_fds1, _, _, cpu1, beats1 = self.samples[-1]
+        # the recorder has exited by the final sample, so take its growth from the last sample it was alive for
+        _, _, _, _, rec_rss1, rec_fds1, _, _ = [s for s in self.samples if s[4] > 0][-1]
+        latency = list(self.latency)
+        report = {
+            'seconds': t1 - t0,
+            'frames': frames1 - frames0,
+            'fps': (frames1 - frames0) / (t1 - t0),
+            'latency_p50_ms': percentile(latency, 50),
+            'latency_p99_ms': percentile(latency, 99),
+            'latency_max_ms': self.max_latency,
+            'ui_cpu_percent': 100 * (cpu1 - cpu0) / (t1 - t0),
+            'ui_wakeups_per_s': (beats1 - beats0) / (t1 - t0),
+            'ui_rss_growth_kb': ui_rss1 - ui_rss0,
+            'ui_fd_growth': ui_fds1 - ui_fds0,
+            'recorder_rss_growth_kb': rec_rss1 - rec_rss0,
+            'recorder_fd_growth': rec_fds1 - rec_fds0,
+        }
+        if self.grab_summary is not None:
+            report.update({f'grab_{key}': value for key, value in self.grab_summary.items()})
+        if self.preview_stats is not None:
+            written, stride, _, max_cost, mean_cost = self.preview_stats
+            report.update({'preview_frames': written, 'preview_stride': stride,
+                           'preview_mean_ms': mean_cost / 1e6, 'preview_max_ms': max_cost / 1e6})
+        return report
+
+
+class AsyncioSoakApp(AsyncioFrontend, SoakApp):
+    pass
+
+
+def soak(args):
+    camera = SyntheticCamera(width=args.width, height=args.height, fps=args.fps, jitter=args.jitter,
+                             fail_rate=args.fail_rate, payload_bytes=args.payload_bytes)
+    with tempfile.TemporaryDirectory() as directory:
+        app_class = AsyncioSoakApp if args.asyncio else SoakApp
+        app = app_class(camera, args.directory or directory, args.duration, warmup=args.warmup,
+                        sample_interval=args.sample_interval, screen=None if args.tui else headless_screen(),
+                        max_fps=args.ui_fps, preview=args.preview)
+        app.run()
+    report = app.report()
+    for key, value in report.items():
+        print(f'{key:>24}: {value:.2f}' if isinstance(value, float) else f'{key:>24}: {value}')
+    if not report:
+        print('run was too short to measure, increase --duration')
+        return 1
+    if args.min_fps is not None and report['fps'] < args.min_fps:
+        print(f'FAIL: sustained {report["fps"]:.2f} frames/s is below {args.min_fps}')
+        return 1
+    return 0
+
+
+def _allocate(directory, count, corrupt_at):
+    ids = []
+    for i in range(count):
+        if i == corrupt_at:
+            # simulate an old style state file left empty by a crash
+            with open(f'{directory}/{STATE}', 'w'):
+                pass
+        ids += [allocate_run_id(directory)]
+        # like a recorder, create the recording, so the allocator can recover from it
+        open(f'{directory}/{ids[-1]}.svo', 'w').close()
+    return ids
+
+
+def run_id(args):
+    with tempfile.TemporaryDirectory() as directory:
+        directory = args.directory or directory
+        corrupt_at = [args.ids // 2 if args.corrupt and p == 0 else None for p in range(args.processes)]
+        start = time.monotonic()
+        with Pool(args.processes) as pool:
+            results = pool.starmap(_allocate, [(directory, args.ids, c) for c in corrupt_at])
+        elapsed = time.monotonic() - start
+    ids = [i for result in results for i in result]
+    duplicates = len(ids) - len(set(ids))
+    print(f'{len(ids)} ids from {args.processes} processes in {elapsed:.2f} s, {len(ids) / elapsed:.0f} ids/s')
+    print(f'{duplicates} duplicates')
+    in_order = all(result == sorted(result) for result in results)
+    print(f'ids increase within each process: {in_order}')
+    return 0 if duplicates == 0 and in_order else 1
+
+
+def _pace(i, start, rate):
+    if rate > 0:
+        delay = start + i / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _produce(transport, channel, count, rate, batch):
+    start = time.monotonic()
+    if transport == 'pipe':
+        for i in range(count):
+            _pace(i, start, rate)
+            channel.send((i, time.monotonic_ns()))
+    elif transport == 'queue':
+        for i in range(count):
+            _pace(i, start, rate)
+            channel.put((i, time.monotonic_ns()))
+    elif transport == 'struct':
+        writer = BatchWriter(channel, FRAME, batch=batch, max_delay=0.001 if batch > 1 else 0)
+        for i in range(count):
+            _pace(i, start, rate)
+            writer.send(i, time.monotonic_ns())
+        writer.flush()
+    elif transport == 'shm':
+        for i in range(count):
+            _pace(i, start, rate)
+            while not channel.send(i, time.monotonic_ns()):
+                time.sleep(0)
+
+
+def _consume(transport, channel, count):
+    """
+    :return: list of latency arrays in ns
+    """
+    latency = []
+    received = 0
+    while received < count:
+        if transport == 'pipe':
+            channel.poll(None)
+            i, stamp = channel.recv()
+            latency += [np.array([time.monotonic_ns() - stamp])]
+            received += 1
+        elif transport == 'queue':
+            i, stamp = channel.get()
+            latency += [np.array([time.monotonic_ns() - stamp])]
+            received += 1
+        elif transport == 'struct':
+            channel.poll(None)
+            for messages in read_messages(channel).values():
+                latency += [time.monotonic_ns() - messages['timestamp']]
+                received += len(messages)
+        elif transport == 'shm':
+            messages = channel.receive()
+            if len(messages) == 0:
+                time.sleep(0)
+                continue
+            latency += [time.monotonic_ns() - messages['timestamp']]
+            received += len(messages)
+    return latency
+
+
+def ipc(args):
+    print(f'{"transport":>16} {"messages/s":>12} {"p50 us":>10} {"p99 us":>10} {"max us":>10}')
+    for transport, batch in [('pipe', 1), ('queue', 1), ('struct', 1), ('struct', args.batch), ('shm', 1)]:
+        if transport in ('pipe', 'struct'):
+            receive, send = Pipe(duplex=False)
+        elif transport == 'queue':
+            receive = send = Queue()
+        else:
+            receive = send = MessageRing(FRAME, capacity=args.capacity)
+        start = time.monotonic()
+        producer = Process(target=_produce, args=(transport, send, args.messages, args.rate, batch))
+        producer.start()
+        latency = np.concatenate(_consume(transport, receive, args.messages)) / 1e3
+        elapsed = time.monotonic() - start
+        producer.join()
+        if transport == 'shm':
+            receive.close()
+            receive.unlink()
+        name = f'{transport} x{batch}' if batch > 1 else transport
+        print(f'{name:>16} {args.messages / elapsed:>12.0f} {np.percentile(latency, 50):>10.1f} '
+              f'{np.percentile(latency, 99):>10.1f} {latency.max():>10.1f}')
+    return 0
+
+
+def _flood(transmit, stop_process):
+    frames = 0
+    while not stop_process.is_set():
+        transmit.send(frames)
+        frames += 1
+
+
+def _aggregate(aggregate, frames):
+    count, newest = aggregate
+    return count + 1, max(newest, frames)
+
+
+def backlog(args):
+    budget = args.budget / 1e3
+    modes = [
+        ('unbounded', {}),
+        ('budget', {'max_seconds': budget}),
+        ('latest', {'max_seconds': budget, 'reduce': 'latest'}),
+        ('fold', {'max_seconds': budget, 'reduce': _aggregate, 'initial': (0, 0)}),
+    ]
+    print(f'{"mode":>10} {"ticks":>6} {"read/s":>10} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for name, kwargs in modes:
+        subprocess = SubProcess(_flood)
+        subprocess.fork()
+        read, ticks = 0, []
+        start = time.monotonic()
+        while time.monotonic() - start < args.duration:
+            time.sleep(1 / args.ui_fps)
+            tick = time.monotonic()
+            item = subprocess.read_pipe(**kwargs)
+            ticks += [time.monotonic() - tick]
+            if name in ('unbounded', 'budget'):
+                read += len(item)
+            elif name == 'fold':
+                read = item[0]
+                kwargs['initial'] = item
+        subprocess.stop(wait=False)
+        subprocess.read_pipe()  # unblock the sender so it sees the stop event
+        subprocess.proc.join()
+        rate = f'{read / args.duration:.0f}' if name != 'latest' else '-'
+        print(f'{name:>10} {len(ticks):>6} {rate:>10} {percentile(ticks, 50) * 1e3:>8.2f} '
+              f'{percentile(ticks, 99) * 1e3:>8.2f} {max(ticks) * 1e3:>8.2f}')
+    return 0
+
+
+def _stubborn(transmit, stop_process):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        time.sleep(1.0)
+
+
+class StopApp(UrwidFrontend):
+    def __init__(self, recorder, interrupt_seconds, kill_seconds, status=False, warmup=1.0, screen=None):
+        """
+        Starts the recorder, stops it asynchronously after warmup seconds, and exits once it has stopped
+        """
+        super().__init__('Stop Benchmark', screen=screen)
+        self.add_subprocess('Recording', recorder, ['Stop Recording'], status=status)
+        self.interrupt_seconds = interrupt_seconds
+        self.kill_seconds = kill_seconds
+        self.last = None
+        self.longest = 0.0
+        self.subprocess['Recording'].fork()
+        self.event_loop.alarm(warmup, self.stop)
+
+    def stop(self):
+        self.last = time.monotonic()
+        self.stop_subprocess('Recording', on_stopped=self.exit, interrupt_after=self.interrupt_seconds,
+                             kill_after=self.kill_seconds)
+
+    def heartbeat(self):
+        # how long the event loop went without a heartbeat while the recorder stopped
+        now = time.monotonic()
+        if self.last is not None:
+            self.longest = max(self.longest, now - self.last)
+            self.last = now
+        super().heartbeat()
+
+    def exit(self, name):
+        raise urwid.ExitMainLoop()
+
+
+def stop(args):
+    directory = args.directory or tempfile.mkdtemp(prefix='stop_')
+    recorders = [
+        ('event', partial(start_recording, camera=SyntheticCamera(), directory=directory), True),
+        ('interrupt', partial(start_recording, camera=SyntheticCamera(hang_after=1), directory=directory), True),
+        ('kill', _stubborn, False),
+    ]
+    print(f'{"recorder":>10} {"event s":>8} {"interrupt s":>12} {"kill s":>8} {"total s":>8} {"longest beat ms":>16}')
+    failed = False
+    for name, recorder, status in recorders:
+        app = StopApp(recorder, args.interrupt_seconds, args.kill_seconds, status=status, screen=headless_screen())
+        app.run()
+        timings = app.subprocess['Recording'].shutdown.timings
+        failed = failed or name not in timings
+        print(f'{name:>10} {timings.get("event", 0):>8.3f} {timings.get("interrupt", 0):>12.3f} '
+              f'{timings.get("kill", 0):>8.3f} {timings["total"]:>8.3f} {app.longest * 1e3:>16.1f}')
+    return 1 if failed else 0
+
+
+def watchdog(args):
+    directory = args.directory or tempfile.mkdtemp(prefix='watchdog_')
+    camera = SyntheticCamera(fps=args.fps, hang_after=args.hang_after)
+    recorder = SubProcess(partial(start_recording, camera=camera, directory=directory), status=True)
+    run_id = allocate_run_id(directory)
+    supervisor = Watchdog(directory, run_id, stall_seconds=args.stall_seconds)
+    recorder.fork(run_id=run_id)
+    start = time.monotonic()
+    while time.monotonic() - start < args.duration:
+        time.sleep(1 / args.ui_fps)
+        if supervisor.stalled('Recording', recorder.read_status()):
+            recorder.kill()
+            frames = recorder.read_status().frames
+            run_id = allocate_run_id(directory)
+            recorder.fork(run_id=run_id)
+            supervisor.restarted('Recording', run_id, frames)
+    # the last recorder may be hung, so it can't be relied on to see the stop event
+    recorder.stop(wait=False)
+    recorder.proc.join(args.stall_seconds)
+    recorder.kill()
+    recorder.close()
+
+    gaps = [gap['seconds'] for gap in supervisor.gaps if gap['seconds'] is not None]
+    print(f'{"restarts":>24}: {supervisor.restarts}')
+    print(f'{"seconds_lost":>24}: {supervisor.seconds_lost():.2f}')
+    print(f'{"gap_mean_s":>24}: {sum(gaps) / max(len(gaps), 1):.2f}')
+    print(f'{"gap_max_s":>24}: {max(gaps, default=0):.2f}')
+    print(f'{"session":>24}: {supervisor.filename}')
+    return 0 if supervisor.restarts > 0 else 1
+
+
+def _synthetic_recording(filename, frames, width, height):
+    camera = SyntheticCamera(width=width, height=height, fps=1e6)
+    camera.open()
+    camera.enable_recording(filename)
+    for _ in range(frames):
+        camera.grab()
+    camera.disable_recording()
+    camera.close()
+
+
+def export(args):
+    source = tempfile.mkdtemp(prefix='export_')
+    for i in range(args.recordings):
+        _synthetic_recording(f'{source}/{i + 1}.svo', args.frames, args.width, args.height)
+    frames = args.recordings * args.frames
+
+    def quiet(message):
+        pass
+
+    print(f'{"processes":>10} {"seconds":>8} {"frames/s":>10}')
+    for processes in sorted({1, max(1, (os.cpu_count() or 1) // 2), args.processes}):
+        output = f'{source}/export_{processes}'
+        start = time.monotonic()
+        run_export(source, output, format='npy', processes=processes, settle_seconds=0, progress=quiet)
+        elapsed = time.monotonic() - start
+        print(f'{processes:>10} {elapsed:>8.2f} {frames / elapsed:>10.0f}')
+
+    # interrupt an export once the first recording is done, then resume it
+    output = f'{source}/export_resume'
+    done = []
+    interrupted = not run_export(source, output, format='npy', processes=args.processes, settle_seconds=0,
+                                 progress=lambda message: done.append(message[0] == 'done'), stop=lambda: any(done))
+    queued = []
+    run_export(source, output, format='npy', processes=args.processes, settle_seconds=0,
+               progress=lambda message: queued.append(message) if message[0] == 'queued' else None)
+    _, pending, skipped = queued[0]
+    exported = [np.load(output_path(f'{source}/{i + 1}.svo', output, 'npy'), mmap_mode='r')
+                for i in range(args.recordings)]
+    complete = all(len(video) == args.frames for video in exported)
+    partials = [name for name in os.listdir(output) if '.partial' in name]
+    print(f'interrupted: {interrupted}, resumed {len(pending)}, skipped {skipped}, complete: {complete}, '
+          f'partial files left: {len(partials)}')
+
+    # a recording with no frames is marked empty, shown as empty, and skipped next time
+    empty_source = tempfile.mkdtemp(prefix='export_empty_')
+    _synthetic_recording(f'{empty_source}/1.svo', 0, args.width, args.height)
+    progress = ExportProgress()
+    run_export(empty_source, f'{empty_source}/export', format='npy', processes=1, settle_seconds=0,
+               progress=progress.update)
+    queued = []
+    run_export(empty_source, f'{empty_source}/export', format='npy', processes=1, settle_seconds=0,
+               progress=queued.append)
+    empty = progress.files.get(f'{empty_source}/1.svo', '').startswith('empty') and queued[0][2] == 1
+    shutil.rmtree(empty_source)
+    shutil.rmtree(source)
+    print(f'empty recording marked and skipped: {empty}')
+    return 0 if complete and skipped > 0 and not partials and empty else 1
+
+
+def _scan(recording, time):
+    """
+    the frame nearest time, by reading the recording from the start
+    """
+    best, best_distance = None, None
+    with open(recording, 'rb') as f:
+        f.seek(SYNTHETIC_HEADER.size)
+        while True:
+            record = f.read(SYNTHETIC_RECORD.size)
+            if len(record) < SYNTHETIC_RECORD.size:
+                return best
+            frame, timestamp = SYNTHETIC_RECORD.unpack(record)
+            if best_distance is not None and abs(timestamp - time) > best_distance:
+                return best
+            best, best_distance = frame, abs(timestamp - time)
+
+
+def index(args):
+    directory = tempfile.mkdtemp(prefix='index_')
+    recording = f'{directory}/1.svo'
+    period = int(1e9 / args.fps)
+    rng = np.random.default_rng(0)
+    timestamps = np.cumsum(rng.normal(period, period * 0.05, args.frames).astype(np.int64))
+
+    # the recording and its index, written a frame at a time as the recorder does
+    writer = FrameIndexWriter(index_filename(recording), batch=args.batch)
+    elapsed = 0
+    with open(recording, 'wb') as f:
+        f.write(SYNTHETIC_HEADER.pack(b'SYNV', 1, 1, 0, args.fps))
+        for frame, timestamp in enumerate(timestamps.tolist(), 1):
+            f.write(SYNTHETIC_RECORD.pack(frame, timestamp))
+            start = time.perf_counter_ns()
+            writer.append(frame, timestamp, timestamp)
+            elapsed += time.perf_counter_ns() - start
+    writer.close()
+    print(f'{"append_ns_per_frame":>24}: {elapsed / args.frames:.0f}')
+    print(f'{"index_bytes_per_frame":>24}: {(os.path.getsize(index_filename(recording))) / args.frames:.1f}')
+
+    frame_index = FrameIndex(index_filename(recording))
+    queries = rng.integers(timestamps[0], timestamps[-1], args.queries)
+    start = time.perf_counter()
+    frames = frame_index.nearest_frame(queries)
+    elapsed = time.perf_counter() - start
+    print(f'{"index_queries_per_s":>24}: {args.queries / elapsed:.0f}')
+
+    scans = min(args.queries, args.scans)
+    start = time.perf_counter()
+    scanned = [_scan(recording, query) for query in queries[:scans].tolist()]
+    elapsed = time.perf_counter() - start
+    print(f'{"scan_queries_per_s":>24}: {scans / elapsed:.1f}')
+    agree = np.array_equal(frames[:scans], scanned)
+    print(f'{"results_agree":>24}: {agree}')
+    frame_index.close()
+    return 0 if agree else 1
+
+
+def _paced_recording(filename, frames, width, height, fps):
+    """
+    a synthetic recording with frames exactly one period apart, so real time replay has a known rate
+    """
+    period = int(1e9 / fps)
+    with open(filename, 'wb') as f:
+        f.write(SYNTHETIC_HEADER.pack(SYNTHETIC_MAGIC, width, height, 0, fps))
+        for frame in range(1, frames + 1):
+            f.write(SYNTHETIC_RECORD.pack(frame, frame * period))
+
+
+class ReplayApp(UrwidFrontend):
+    def __init__(self, filename, realtime, loop=False, duration=None, screen=None, max_fps=24):
+        """
+        Replays a recording, measuring how quickly the frontend sees each frame, and exits when the replay
+        finishes, or after duration seconds
+        """
+        super().__init__('Replay Benchmark', screen=screen, max_fps=max_fps)
+        shared = {'stats': GrabStats, 'preview': FrameRing}
+        self.add_subprocess('Replay', replay_main, ['Stop Replay'], status=True, shared=shared, preview=True)
+        self.progress = ReplayProgress()
+        self.duration = duration
+        self.latency = []
+        self.frames = 0
+        self.beats = 0
+        self.main.original_widget = self.subprocess_menu['Replay'].menu()
+        self.subprocess['Replay'].fork(filename=filename, realtime=realtime, loop=loop)
+        self.start = time.monotonic()
+        self.cpu = sum(os.times()[:2])
+
+    def heartbeat(self):
+        self.beats += 1
+        replay = self.subprocess['Replay']
+        self.progress = replay.read_pipe(reduce=ReplayProgress.update, initial=self.progress)
+        status = replay.read_status()
+        if status.frames != self.frames:
+            self.latency.append((time.monotonic_ns() - status.timestamp) / 1e6)
+            self.frames = status.frames
+        frame = replay.blocks['preview'].latest()
+        if frame is not None:
+            self.subprocess_menu['Replay'].update_preview(frame)
+        self.subprocess_menu['Replay'].update(self.progress.text() + [f'{self.frames} frames\n'])
+        self.loop.draw_screen()
+
+        if self.duration is not None and time.monotonic() - self.start >= self.duration:
+            replay.stop(wait=False)
+        if self.progress.finished is not None:
+            self.cpu = sum(os.times()[:2]) - self.cpu
+            self.elapsed = time.monotonic() - self.start
+            replay.stop()
+            raise urwid.ExitMainLoop()
+        super().heartbeat()
+
+
+def replay(args):
+    directory = tempfile.mkdtemp(prefix='replay_')
+    recording = f'{directory}/1.svo'
+    _paced_recording(recording, args.frames, args.width, args.height, args.fps)
+    print(f'{"mode":>10} {"frames":>8} {"seconds":>8} {"frames/s":>10} {"latency p50 ms":>15} '
+          f'{"p99 ms":>8} {"beats/s":>8} {"ui cpu %":>9}')
+    rates = {}
+    for mode, realtime, loop, duration in [('realtime', True, False, None), ('max', False, False, None),
+                                           ('loop', False, True, args.duration)]:
+        app = ReplayApp(recording, realtime, loop=loop, duration=duration, screen=headless_screen(),
+                        max_fps=args.ui_fps)
+        app.run()
+        frames, seconds, fps = app.progress.finished
+        rates[mode] = fps
+        print(f'{mode:>10} {frames:>8} {seconds:>8.2f} {fps:>10.1f} {percentile(app.latency, 50):>15.2f} '
+              f'{percentile(app.latency, 99):>8.2f} {app.beats / app.elapsed:>8.1f} '
+              f'{100 * app.cpu / app.elapsed:>9.1f}')
+    paced = abs(rates['realtime'] - args.fps) <= 0.05 * args.fps
+    print(f'real time replay within 5% of {args.fps:.0f} fps: {paced}')
+    return 0 if paced else 1
+
+
+def cpu_seconds(pid):
+    """
+    :return: user + system cpu seconds used by the process (linux only)
+    """
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def profiles(args):
+    available = load_profiles(args.config)
+    names = args.profiles or list(available)
+    print(f'{"profile":>12} {"resolution":>10} {"compression":>13} {"fps":>7} {"dropped":>8} {"failed":>7} '
+          f'{"MB/s":>8} {"cpu %":>6}')
+    failed = False
+    for name in names:
+        profile = available[name]
+        directory = tempfile.mkdtemp(prefix='profiles_', dir=profile.directory)
+        camera = profile_camera(profile) if args.camera == 'zed' else synthetic_camera(profile, args.fps)
+        recorder = SubProcess(partial(start_recording, camera=camera, directory=directory), status=True,
+                              shared={'stats': GrabStats})
+        recorder.fork()
+        time.sleep(args.warmup)
+        start, status, cpu = time.monotonic(), recorder.read_status(), cpu_seconds(recorder.proc.pid)
+        time.sleep(args.duration)
+        end, last = time.monotonic(), recorder.read_status()
+        cpu = cpu_seconds(recorder.proc.pid) - cpu if recorder.is_alive() else 0.0
+        summary = recorder.blocks['stats'].summary()
+        recorder.stop()
+        recorder.close()
+        if not args.keep:
+            shutil.rmtree(directory)
+
+        seconds = end - start
+        failed = failed or last.frames == status.frames
+        print(f'{name:>12} {profile.resolution:>10} {profile.compression:>13} '
+              f'{(last.frames - status.frames) / seconds:>7.1f} {summary["dropped"]:>8} {summary["failed"]:>7} '
+              f'{(last.bytes_written - status.bytes_written) / seconds / 1e6:>8.1f} {100 * cpu / seconds:>6.1f}')
+    return 1 if failed else 0
+
+
+def _serve(path, profile):
+    with open(os.devnull, 'w') as log:
+        asyncio.run(ControlDaemon(path, profiles={profile.name: profile}, profile=profile.name, synthetic=True,
+                                  log=log).serve())
+
+
+async def _query(path, queries):
+    """
+    :return: list of status query round trip times in ms
+    """
+    reader, writer = await asyncio.open_unix_connection(path)
+    latency = []
+    for i in range(queries):
+        start = time.perf_counter()
+        writer.write(json.dumps({'id': i, 'cmd': 'status'}).encode() + b'\n')
+        await reader.readline()
+        latency.append((time.perf_counter() - start) * 1e3)
+    writer.close()
+    return latency
+
+
+async def _subscribe(path, fps, stop, received):
+    """
+    counts the telemetry events received until stop is set, and the lag of each from the recorder publishing it
+    """
+    reader, writer = await asyncio.open_unix_connection(path)
+    writer.write(json.dumps({'cmd': 'subscribe', 'fps': fps}).encode() + b'\n')
+    while not stop.is_set():
+        try:
+            line = await asyncio.wait_for(reader.readline(), 0.5)
+        except asyncio.TimeoutError:
+            continue
+        message = json.loads(line)
+        if message.get('event') == 'telemetry' and message['published'] > 0:
+            received.append((time.monotonic_ns() - message['published']) / 1e6)
+    writer.close()
+
+
+async def _load(path, clients, fps, queries, warmup):
+    stop = asyncio.Event()
+    received = [[] for _ in range(clients)]
+    subscribers = [asyncio.ensure_future(_subscribe(path, fps, stop, events)) for events in received]
+    await asyncio.sleep(warmup)
+    for events in received:
+        events.clear()
+    start = time.monotonic()
+    latency = await _query(path, queries)
+    elapsed = time.monotonic() - start
+    counts = [len(events) for events in received]
+    stop.set()
+    await asyncio.gather(*subscribers)
+    return latency, counts, received, elapsed
+
+
+def control(args):
+    directory = tempfile.mkdtemp(prefix='control_')
+    path = f'{directory}/control.sock'
+    profile = Profile('bench', 'VGA', args.fps, 'H264', directory)
+    daemon = Process(target=_serve, args=(path, profile))
+    daemon.start()
+    while not os.path.exists(path):
+        time.sleep(0.05)
+    client = ControlClient(path)
+    client.request('start')
+    time.sleep(1.0)
+
+    print(f'{"subscribers":>12} {"query p50 ms":>13} {"p99 ms":>8} {"max ms":>8} {"queries/s":>10} '
+          f'{"events/s each":>14} {"lag p50 ms":>11} {"lag p99 ms":>11}')
+    for clients in sorted({0, args.clients}):
+        load = _load(path, clients, args.telemetry_fps, args.queries, args.warmup)
+        latency, counts, received, elapsed = asyncio.run(load)
+        lags = [lag for events in received for lag in events]
+        rate = sum(counts) / max(clients, 1) / elapsed
+        print(f'{clients:>12} {percentile(latency, 50):>13.2f} {percentile(latency, 99):>8.2f} {max(latency):>8.2f} '
+              f'{args.queries / elapsed:>10.0f} {rate:>14.1f} {percentile(lags, 50):>11.2f} '
+              f'{percentile(lags, 99):>11.2f}')
+
+    # malformed requests are answered with an error, and the connection keeps working
+    rejected = [not client.request('subscribe', fps='fast')['ok'], not client.request('start', profile=[1])['ok']]
+    client.socket.sendall(b'[1, 2]\n')
+    rejected += [not client.receive()['ok'], client.request('ping')['ok']]
+    print(f'malformed requests rejected: {all(rejected)}')
+
+    stopped = client.request('stop')
+    client.close()
+    daemon.terminate()
+    daemon.join()
+    shutil.rmtree(directory)
+    return 0 if stopped['ok'] and all(rejected) else 1
+
+
+def metrics(args):
+    directory = tempfile.mkdtemp(prefix='metrics_')
+    cameras = [f'Camera {i}' for i in range(args.cameras)]
+    recorders = {camera: SubProcess(partial(start_recording, camera=SyntheticCamera(fps=args.fps),
+                                            directory=directory), status=True, shared={'stats': GrabStats})
+                 for camera in cameras}
+    for recorder in recorders.values():
+        recorder.fork()
+    recorder_metrics = RecorderMetrics()
+    server = MetricsServer(recorder_metrics.registry, 0)
+    url = f'http://127.0.0.1:{server.port}/metrics'
+    textfile = f'{directory}/recorder.prom'
+
+    updates, renders, scrapes, writes = [], [], [], []
+    went_backwards, restarted, size = False, False, 0
+    start = time.monotonic()
+    next_scrape = start
+    while time.monotonic() - start < args.duration:
+        time.sleep(1 / args.ui_fps)
+        now = time.monotonic()
+        if not restarted and now - start >= args.duration / 2:
+            # a stalled recorder being replaced, its counters in shared memory start over from zero
+            recorders[cameras[0]].kill()
+            recorders[cameras[0]].fork()
+            restarted = True
+        before = dict(recorder_metrics.frames.samples)
+        begin = time.perf_counter()
+        for camera, recorder in recorders.items():
+            recorder_metrics.update(camera, recorder, now)
+        updates.append((time.perf_counter() - begin) * 1e6)
+        went_backwards = went_backwards or any(recorder_metrics.frames.samples[key] < frames
+                                               for key, frames in before.items())
+        if now >= next_scrape:
+            next_scrape = now + 1 / args.scrape_hz
+            begin = time.perf_counter()
+            recorder_metrics.registry.render()
+            renders.append((time.perf_counter() - begin) * 1e3)
+            begin = time.perf_counter()
+            with urllib.request.urlopen(url) as response:
+                size = len(response.read())
+            scrapes.append((time.perf_counter() - begin) * 1e3)
+            begin = time.perf_counter()
+            recorder_metrics.registry.write_textfile(textfile)
+            writes.append((time.perf_counter() - begin) * 1e3)
+
+    for recorder in recorders.values():
+        recorder.stop()
+    for camera, recorder in recorders.items():
+        recorder_metrics.update(camera, recorder)
+    frames = sum(recorder_metrics.frames.samples.values())
+    server.close()
+    for recorder in recorders.values():
+        recorder.close()
+    shutil.rmtree(directory)
+
+    print(f'{"cameras":>24}: {args.cameras}')
+    print(f'{"update_us_p50/p99/max":>24}: {percentile(updates, 50):.0f} / {percentile(updates, 99):.0f} / '
+          f'{max(updates):.0f} (all cameras)')
+    print(f'{"render_ms_p50/p99":>24}: {percentile(renders, 50):.2f} / {percentile(renders, 99):.2f}')
+    print(f'{"scrape_ms_p50/p99":>24}: {percentile(scrapes, 50):.2f} / {percentile(scrapes, 99):.2f}')
+    print(f'{"textfile_ms_p50/p99":>24}: {percentile(writes, 50):.2f} / {percentile(writes, 99):.2f}')
+    print(f'{"exposition_bytes":>24}: {size}')
+    print(f'{"frames_total":>24}: {frames}')
+    print(f'{"counters_monotonic":>24}: {not went_backwards}')
+    return 1 if went_backwards else 0
+
+
+def dashcam(args):
+    print(f'{"ring":>6} {"events":>7} {"pre s":>6} {"flush ms p50":>13} {"max":>7} {"ring MB":>8} {"rss MB":>7} '
+          f'{"interval p99 ms":>16} {"kept MB":>8} {"continuous MB":>14} {"saved %":>8}')
+    for ring in ('tmpfs', 'disk'):
+        directory = tempfile.mkdtemp(prefix='dashcam_')
+        camera = SyntheticCamera(fps=args.fps, payload_bytes=args.payload_bytes)
+        recorder = SubProcess(partial(start_recording, camera=camera, directory=directory), status=True,
+                              shared={'stats': GrabStats})
+        recorder.fork(pre_seconds=args.pre_seconds, post_seconds=args.post_seconds,
+                      ring_directory=None if ring == 'tmpfs' else f'{directory}/.ring')
+        progress, rss = DashcamProgress(), 0
+        start = time.monotonic()
+        next_trigger = start + args.pre_seconds + args.trigger_every / 2
+        while time.monotonic() - start < args.duration:
+            time.sleep(0.05)
+            progress = recorder.read_pipe(reduce=DashcamProgress.update, initial=progress)
+            if time.monotonic() >= next_trigger:
+                next_trigger += args.trigger_every
+                recorder.write_pipe(('trigger', time.monotonic_ns()))
+            rss = max(rss, proc_stats(recorder.proc.pid)[0])
+        recorder.stop()
+        progress = recorder.read_pipe(reduce=DashcamProgress.update, initial=progress)
+        status, summary = recorder.read_status(), recorder.blocks['stats'].summary()
+        recorder.close()
+        shutil.rmtree(directory)
+
+        latencies = [event[4] for event in progress.events]
+        windows = [event[3] for event in progress.events]
+        kept = sum(event[5] or 0 for event in progress.events)
+        continuous = status.frames * (SYNTHETIC_RECORD.size + args.payload_bytes) + SYNTHETIC_HEADER.size
+        print(f'{ring:>6} {len(progress.events):>7} {sum(windows) / max(len(windows), 1):>6.2f} '
+              f'{percentile(latencies, 50):>13.2f} {max(latencies, default=0):>7.2f} {progress.peak_bytes / 1e6:>8.1f} '
+              f'{rss / 1e3:>7.1f} {summary["interval_p99_ms"]:>16.1f} {kept / 1e6:>8.1f} {continuous / 1e6:>14.1f} '
+              f'{100 * (1 - kept / continuous):>8.1f}')
+    return 0
+
+
+def motion(args):
+    period = args.duration / args.episodes
+    ranges = [(int((i + 0.5) * period * args.fps), int(((i + 0.5) * period + args.motion_seconds) * args.fps))
+              for i in range(args.episodes)]
+    print(f'{"mode":>10} {"fps":>6} {"interval p99 ms":>16} {"episodes":>9} {"recorded %":>11} {"saved %":>8} '
+          f'{"stride":>7} {"cost ms":>8} {"max":>7}')
+    for mode in ('motion', 'continuous'):
+        directory = tempfile.mkdtemp(prefix='motion_')
+        camera = SyntheticCamera(fps=args.fps, payload_bytes=args.payload_bytes, motion=ranges)
+        detector = MotionDetector(roi=(0.0, 1 / 3, 1.0, 2 / 3), on_threshold=args.threshold,
+                                  off_threshold=args.threshold / 4, stride=args.stride)
+        recorder = SubProcess(partial(start_recording, camera=camera, directory=directory), status=True,
+                              shared={'stats': GrabStats})
+        if mode == 'motion':
+            recorder.fork(post_seconds=args.post_seconds, motion=detector)
+        else:
+            recorder.fork()
+        progress = DashcamProgress()
+        start = time.monotonic()
+        while time.monotonic() - start < args.duration:
+            time.sleep(0.05)
+            progress = recorder.read_pipe(reduce=DashcamProgress.update, initial=progress)
+        recorder.stop()
+        elapsed = time.monotonic() - start
+        progress = recorder.read_pipe(reduce=DashcamProgress.update, initial=progress)
+        status, summary = recorder.read_status(), recorder.blocks['stats'].summary()
+        recorder.close()
+        shutil.rmtree(directory)
+
+        found = progress.motion or {'episodes': 0, 'recorded_fraction': 1.0, 'storage_saved': 0.0, 'stride': 0,
+                                    'cost_mean_ms': 0.0, 'cost_max_ms': 0.0}
+        print(f'{mode:>10} {status.frames / elapsed:>6.1f} {summary["interval_p99_ms"]:>16.1f} '
+              f'{found["episodes"]:>9} {100 * found["recorded_fraction"]:>11.1f} {100 * found["storage_saved"]:>8.1f} '
+              f'{found["stride"]:>7} {found["cost_mean_ms"]:>8.3f} {found["cost_max_ms"]:>7.3f}')
+    return 0
+
+
+def _spin(stop_process):
+    while not stop_process.is_set():
+        sum(range(10000))
+
+
+def jitter_benchmark(args):
+    cpu = max(os.sched_getaffinity(0)) if args.cpu is None else args.cpu
+    busy = len(os.sched_getaffinity(0)) if args.load is None else args.load
+    modes = [('default', None), ('pinned', Scheduling(cpus={cpu})),
+             ('pinned nice', Scheduling(cpus={cpu}, nice=args.nice)),
+             ('pinned fifo', Scheduling(cpus={cpu}, fifo=args.fifo))]
+    directory = tempfile.mkdtemp(prefix='jitter_')
+    print(f'{"mode":>12} {"scheduling":<40} {"not permitted":>14} {"frames":>7} {"dropped":>8} {"p50":>6} '
+          f'{"p90":>6} {"p99":>6} {"p99.9":>6} {"max ms":>7}')
+    for mode, scheduling in modes:
+        stop_load = Event()
+        load = [Process(target=_spin, args=(stop_load,)) for _ in range(busy)]
+        for process in load:
+            process.start()
+        recorder = SubProcess(partial(start_recording, camera=SyntheticCamera(fps=args.fps), directory=directory),
+                              status=True, shared={'stats': GrabStats})
+        recorder.fork(scheduling=scheduling)
+        time.sleep(args.duration)
+        settings = recorder.read_scheduling()
+        missing = scheduling.check(settings) if scheduling is not None and settings is not None else []
+        recorder.stop()
+        stop_load.set()
+        for process in load:
+            process.join()
+        recorder.close()
+
+        with open(max(glob.glob(f'{directory}/*.stats.json'), key=os.path.getmtime)) as f:
+            pooled = jitter([json.load(f)])
+        print(f'{mode:>12} {describe(settings):<40} {",".join(missing) or "-":>14} {pooled["frames"]:>7} '
+              f'{pooled["dropped"]:>8} {pooled["p50_ms"]:>6.1f} {pooled["p90_ms"]:>6.1f} {pooled["p99_ms"]:>6.1f} '
+              f'{pooled["p999_ms"]:>6.1f} {pooled["max_ms"]:>7.1f}')
+    print()
+    print(''.join(jitter_report(directory)), end='')
+    shutil.rmtree(directory)
+    return 0
+
+
+def segments(args):
+    directory = tempfile.mkdtemp(prefix='segments_')
+    recorder = SubProcess(partial(start_recording, camera=SyntheticCamera(fps=args.fps), directory=directory,
+                                  segment_seconds=args.segment_seconds), status=True)
+    recorder.fork()
+    time.sleep(args.duration)
+    recorder.stop()
+    recorder.close()
+    with open(glob.glob(f'{directory}/*.manifest.json')[0]) as f:
+        recorded = json.load(f)['segments']
+    shutil.rmtree(directory)
+
+    interval = 1e3 / args.fps
+    gaps = [segment['gap_ns'] / 1e6 for segment in recorded if segment['gap_ns'] is not None]
+    lost = [max(0, round(gap / interval) - 1) for gap in gaps]
+    print(f'{"segments":>24}: {len(recorded)}')
+    print(f'{"frame_interval_ms":>24}: {interval:.2f}')
+    print(f'{"gap_ms_p50/max":>24}: {percentile(gaps, 50):.2f} / {max(gaps, default=0):.2f}')
+    print(f'{"frames_lost_total/max":>24}: {sum(lost)} / {max(lost, default=0)}')
+    return 0 if gaps else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='recorder benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_soak = commands.add_parser('soak', help='throughput and resource soak test of the recording path')
+    parser_soak.add_argument('--duration', type=float, default=60.0, help='seconds to run for')
+    parser_soak.add_argument('--warmup', type=float, default=5.0, help='seconds before measurement starts')
+    parser_soak.add_argument('--sample_interval', type=float, default=10.0, help='seconds between resource samples')
+    parser_soak.add_argument('--width', type=int, default=1280)
+    parser_soak.add_argument('--height', type=int, default=720)
+    parser_soak.add_argument('--fps', type=float, default=60.0)
+    parser_soak.add_argument('--jitter', type=float, default=0.0, help='frame interval std dev as fraction of period')
+    parser_soak.add_argument('--fail_rate', type=float, default=0.0, help='probability of an injected grab failure')
+    parser_soak.add_argument('--ui_fps', type=float, default=24.0, help='maximum heartbeat rate of the frontend')
+    parser_soak.add_argument('--preview', action='store_true', help='write and render preview frames')
+    parser_soak.add_argument('--payload_bytes', type=int, default=0, help='bytes written per frame')
+    parser_soak.add_argument('--directory', default=None, help='where to write recordings, defaults to a temp dir')
+    parser_soak.add_argument('--min_fps', type=float, default=None, help='exit non zero below this frame rate')
+    parser_soak.add_argument('--tui', action='store_true', help='draw to the terminal instead of headless')
+    parser_soak.add_argument('--asyncio', action='store_true', help='run the frontend on an asyncio event loop')
+    parser_soak.set_defaults(func=soak)
+
+    parser_run_id = commands.add_parser('run_id', help='stress test the run id allocator from parallel processes')
+    parser_run_id.add_argument('--processes', type=int, default=16)
+    parser_run_id.add_argument('--ids', type=int, default=500, help='ids to allocate per process')
+    parser_run_id.add_argument('--corrupt', action='store_true', help='empty the state file half way through')
+    parser_run_id.add_argument('--directory', default=None, help='directory to allocate in, defaults to a temp dir')
+    parser_run_id.set_defaults(func=run_id)
+
+    parser_ipc = commands.add_parser('ipc', help='compare subprocess to frontend message transports')
+    parser_ipc.add_argument('--messages', type=int, default=200000, help='messages to send over each transport')
+    parser_ipc.add_argument('--rate', type=float, default=0, help='messages/s to send at, 0 for as fast as possible')
+    parser_ipc.add_argument('--batch', type=int, default=64, help='messages per write for batched struct framing')
+    parser_ipc.add_argument('--capacity', type=int, default=4096, help='messages held by the shared memory ring')
+    parser_ipc.set_defaults(func=ipc)
+
+    parser_backlog = commands.add_parser('backlog', help='time UI ticks reading a flooded subprocess pipe')
+    parser_backlog.add_argument('--duration', type=float, default=5.0, help='seconds to run each mode for')
+    parser_backlog.add_argument('--ui_fps', type=float, default=24.0, help='ticks per second')
+    parser_backlog.add_argument('--budget', type=float, default=2.0, help='ms each budgeted tick may spend reading')
+    parser_backlog.set_defaults(func=backlog)
+
+    parser_watchdog = commands.add_parser('watchdog', help='restart a recorder whose camera hangs')
+    parser_watchdog.add_argument('--duration', type=float, default=10.0, help='seconds to run for')
+    parser_watchdog.add_argument('--fps', type=float, default=60.0)
+    parser_watchdog.add_argument('--hang_after', type=int, default=120, help='frames before each grab hangs')
+    parser_watchdog.add_argument('--stall_seconds', type=float, default=1.0, help='seconds without frames to restart')
+    parser_watchdog.add_argument('--ui_fps', type=float, default=24.0, help='watchdog checks per second')
+    parser_watchdog.add_argument('--directory', default=None, help='where to write recordings, defaults to a temp dir')
+    parser_watchdog.set_defaults(func=watchdog)
+
+    parser_stop = commands.add_parser('stop', help='time the phases of stopping recorders without blocking the UI')
+    parser_stop.add_argument('--interrupt_seconds', type=float, default=1.0, help='seconds before SIGINT')
+    parser_stop.add_argument('--kill_seconds', type=float, default=1.0, help='seconds after SIGINT before SIGKILL')
+    parser_stop.add_argument('--directory', default=None, help='where to write recordings, defaults to a temp dir')
+    parser_stop.set_defaults(func=stop)
+
+    parser_export = commands.add_parser('export', help='export synthetic recordings in a process pool')
+    parser_export.add_argument('--recordings', type=int, default=8)
+    parser_export.add_argument('--frames', type=int, default=300, help='frames per recording')
+    parser_export.add_argument('--width', type=int, default=640)
+    parser_export.add_argument('--height', type=int, default=360)
+    parser_export.add_argument('--processes', type=int, default=4, help='largest pool to export with')
+    parser_export.set_defaults(func=export)
+
+    parser_index = commands.add_parser('index', help='frame index append cost and lookup speed')
+    parser_index.add_argument('--frames', type=int, default=1000000, help='frames in the recording')
+    parser_index.add_argument('--fps', type=float, default=60.0)
+    parser_index.add_argument('--batch', type=int, default=256, help='frames per write to the index')
+    parser_index.add_argument('--queries', type=int, default=100000, help='nearest frame lookups in the index')
+    parser_index.add_argument('--scans', type=int, default=20, help='nearest frame lookups by scanning the recording')
+    parser_index.set_defaults(func=index)
+
+    parser_replay = commands.add_parser('replay', help='replay a synthetic recording in real time and at max speed')
+    parser_replay.add_argument('--frames', type=int, default=600, help='frames in the recording')
+    parser_replay.add_argument('--fps', type=float, default=60.0, help='frame rate the recording was made at')
+    parser_replay.add_argument('--width', type=int, default=1280)
+    parser_replay.add_argument('--height', type=int, default=720)
+    parser_replay.add_argument('--duration', type=float, default=5.0, help='seconds to loop the recording for')
+    parser_replay.add_argument('--ui_fps', type=float, default=24.0, help='maximum heartbeat rate of the frontend')
+    parser_replay.set_defaults(func=replay)
+
+    parser_profiles = commands.add_parser('profiles', help='frame rate, drops, bytes/s and cpu of each profile')
+    parser_profiles.add_argument('--profiles', nargs='+', default=None, help='profiles to run, defaults to all')
+    parser_profiles.add_argument('--config', default=PROFILES_FILE, help='JSON file of recording profiles')
+    parser_profiles.add_argument('--camera', choices=['synthetic', 'zed'], default='synthetic')
+    parser_profiles.add_argument('--duration', type=float, default=10.0, help='seconds to record each profile for')
+    parser_profiles.add_argument('--warmup', type=float, default=2.0, help='seconds before measurement starts')
+    parser_profiles.add_argument('--fps', type=float, default=30.0,
+                                 help='synthetic frame rate of profiles that use the camera default')
+    parser_profiles.add_argument('--keep', action='store_true', help='keep the recordings')
+    parser_profiles.set_defaults(func=profiles)
+
+    parser_control = commands.add_parser('control', help='status query latency with many telemetry subscribers')
+    parser_control.add_argument('--clients', type=int, default=48, help='clients subscribed to telemetry')
+    parser_control.add_argument('--queries', type=int, default=2000, help='status queries to time')
+    parser_control.add_argument('--fps', type=float, default=60.0, help='frame rate of the synthetic camera')
+    parser_control.add_argument('--telemetry_fps', type=float, default=24.0, help='telemetry rate each client asks for')
+    parser_control.add_argument('--warmup', type=float, default=1.0, help='seconds between subscribing and timing')
+    parser_control.set_defaults(func=control)
+
+    parser_metrics = commands.add_parser('metrics', help='cost of updating, scraping and writing recorder metrics')
+    parser_metrics.add_argument('--cameras', type=int, default=4, help='synthetic recorders to take metrics of')
+    parser_metrics.add_argument('--duration', type=float, default=10.0, help='seconds to run for')
+    parser_metrics.add_argument('--fps', type=float, default=60.0, help='frame rate of each synthetic camera')
+    parser_metrics.add_argument('--ui_fps', type=float, default=24.0, help='metrics updates per second')
+    parser_metrics.add_argument('--scrape_hz', type=float, default=4.0, help='scrapes and textfile writes per second')
+    parser_metrics.set_defaults(func=metrics)
+
+    parser_dashcam = commands.add_parser('dashcam', help='ring size, memory and flush latency of dashcam mode')
+    parser_dashcam.add_argument('--pre_seconds', type=float, default=5.0, help='seconds kept before a trigger')
+    parser_dashcam.add_argument('--post_seconds', type=float, default=2.0, help='seconds recorded after a trigger')
+    parser_dashcam.add_argument('--trigger_every', type=float, default=10.0, help='seconds between triggers')
+    parser_dashcam.add_argument('--duration', type=float, default=30.0, help='seconds to record each ring for')
+    parser_dashcam.add_argument('--fps', type=float, default=60.0)
+    parser_dashcam.add_argument('--payload_bytes', type=int, default=40000,
+                                help='bytes written per frame, about a 720p H264 frame')
+    parser_dashcam.set_defaults(func=dashcam)
+
+    parser_motion = commands.add_parser('motion', help='fraction recorded, storage saved and cost of motion triggering')
+    parser_motion.add_argument('--episodes', type=int, default=3, help='times the synthetic scene moves')
+    parser_motion.add_argument('--motion_seconds', type=float, default=2.0, help='seconds each episode lasts')
+    parser_motion.add_argument('--duration', type=float, default=30.0, help='seconds to record each mode for')
+    parser_motion.add_argument('--post_seconds', type=float, default=2.0, help='seconds recorded after motion stops')
+    parser_motion.add_argument('--threshold', type=float, default=0.01, help='fraction of pixels changed for motion')
+    parser_motion.add_argument('--stride', type=int, default=2, help='frames grabbed per frame looked at')
+    parser_motion.add_argument('--fps', type=float, default=60.0)
+    parser_motion.add_argument('--payload_bytes', type=int, default=40000,
+                               help='bytes written per frame, about a 720p H264 frame')
+    parser_motion.set_defaults(func=motion)
+
+    parser_jitter = commands.add_parser('jitter', help='frame interval jitter with and without pinning and priority')
+    parser_jitter.add_argument('--load', type=int, default=None, help='busy processes competing, defaults to the cpus')
+    parser_jitter.add_argument('--duration', type=float, default=20.0, help='seconds to record each mode for')
+    parser_jitter.add_argument('--cpu', type=int, default=None, help='cpu to pin the recorder to, defaults to the last')
+    parser_jitter.add_argument('--nice', type=int, default=-10, help='nice level of the nice mode')
+    parser_jitter.add_argument('--fifo', type=int, default=50, help='SCHED_FIFO priority of the fifo mode')
+    parser_jitter.add_argument('--fps', type=float, default=60.0)
+    parser_jitter.set_defaults(func=jitter_benchmark)
+
+    parser_segments = commands.add_parser('segments', help='camera time gap and frames lost across segment rollovers')
+    parser_segments.add_argument('--segment_seconds', type=float, default=2.0, help='seconds of each segment')
+    parser_segments.add_argument('--duration', type=float, default=20.0, help='seconds to record for')
+    parser_segments.add_argument('--fps', type=float, default=60.0)
+    parser_segments.set_defaults(func=segments)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
@@ -0,0 +1,272 @@
+import os
+import time
+import random
+import struct
+import numpy as np
+
+
+SUCCESS = 0
+
+# synthetic recording file layout: a header, then one record (plus optional payload) per grabbed frame
+SYNTHETIC_MAGIC = b'SYNV'
+SYNTHETIC_HEADER = struct.Struct('<4sIIIf')    # magic, width, height, payload_bytes, fps
+SYNTHETIC_RECORD = struct.Struct('<Qq')        # frame number, camera timestamp (ns)
+
+
+def synthetic_pattern(width, height):
+    """
+    :return: a BGRA colour gradient twice the frame width, synthetic frames are windows into it that scroll
+        one pixel per frame
+    """
+    x = np.arange(2 * width) % width * 255 // max(width - 1, 1)
+    y = np.arange(height)[:, None] * 255 // max(height - 1, 1)
+    pattern = np.empty((height, 2 * width, 4), dtype=np.uint8)
+    pattern[:, :, 0] = x
+    pattern[:, :, 1] = y
+    pattern[:, :, 2] = 255 - x
+    pattern[:, :, 3] = 255
+    return pattern
+
+
+def synthetic_image(pattern, frame):
+    """
+    :param pattern: from synthetic_pattern
+    :param frame: frame number
+    :return: (H, W, 4) BGRA view of the synthetic frame
+    """
+    width = pattern.shape[1] // 2
+    offset = frame % width
+    return pattern[:, offset:offset + width]
+
+
+class CameraBackend:
+    """
+    Frame source used by start_recording
+
+    All methods returning an error code return SUCCESS (0) when the call worked,
+    any other integer is a backend specific error code
+    """
+    def open(self):
+        raise NotImplementedError
+
+    def enable_recording(self, filename):
+        raise NotImplementedError
+
+    def grab(self):
+        raise NotImplementedError
+
+    def timestamp(self):
+        """
+        :return: camera timestamp of the last grabbed frame in nanoseconds
+        """
+        raise NotImplementedError
+
+    def fps(self):
+        """
+        :return: frame rate the camera is running at, or 0 if unknown
+        """
+        return 0
+
+    def retrieve_image(self):
+        """
+        :return: (H, W, 4) uint8 BGRA image of the last grabbed frame, only valid until the next grab
+        """
+        raise NotImplementedError
+
+    def bytes_written(self):
+        """
+        :return: size of the recording on disk in bytes, this may make a syscall, so don't call it every frame
+        """
+        try:
+            return os.path.getsize(self.filename)
+        except (AttributeError, OSError):
+            return 0
+
+    def disable_recording(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ZedCamera(CameraBackend):
+    def __init__(self, serial=None, resolution='HD720', fps=0, compression='H264'):
+        """
+        Stereolabs ZED camera, pyzed.sl is imported when the camera is opened, so this
+        class can be constructed on machines without the SDK
+        :param serial: serial number of the camera to open, if None the first camera found is opened
+        :param resolution: name of a sl.RESOLUTION, eg: HD720
+        :param fps: frame rate to run the camera at, 0 for the default of the resolution
+        :param compression: name of a sl.SVO_COMPRESSION_MODE to record with, eg: H264
+        """
+        self.serial = serial
+        self.resolution = resolution
+        self.frame_rate = fps
+        self.compression = compression
+        self.sl = None
+        self.cam = None
+        self.runtime = None
+        self.image = None
+
+    def _code(self, err):
+        return SUCCESS if err == self.sl.ERROR_CODE.SUCCESS else err.value
+
+    def open(self):
+        import pyzed.sl as sl
+        self.sl = sl
+        self.cam = sl.Camera()
+
+        init = sl.InitParameters()
+        init.camera_resolution = getattr(sl.RESOLUTION, self.resolution)
+        init.camera_fps = self.frame_rate
+        init.depth_mode = sl.DEPTH_MODE.NONE
+        if self.serial is not None:
+            init.set_from_serial_number(int(self.serial))
+        self.runtime = sl.RuntimeParameters()
+        self.image = sl.Mat()
+        return self._code(self.cam.open(init))
+
+    def enable_recording(self, filename):
+        self.filename = filename
+        compression = getattr(self.sl.SVO_COMPRESSION_MODE, self.compression)
+        recording_param = self.sl.RecordingParameters(filename, compression)
+        return self._code(self.cam.enable_recording(recording_param))
+
+    def grab(self):
+        return self._code(self.cam.grab(self.runtime))
+
+    def timestamp(self):
+        return self.cam.get_timestamp(self.sl.TIME_REFERENCE.IMAGE).get_nanoseconds()
+
+    def fps(self):
+        return self.cam.get_camera_information().camera_configuration.fps
+
+    def retrieve_image(self):
+        self.cam.retrieve_image(self.image, self.sl.VIEW.LEFT)
+        return self.image.get_data()
+
+    def disable_recording(self):
+        if self.cam is not None:
+            self.cam.disable_recording()
+
+    def close(self):
+        if self.cam is not None:
+            self.cam.close()
+
+
+class SyntheticCamera(CameraBackend):
+    def __init__(self, width=1280, height=720, fps=60, jitter=0.0, fail_rate=0.0, fail_code=1,
+                 payload_bytes=0, seed=None, hang_after=None, motion=None):
+        """
+        Camera that generates frames on a clock, for running the recorder without ZED hardware
+        :param width: frame width in pixels
+        :param height: frame height in pixels
+        :param fps: frames per second the camera is paced at
+        :param jitter: standard deviation of the frame interval as a fraction of the frame period
+        :param fail_rate: probability that a grab returns fail_code instead of SUCCESS
+        :param fail_code: error code returned by an injected grab failure
+        :param payload_bytes: bytes written to the recording per frame, to emulate the disk load of a real encoder
+        :param seed: seed for the jitter and failure injection
+        :param hang_after: if set, grab never returns after this many frames, like a camera lost on the USB bus
+        :param motion: list of (first, last) frame ranges, if set the image is a still scene, with a square that only
+            moves during those frames, for testing motion detection, see motion.py
+        """
+        self.width = width
+        self.height = height
+        self.frame_rate = fps
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.fail_code = fail_code
+        self.payload_bytes = payload_bytes
+        self.seed = seed
+        self.hang_after = hang_after
+        self.motion = motion
+        self.scene = 0  # frames the scene has moved for
+        self.image = None
+        self.square = None
+        self.period = 1.0 / fps
+        self.deadline = None
+        self.frame = 0
+        self.last_timestamp = 0
+        self.file = None
+        self.payload = b''
+        self.written = 0
+        self.pattern = None
+
+    def open(self):
+        self.rng = random.Random(self.seed)
+        self.deadline = time.monotonic()
+
+        self.pattern = synthetic_pattern(self.width, self.height)
+        return SUCCESS
+
+    def enable_recording(self, filename):
+        try:
+            self.file = open(filename, 'wb')
+        except OSError as e:
+            return e.errno
+        self.file.write(SYNTHETIC_HEADER.pack(SYNTHETIC_MAGIC, self.width, self.height, self.payload_bytes,
+                                            self.frame_rate))
+        self.payload = bytes(self.payload_bytes)
+        self.written = SYNTHETIC_HEADER.size
+        return SUCCESS
+
+    def grab(self):
+        if self.hang_after is not None and self.frame >= self.hang_after:
+            while True:
+                time.sleep(1.0)
+
+        interval = self.period
+        if self.jitter > 0:
+            interval = max(0.0, self.rng.gauss(self.period, self.jitter * self.period))
+        self.deadline += interval
+
+        delay = self.deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # we fell behind, like a real camera we don't try to catch up on frames we missed
+            self.deadline = time.monotonic()
+
+        if self.fail_rate > 0 and self.rng.random() < self.fail_rate:
+            return self.fail_code
+
+        self.frame += 1
+        if self.motion is not None and any(first <= self.frame <= last for first, last in self.motion):
+            self.scene += 1
+        self.last_timestamp = time.monotonic_ns()
+        if self.file is not None:
+            self.file.write(SYNTHETIC_RECORD.pack(self.frame, self.last_timestamp))
+            self.file.write(self.payload)
+            self.written += SYNTHETIC_RECORD.size + self.payload_bytes
+        return SUCCESS
+
+    def timestamp(self):
+        return self.last_timestamp
+
+    def fps(self):
+        return self.frame_rate
+
+    def retrieve_image(self):
+        if self.motion is None:
+            return synthetic_image(self.pattern, self.frame)
+        # only the square is redrawn, so a frame costs about the same as the scrolling view
+        still = synthetic_image(self.pattern, 0)
+        if self.image is None:
+            self.image = still.copy()
+        size = self.height // 3
+        if self.square is not None:
+            self.image[:, self.square:self.square + size] = still[:, self.square:self.square + size]
+        self.square = self.scene * 8 % (self.width - size)
+        top = (self.height - size) // 2
+        self.image[top:top + size, self.square:self.square + size] = 255 - still[top:top + size,
+                                                                               self.square:self.square + size]
+        return self.image
+
+    def bytes_written(self):
+        return self.written
+
+    def disable_recording(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
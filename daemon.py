@@ -0,0 +1,541 @@
+"""
+Control daemon, owns the recorders and serves start, stop, status and live telemetry over a Unix domain socket
+
+    python daemon.py serve --profile hd720
+    python daemon.py start --profile hd1080
+    python daemon.py status
+    python daemon.py watch
+    python daemon.py stop
+
+The protocol is one JSON object per line in each direction.  A request names a command and may carry an id, which
+is echoed in its response, eg:
+
+    > {"id": 1, "cmd": "status"}
+    < {"id": 1, "ok": true, "status": {"recording": true, "run_id": 12, "cameras": {...}, ...}}
+
+commands are
+    ping
+    profiles                        names of the profiles start can record with
+    status                          the recording state and the latest frame counts of each camera
+    start {"profile": name}         starts recording under a new run id, responds with the run id
+    stop                            responds once every recorder has stopped, with how long each took
+    trigger                         in dashcam mode, keeps the seconds before now and records an event, see dashcam.py
+    subscribe {"fps": 10}           streams telemetry events at up to fps, and started / stopped events
+    unsubscribe
+
+failures respond with {"ok": false, "error": "..."}.  Events pushed to subscribers have an "event" key instead of
+an id, telemetry is {"event": "telemetry", "run_id": 12, "frames": [...], "bytes": [...], "published": ns} with
+one entry per camera, where published is the time.monotonic_ns() of the newest status in it.  In dashcam mode,
+flushed and event_closed events are pushed as each camera's events are kept, see headless.HeadlessRecorder.read_dashcam,
+and SIGUSR1 triggers like the trigger command.
+
+The daemon is event driven, recorders exiting are noticed from their process sentinels, and the status blocks are
+read once per telemetry tick for every subscriber, only while someone is subscribed.  A subscriber that doesn't
+read its socket misses telemetry rather than growing the daemon's write buffer.
+
+The urwid and asyncio frontends in main.py aren't clients of the daemon, they fork recorders of their own, so run
+either a frontend or the daemon on a rig, not both.
+"""
+import os
+import sys
+import json
+import math
+import time
+import socket
+import signal
+import asyncio
+import argparse
+from profiles import load_profiles, PROFILES_FILE, DEFAULT_PROFILE
+from main import INTERRUPT_SECONDS, KILL_SECONDS
+from headless import HeadlessRecorder, TRIGGER_SIGNAL
+from dashcam import POST_SECONDS
+from motion import MotionDetector
+from scheduling import Scheduling, IOPRIO_CLASSES
+
+SOCKET = f'{os.environ.get("XDG_RUNTIME_DIR", "/tmp")}/recorder.sock'
+TELEMETRY_FPS = 24  # most telemetry events a second
+MAX_BUFFERED = 64 * 1024  # bytes queued to a subscriber before telemetry to it is skipped
+
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':')).encode() + b'\n'
+
+
+class ControlDaemon:
+    def __init__(self, path=SOCKET, profiles=None, profile=DEFAULT_PROFILE, serials=None, cpus=None,
+                 segment_seconds=None, segment_bytes=None, interrupt_seconds=INTERRUPT_SECONDS,
+                 kill_seconds=KILL_SECONDS, synthetic=False, log=None, pre_seconds=None, post_seconds=POST_SECONDS,
+                 ring_directory=None, motion=None, scheduling=None):
+        """
+        :param path: path of the Unix domain socket to listen on
+        :param profiles: dict of name -> profiles.Profile that start can record with, defaults to the built in ones
+        :param profile: name of the profile start records with when none is given
+        :param serials: serial numbers of the cameras to record, if None the first camera found is recorded
+        :param cpus: list of cpu sets, one per camera, to pin each recorder to
+        :param segment_seconds: split recordings into segments of this many seconds
+        :param segment_bytes: split recordings into segments of this many bytes
+        :param interrupt_seconds: seconds a stopping recorder gets to finalize its recording before it is sent SIGINT
+        :param kill_seconds: seconds after SIGINT before a stopping recorder is sent SIGKILL
+        :param synthetic: if True, record from SyntheticCameras, for testing without a ZED
+        :param log: file started and stopped events are logged to as JSON lines, defaults to stdout
+        :param pre_seconds: if set, record in dashcam mode, keeping this many seconds before each trigger
+        :param post_seconds: seconds to record after a trigger in dashcam mode
+        :param ring_directory: where recorders keep their ring in dashcam mode, defaults to dashcam.RING_DIR
+        :param motion: motion.MotionDetector, if set, motion triggers the recorders in dashcam mode
+        :param scheduling: scheduling.Scheduling to run the recorders with, each pinned to its cpus
+        """
+        self.path = path
+        self.profiles = profiles or load_profiles(None)
+        self.profile = profile
+        self.serials = serials
+        self.cpus = cpus
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.interrupt_seconds = interrupt_seconds
+        self.kill_seconds = kill_seconds
+        self.synthetic = synthetic
+        self.log = log or sys.stdout
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.ring_directory = ring_directory
+        self.motion = motion
+        self.scheduling = scheduling
+        self.recorder = None  # HeadlessRecorder of the current, or last, recording
+        self.stopping = None  # task stopping the recorders
+        self.subscribers = {}  # StreamWriter -> [seconds between telemetry events, monotonic time next one is due]
+        self.skipped = 0  # telemetry events not sent to subscribers that weren't keeping up
+        self.telemetry = None
+        self.server = None
+        self.closed = None
+
+    def recording(self):
+        return self.recorder is not None and self.stopping is None and \
+            any(recorder.is_alive() for recorder in self.recorder.recorders.values())
+
+    def status(self):
+        """
+        :return: dict describing the recording, and the latest status of each of its cameras
+        """
+        if self.recorder is None:
+            return {'recording': False, 'stopping': False, 'subscribers': len(self.subscribers)}
+        cameras = self.recorder.camera_progress()
+        for camera, recorder in self.recorder.recorders.items():
+            cameras[camera]['alive'] = recorder.is_alive()
+            cameras[camera]['exit_code'] = recorder.proc.exitcode
+        return {'recording': self.recording(), 'stopping': self.stopping is not None, 'run_id': self.recorder.run_id,
+                'profile': self.recorder.profile.name, 'directory': self.recorder.directory,
+                'elapsed': time.monotonic() - self.recorder.started, 'cameras': cameras,
+                'subscribers': len(self.subscribers)}
+
+    def broadcast(self, message):
+        """
+        sends an event to every subscriber
+        """
+        data = encode(message)
+        for writer in list(self.subscribers):
+            writer.write(data)
+
+    def start(self, profile=None):
+        """
+        :return: run id of the new recording
+        """
+        if self.recording() or self.stopping is not None:
+            raise RuntimeError('already recording')
+        name = profile or self.profile
+        if name not in self.profiles:
+            raise ValueError(f'unknown profile {name}')
+        if self.recorder is not None:
+            self.recorder.close()
+        self.recorder = HeadlessRecorder(self.profiles[name], serials=self.serials, cpus=self.cpus,
+                                         segment_seconds=self.segment_seconds, segment_bytes=self.segment_bytes,
+                                         interrupt_seconds=self.interrupt_seconds, kill_seconds=self.kill_seconds,
+                                         synthetic=self.synthetic, output=self.log, pre_seconds=self.pre_seconds,
+                                         post_seconds=self.post_seconds, ring_directory=self.ring_directory,
+                                         motion=self.motion, scheduling=self.scheduling)
+        self.recorder.start()
+        loop = asyncio.get_running_loop()
+        for camera, recorder in self.recorder.recorders.items():
+            loop.add_reader(recorder.sentinel(), self.recorder_exited, camera)
+            if self.recorder.pre_seconds is not None:
+                loop.add_reader(recorder.fileno(), self.dashcam_events)
+        self.broadcast({'event': 'started', 'run_id': self.recorder.run_id, 'profile': name,
+                        'cameras': self.recorder.cameras})
+        return self.recorder.run_id
+
+    def dashcam_events(self):
+        """
+        a recorder sent flush or event messages
+        """
+        for message in self.recorder.read_dashcam():
+            self.recorder.emit(**message)
+            self.broadcast(message)
+
+    def trigger(self):
+        """
+        :return: the cameras triggered
+        """
+        if not self.recording():
+            raise RuntimeError('not recording')
+        return self.recorder.trigger()
+
+    def recorder_exited(self, camera):
+        """
+        a recorder exited without being asked to, eg: its camera failed to open
+        """
+        recorder = self.recorder.recorders[camera]
+        asyncio.get_running_loop().remove_reader(recorder.sentinel())
+        # the pipe stays readable once the recorder has closed its end
+        asyncio.get_running_loop().remove_reader(recorder.fileno())
+        self.dashcam_events()
+        recorder.proc.join()
+        message = {'event': 'recorder_exited', 'run_id': self.recorder.run_id, 'camera': camera,
+                   'exit_code': recorder.proc.exitcode}
+        self.recorder.emit(**message)
+        self.broadcast(message)
+
+    async def exited(self, recorders, timeout):
+        """
+        waits for the recorders to exit, for at most timeout seconds, None to wait forever
+        """
+        loop = asyncio.get_running_loop()
+        waiting = {}
+        for recorder in recorders:
+            if not recorder.has_exited():
+                future = loop.create_future()
+                loop.add_reader(recorder.sentinel(), lambda f=future: f.done() or f.set_result(None))
+                waiting[recorder.sentinel()] = future
+        try:
+            if waiting:
+                await asyncio.wait(waiting.values(), timeout=timeout)
+        finally:
+            for sentinel in waiting:
+                loop.remove_reader(sentinel)
+
+    async def stop(self):
+        """
+        signals every recorder at once, then interrupts and kills those that don't stop
+        :return: dict of camera -> seconds spent in each phase of stopping
+        """
+        if self.stopping is None:
+            if not self.recording():
+                raise RuntimeError('not recording')
+            self.stopping = asyncio.ensure_future(self._stop())
+        return await asyncio.shield(self.stopping)
+
+    async def _stop(self):
+        try:
+            recorder = self.recorder
+            loop = asyncio.get_running_loop()
+            alive = [process for process in recorder.recorders.values() if process.is_alive()]
+            for process in alive:
+                loop.remove_reader(process.sentinel())
+                loop.remove_reader(process.fileno())
+                process.stop(wait=False)
+            await self.exited(alive, self.interrupt_seconds)
+            for process in alive:
+                if not process.has_exited():
+                    process.interrupt()
+            await self.exited(alive, self.kill_seconds)
+            for process in alive:
+                if not process.has_exited():
+                    process.kill(wait=False)
+            await self.exited(alive, None)
+            for process in alive:
+                process.proc.join()
+                if process.shutdown is not None:
+                    process.shutdown.exited()
+            self.dashcam_events()
+            shutdown = {camera: process.shutdown.timings for camera, process in recorder.recorders.items()
+                        if process.shutdown is not None}
+            message = {'event': 'stopped', 'run_id': recorder.run_id,
+                       'frames': {camera: values['frames'] for camera, values in recorder.camera_progress().items()},
+                       'shutdown': shutdown}
+            recorder.emit(**message)
+            self.broadcast(message)
+            return shutdown
+        finally:
+            self.stopping = None
+
+    async def stream_telemetry(self):
+        """
+        reads the status blocks once per tick, and sends the frame counts to every subscriber due one
+        """
+        last = None
+        while self.subscribers:
+            now = time.monotonic()
+            if self.recorder is not None:
+                statuses = [recorder.read_status() for recorder in self.recorder.recorders.values()]
+                frames = [status.frames for status in statuses]
+                if frames != last:
+                    last = frames
+                    data = encode({'event': 'telemetry', 'run_id': self.recorder.run_id, 'frames': frames,
+                                   'bytes': [status.bytes_written for status in statuses],
+                                   'published': max(status.timestamp for status in statuses)})
+                    for writer, schedule in list(self.subscribers.items()):
+                        interval, due = schedule
+                        if now < due:
+                            continue
+                        if writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+                            self.skipped += 1
+                            continue
+                        writer.write(data)
+                        schedule[1] = now + interval
+            await asyncio.sleep(1 / TELEMETRY_FPS)
+        self.telemetry = None
+
+    def subscribe(self, writer, fps=TELEMETRY_FPS):
+        self.subscribers[writer] = [1 / min(max(fps, 0.1), TELEMETRY_FPS), 0.0]
+        if self.telemetry is None:
+            self.telemetry = asyncio.ensure_future(self.stream_telemetry())
+
+    async def handle(self, request, writer):
+        """
+        :return: response to a request, without its id
+        """
+        command = request.get('cmd')
+        profile, fps = request.get('profile'), request.get('fps', TELEMETRY_FPS)
+        if profile is not None and not isinstance(profile, str):
+            raise ValueError('profile must be a string')
+        if isinstance(fps, bool) or not isinstance(fps, (int, float)) or not math.isfinite(fps):
+            raise ValueError('fps must be a number')
+        if command == 'ping':
+            return {'ok': True}
+        if command == 'profiles':
+            return {'ok': True, 'profiles': list(self.profiles), 'default': self.profile}
+        if command == 'status':
+            return {'ok': True, 'status': self.status()}
+        if command == 'start':
+            return {'ok': True, 'run_id': self.start(profile)}
+        if command == 'stop':
+            return {'ok': True, 'shutdown': await self.stop()}
+        if command == 'trigger':
+            return {'ok': True, 'cameras': self.trigger()}
+        if command == 'subscribe':
+            self.subscribe(writer, fps)
+            return {'ok': True}
+        if command == 'unsubscribe':
+            self.subscribers.pop(writer, None)
+            return {'ok': True}
+        raise ValueError(f'unknown command {command}')
+
+    async def respond(self, request, writer):
+        try:
+            response = await self.handle(request, writer)
+        except (RuntimeError, ValueError, OSError) as e:
+            response = {'ok': False, 'error': str(e)}
+        if 'id' in request:
+            response['id'] = request['id']
+        writer.write(encode(response))
+
+    async def client(self, reader, writer):
+        """
+        serves one connection, requests that wait, like stop, don't hold up the connection's other requests
+        """
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    writer.write(encode({'ok': False, 'error': 'request is not JSON'}))
+                    continue
+                if not isinstance(request, dict):
+                    writer.write(encode({'ok': False, 'error': 'request is not a JSON object'}))
+                    continue
+                task = asyncio.ensure_future(self.respond(request, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # ValueError is a request line longer than the reader's limit
+            pass
+        finally:
+            self.subscribers.pop(writer, None)
+            for task in tasks:
+                task.cancel()
+            try:
+                # recorders forked while this client was connected hold a copy of the socket, so closing it here
+                # alone wouldn't end the connection
+                writer.transport.get_extra_info('socket').shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            writer.close()
+
+    def claim_socket(self):
+        """
+        removes a socket left by a daemon that exited, raises RuntimeError if a daemon is listening on it
+        """
+        if not os.path.exists(self.path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(self.path)
+            return
+        finally:
+            probe.close()
+        raise RuntimeError(f'a daemon is already listening on {self.path}')
+
+    def shutdown(self):
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def trigger_signalled(self, signal_received, frame):
+        self.closed.get_loop().call_soon_threadsafe(self.signal_trigger)
+
+    def signal_trigger(self):
+        try:
+            self.trigger()
+        except RuntimeError:
+            pass
+
+    def signalled(self, signal_received, frame):
+        # not loop.add_signal_handler, its wakeup fd would be inherited by the recorders, and signals sent to them
+        # would shut the daemon down
+        self.closed.get_loop().call_soon_threadsafe(self.shutdown)
+
+    async def serve(self):
+        """
+        serves clients until SIGINT or SIGTERM, then stops any recording
+        """
+        loop = asyncio.get_running_loop()
+        self.closed = loop.create_future()
+        self.claim_socket()
+        self.server = await asyncio.start_unix_server(self.client, path=self.path)
+        os.chmod(self.path, 0o660)
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, self.signalled)
+        signal.signal(TRIGGER_SIGNAL, self.trigger_signalled)
+        try:
+            await self.closed
+        finally:
+            self.server.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            if self.recording() or self.stopping is not None:
+                await self.stop()
+            if self.recorder is not None:
+                self.recorder.close()
+
+
+class ControlClient:
+    def __init__(self, path=SOCKET, timeout=None):
+        """
+        Blocking client of the control daemon, for scripts and fleet tooling
+        :param path: path of the daemon's socket
+        :param timeout: seconds to wait for a response, None to wait forever
+        """
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(path)
+        self.file = self.socket.makefile('rb')
+        self.next_id = 0
+
+    def send(self, command, **fields):
+        self.next_id += 1
+        self.socket.sendall(encode({'id': self.next_id, 'cmd': command, **fields}))
+        return self.next_id
+
+    def receive(self):
+        """
+        :return: the next message from the daemon, None if it closed the connection
+        """
+        line = self.file.readline()
+        return json.loads(line) if line else None
+
+    def request(self, command, **fields):
+        """
+        :return: the response to the command, events that arrive first are skipped
+        """
+        request_id = self.send(command, **fields)
+        while True:
+            message = self.receive()
+            if message is None:
+                raise ConnectionError('the daemon closed the connection')
+            if message.get('id') == request_id:
+                return message
+
+    def events(self, fps=TELEMETRY_FPS):
+        """
+        subscribes, then yields telemetry and events as they arrive
+        """
+        self.request('subscribe', fps=fps)
+        while True:
+            message = self.receive()
+            if message is None:
+                return
+            if 'event' in message:
+                yield message
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='recorder control daemon and client')
+    parser.add_argument('command', choices=['serve', 'ping', 'profiles', 'status', 'start', 'stop', 'trigger',
+                                            'watch'])
+    parser.add_argument('--socket', default=SOCKET, help='path of the control socket')
+    parser.add_argument('--profile', default=None, help='profile to record with, defaults to the default profile')
+    parser.add_argument('--profiles', default=PROFILES_FILE, help='JSON file of recording profiles, for serve')
+    parser.add_argument('--serials', nargs='+', default=None, help='serial numbers of the cameras, for serve')
+    parser.add_argument('--cpus', nargs='+', default=None,
+                        help='comma separated cpus to pin each camera recorder to, for serve, eg: --cpus 2,3 4,5')
+    parser.add_argument('--segment_minutes', type=float, default=None, help='segment length, for serve')
+    parser.add_argument('--segment_gb', type=float, default=None, help='segment size, for serve')
+    parser.add_argument('--synthetic', action='store_true', help='record from synthetic cameras, for serve')
+    parser.add_argument('--pre_seconds', type=float, default=None,
+                        help='dashcam mode, keep only this many seconds before each trigger, for serve')
+    parser.add_argument('--post_seconds', type=float, default=POST_SECONDS,
+                        help='seconds to record after a trigger in dashcam mode, for serve')
+    parser.add_argument('--ring_directory', default=None, help='where to keep the pre-trigger ring, for serve')
+    parser.add_argument('--motion', action='store_true', help='record only around motion, for serve')
+    parser.add_argument('--motion_roi', type=float, nargs=4, default=None,
+                        help='region motion is looked for in, left top right bottom as fractions, for serve')
+    parser.add_argument('--motion_threshold', type=float, default=0.01,
+                        help='fraction of pixels that must change for motion, for serve')
+    parser.add_argument('--motion_stride', type=int, default=2, help='frames per frame looked at, for serve')
+    parser.add_argument('--nice', type=int, default=None, help='nice level of the recorders, for serve')
+    parser.add_argument('--fifo', type=int, default=None,
+                        help='run the recorders SCHED_FIFO at this priority if permitted, for serve')
+    parser.add_argument('--ioclass', choices=IOPRIO_CLASSES[1:], default=None,
+                        help='I/O class of the recorders, for serve')
+    parser.add_argument('--iolevel', type=int, default=4, help='I/O priority in the class, 0 - 7, for serve')
+    parser.add_argument('--fps', type=float, default=4.0, help='telemetry rate, for watch')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        profiles = load_profiles(args.profiles)
+        if (args.profile or DEFAULT_PROFILE) not in profiles:
+            parser.error(f'unknown profile {args.profile}, choose from {", ".join(profiles)}')
+        cpus = [{int(cpu) for cpu in cpu_set.split(',')} for cpu_set in args.cpus] if args.cpus else None
+        daemon = ControlDaemon(args.socket, profiles=profiles, profile=args.profile or DEFAULT_PROFILE,
+                               serials=args.serials, cpus=cpus,
+                               segment_seconds=args.segment_minutes * 60 if args.segment_minutes else None,
+                               segment_bytes=int(args.segment_gb * 1e9) if args.segment_gb else None,
+                               synthetic=args.synthetic, pre_seconds=args.pre_seconds,
+                               post_seconds=args.post_seconds, ring_directory=args.ring_directory,
+                               motion=MotionDetector(roi=args.motion_roi, on_threshold=args.motion_threshold,
+                                                     off_threshold=args.motion_threshold / 4,
+                                                     stride=args.motion_stride) if args.motion else None,
+                               scheduling=Scheduling(nice=args.nice, fifo=args.fifo, ioclass=args.ioclass,
+                                                     iolevel=args.iolevel))
+        asyncio.run(daemon.serve())
+        sys.exit(0)
+
+    client = ControlClient(args.socket)
+    if args.command == 'watch':
+        try:
+            for event in client.events(fps=args.fps):
+                print(json.dumps(event), flush=True)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    fields = {'profile': args.profile} if args.command == 'start' and args.profile else {}
+    response = client.request(args.command, **fields)
+    print(json.dumps(response))
+    sys.exit(0 if response['ok'] else 1)
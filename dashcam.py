@@ -0,0 +1,313 @@
+"""
+Pre-trigger "dashcam" recording, the recorder keeps only the last few seconds, until something worth keeping happens
+
+The SVO is written by the ZED SDK's encoder, so the window before a trigger is kept as short segment files in a ring,
+the oldest deleted as each new one opens.  The ring defaults to tmpfs in /dev/shm, so it is held in memory and never
+touches the SSD.  On a trigger, the segments in the ring are moved into the recording directory as the first
+segments of an event recording, {stem}_event{n:04d}-{i:04d}.svo with a manifest as segments.Segments writes, and
+recording carries on into the event for post_seconds, a trigger during that extends it.  Then it's back to the ring.
+
+A trigger comes from the frontend as ('trigger', time.monotonic_ns()) sent down the recorder's pipe, or from
+SIGUSR1 sent to the recorder.  The recorder sends these messages back up its pipe
+
+    ('flushed', event stem, segments, bytes, seconds of frames, flush latency ms, ring peak bytes)
+    ('event_closed', event stem, frames, bytes)
+
+the bytes flushed are what the ring held at the trigger, its memory use on tmpfs, and the flush latency is from the
+trigger being requested to the last pre-trigger segment being in place.
+
+A recorder can also trigger itself, on motion, see motion.py, and then sends ('motion', summary) as it stops.
+"""
+import os
+import glob
+import math
+import time
+import shutil
+import threading
+from collections import deque
+from frame_index import index_filename
+from segments import Segments
+
+RING_DIR = '/dev/shm/recorder_ring' if os.path.isdir('/dev/shm') else None  # None for {directory}/.ring
+RING_SEGMENT_SECONDS = 1.0  # seconds of frames in each segment of the ring
+POST_SECONDS = 10.0  # seconds recorded after a trigger
+
+
+def _frames(event):
+    """
+    :return: frames recorded in an event, before and after the trigger
+    """
+    last = event.segments[-1]['last_frame']
+    return 0 if last is None else last - event.segments[0]['first_frame'] + 1
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Dashcam:
+    def __init__(self, directory, stem, pre_seconds, post_seconds=POST_SECONDS, ring_directory=None,
+                 segment_seconds=RING_SEGMENT_SECONDS, extension='svo'):
+        """
+        Decides which file the recorder writes to, a segment of the ring, or a segment of an event, see the module
+        docstring.  Used like segments.Segments, the recorder calls frame every frame, and rotate between grabs
+        when due says so.
+        :param directory: directory event recordings are written to
+        :param stem: name of the recording, events are named after it
+        :param pre_seconds: seconds before a trigger to keep
+        :param post_seconds: seconds after a trigger to record
+        :param ring_directory: where the ring is kept, defaults to RING_DIR, or {directory}/.ring without /dev/shm
+        :param segment_seconds: seconds in each segment of the ring, the pre-trigger window is kept to within this
+        """
+        self.directory = directory
+        self.stem = stem
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.ring_directory = ring_directory or RING_DIR or f'{directory}/.ring'
+        self.segment_seconds = segment_seconds
+        self.extension = extension
+        self.keep = max(1, math.ceil(pre_seconds / segment_seconds))  # closed segments kept in the ring
+        self.ring = deque()  # closed segments of the ring, oldest first, as Segments keeps them, plus their path
+        self.current = None  # the ring segment being recorded
+        self.opened = 0
+        self.started = None
+        self.triggered = None  # time.monotonic_ns() of a trigger the recorder hasn't rotated for yet
+        self.event = None  # Segments of the event being recorded
+        self.events = 0
+        self.post_until = None
+        self.closed_bytes = 0  # bytes of events that have closed
+        self.kept_frames = 0  # frames of events that have closed
+        self.written_bytes = 0  # bytes of every file closed, ring or event, what recording continuously would write
+        self.peak_bytes = 0
+        self.flushers = []
+        self.flushed = deque()  # messages from flushes that have finished, for the recorder to send
+
+    def ring_filename(self, slot):
+        # the pid keeps apart recorders whose directories hand out the same run ids
+        return f'{self.ring_directory}/{self.stem}.{os.getpid()}.ring-{slot:02d}.{self.extension}'
+
+    def open(self, first_frame):
+        """
+        Starts recording into the ring, removing rings left by recorders that were killed, which on tmpfs would
+        hold on to memory
+        :param first_frame: number of the first frame that will be recorded
+        :return: filename to record to
+        """
+        os.makedirs(self.ring_directory, exist_ok=True)
+        for path in glob.glob(f'{self.ring_directory}/*.ring-*'):
+            pid = os.path.basename(path).split('.ring-')[0].rsplit('.', 1)[-1]
+            if pid.isdigit() and not _alive(int(pid)):
+                os.remove(path)
+        return self.open_ring(first_frame)
+
+    def open_ring(self, first_frame):
+        # the slot of the segment dropped from the ring last, so the ring only ever has keep + 1 files
+        path = self.ring_filename(self.opened % (self.keep + 1))
+        self.opened += 1
+        self.current = {'file': os.path.basename(path), 'first_frame': first_frame, 'last_frame': None,
+                        'start_timestamp': None, 'end_timestamp': None, 'bytes': None, 'closed': False, 'path': path}
+        self.started = time.monotonic()
+        return path
+
+    def frame(self, frame, timestamp):
+        """
+        Records a grabbed frame, called every frame
+        """
+        if self.event is not None:
+            self.event.frame(frame, timestamp)
+            return
+        if self.current['start_timestamp'] is None:
+            self.current['start_timestamp'] = timestamp
+        self.current['last_frame'] = frame
+        self.current['end_timestamp'] = timestamp
+
+    def trigger(self, requested_ns=None):
+        """
+        Keeps the ring and records an event, or extends the event being recorded, safe to call from a signal handler
+        :param requested_ns: time.monotonic_ns() the trigger was requested at, defaults to now
+        """
+        requested_ns = time.monotonic_ns() if requested_ns is None else requested_ns
+        if self.event is not None:
+            self.post_until = max(self.post_until, time.monotonic() + self.post_seconds)
+        elif self.triggered is None:
+            self.triggered = requested_ns
+
+    def due(self):
+        """
+        :return: True if the recorder should rotate to the next file
+        """
+        if self.triggered is not None:
+            return True
+        if self.event is not None:
+            return time.monotonic() >= self.post_until
+        return time.monotonic() - self.started >= self.segment_seconds
+
+    def ring_bytes(self, bytes_written=0):
+        """
+        :param bytes_written: size of the segment being recorded
+        :return: bytes the ring holds, in memory when it is on tmpfs
+        """
+        current = bytes_written if self.event is None else 0
+        return sum(segment['bytes'] for segment in self.ring) + current
+
+    def kept_bytes(self, bytes_written=0):
+        """
+        :param bytes_written: size of the segment being recorded
+        :return: bytes of events, the recording that is kept
+        """
+        if self.event is None:
+            return self.closed_bytes
+        return self.closed_bytes + self.event.closed_bytes + bytes_written
+
+    def rotate(self, first_frame, bytes_written):
+        """
+        Closes the file being recorded and picks the next, call between grabs with recording disabled and the frame
+        index of the file closed, as the ring's files may be moved
+        :param first_frame: number of the first frame that will be recorded into the next file
+        :param bytes_written: final size of the file being closed
+        :return: filename to record to next, and a message for the frontend, or None
+        """
+        self.written_bytes += bytes_written
+        if self.event is not None:
+            event = self.event
+            event.close(bytes_written)
+            self.closed_bytes += event.closed_bytes
+            self.kept_frames += _frames(event)
+            self.event = None
+            return self.open_ring(first_frame), ('event_closed', event.stem, _frames(event), event.closed_bytes)
+
+        self.current['bytes'] = bytes_written
+        self.current['closed'] = True
+        self.ring.append(self.current)
+        self.peak_bytes = max(self.peak_bytes, self.ring_bytes())
+        if self.triggered is None:
+            while len(self.ring) > self.keep:
+                self.drop(self.ring.popleft())
+            return self.open_ring(first_frame), None
+
+        # the ring becomes the start of an event
+        self.events += 1
+        self.event = Segments(self.directory, f'{self.stem}_event{self.events:04d}', extension=self.extension)
+        ring_bytes = self.ring_bytes()
+        moves = []
+        for segment in self.ring:
+            path = segment.pop('path')
+            destination = self.event.filename(len(self.event.segments))
+            segment['file'] = os.path.basename(destination)
+            self.event.segments += [segment]
+            self.event.closed_bytes += segment['bytes']
+            moves += [(path, destination)]
+        seconds = 0.0
+        if self.ring[0]['start_timestamp'] is not None:
+            seconds = (self.ring[-1]['end_timestamp'] - self.ring[0]['start_timestamp']) / 1e9
+        self.ring.clear()
+        flusher = threading.Thread(target=self.flush, args=(self.event.stem, moves, self.triggered, ring_bytes,
+                                                            seconds))
+        flusher.start()
+        self.flushers += [flusher]
+        self.triggered = None
+        self.post_until = time.monotonic() + self.post_seconds
+        return self.event.open(first_frame), None
+
+    def flush(self, stem, moves, triggered, ring_bytes, seconds):
+        """
+        moves the pre-trigger segments and their frame indexes into the recording directory, in a thread so the
+        recorder carries on grabbing, a rename if the ring is on the same filesystem, else a copy
+        """
+        for source, destination in moves:
+            shutil.move(source, destination)
+            if os.path.exists(index_filename(source)):
+                shutil.move(index_filename(source), index_filename(destination))
+        latency = (time.monotonic_ns() - triggered) / 1e6
+        self.flushed.append(('flushed', stem, len(moves), ring_bytes, seconds, latency, self.peak_bytes))
+
+    def poll(self):
+        """
+        :return: list of messages from flushes that have finished since the last call
+        """
+        messages = []
+        while self.flushed:
+            messages += [self.flushed.popleft()]
+        if messages:
+            self.flushers = [flusher for flusher in self.flushers if flusher.is_alive()]
+        return messages
+
+    def drop(self, segment):
+        for path in (segment['path'], index_filename(segment['path'])):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def close(self, bytes_written):
+        """
+        Closes the event being recorded, and empties the ring, nothing in it was asked for
+        :return: messages for the frontend
+        """
+        messages = []
+        self.written_bytes += bytes_written
+        if self.event is not None:
+            self.event.close(bytes_written)
+            self.closed_bytes += self.event.closed_bytes
+            self.kept_frames += _frames(self.event)
+            messages += [('event_closed', self.event.stem, _frames(self.event), self.event.closed_bytes)]
+            self.event = None
+        else:
+            self.ring.append(self.current)
+        for flusher in self.flushers:
+            flusher.join()
+        while self.ring:
+            self.drop(self.ring.popleft())
+        return self.poll() + messages
+
+
+class DashcamProgress:
+    def __init__(self):
+        """
+        Folds a recorder's dashcam messages into a summary of its events, for display
+        """
+        self.events = []  # [stem, segments, bytes flushed, seconds, flush latency ms, bytes once closed or None]
+        self.peak_bytes = 0
+        self.motion = None  # summary of motion.MotionDetector, sent when a recorder triggered by motion stops
+
+    def update(self, message):
+        kind, *values = message
+        if kind == 'flushed':
+            stem, segments, flushed_bytes, seconds, latency, self.peak_bytes = values
+            self.events += [[stem, segments, flushed_bytes, seconds, latency, None]]
+        elif kind == 'event_closed':
+            stem, _, closed_bytes = values
+            for event in self.events:
+                if event[0] == stem:
+                    event[5] = closed_bytes
+        elif kind == 'motion':
+            self.motion, = values
+        return self
+
+    def summary(self):
+        """
+        :return: dict of the number of events, the ring's peak size, the slowest flush and the latest event
+        """
+        latencies = [event[4] for event in self.events]
+        return {'events': len(self.events), 'ring_peak_bytes': self.peak_bytes,
+                'flush_ms_max': max(latencies, default=0.0),
+                'last_event': self.events[-1][0] if self.events else None}
+
+    def text(self, pre_seconds):
+        """
+        :return: list of lines describing the ring and the last event, for display
+        """
+        text = [f'dashcam: keeping {pre_seconds:.0f} s before a trigger, ring {self.peak_bytes / 1e6:.1f} MB peak, '
+                f'{len(self.events)} events\n']
+        if self.events:
+            stem, segments, flushed_bytes, seconds, latency, closed_bytes = self.events[-1]
+            state = 'recording' if closed_bytes is None else f'{closed_bytes / 1e6:.1f} MB'
+            text += [f'{stem}: {seconds:.1f} s before the trigger flushed in {latency:.1f} ms, {state}\n']
+        if self.motion is not None:
+            text += [f'motion: recorded {100 * self.motion["recorded_fraction"]:.0f}% of frames, saved '
+                     f'{100 * self.motion["storage_saved"]:.0f}% of storage\n']
+        return text
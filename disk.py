@@ -0,0 +1,112 @@
+import os
+import time
+import shutil
+
+
+def preflight(directory, size=256 * 2 ** 20, block=4 * 2 ** 20):
+    """
+    Measures sustained sequential write bandwidth of the disk holding directory, by writing size bytes
+    to a temporary file and syncing it to disk
+    :param directory: directory recordings will be written to
+    :param size: bytes to write, this should be larger than the disk's write cache to measure the sustained rate
+    :param block: bytes per write call
+    :return: write bandwidth in bytes/s, free space in bytes
+    """
+    filename = f'{directory}/.preflight'
+    buffer = os.urandom(block)
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        start = time.monotonic()
+        written = 0
+        while written < size:
+            written += os.write(fd, buffer)
+        os.fsync(fd)
+        elapsed = time.monotonic() - start
+    finally:
+        os.close(fd)
+        os.remove(filename)
+    return written / elapsed, shutil.disk_usage(directory).free
+
+
+def writeback_bytes():
+    """
+    :return: bytes of dirty page cache not yet written to disk, system wide (linux only, 0 elsewhere)
+    """
+    total = 0
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('Dirty:') or line.startswith('Writeback:'):
+                    total += int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return total
+
+
+class DiskMonitor:
+    def __init__(self, directory, bandwidth=None, interval=1.0, warn_seconds=600, headroom=0.8,
+                 writeback_seconds=5.0):
+        """
+        Tracks the rate recordings are written at against the disk's bandwidth and free space
+        :param directory: directory recordings are written to
+        :param bandwidth: sustained write bandwidth in bytes/s from preflight, None if not measured
+        :param interval: seconds between measurements
+        :param warn_seconds: warn when less than this many seconds of recording space is left
+        :param headroom: warn when the write rate goes over this fraction of the disk bandwidth
+        :param writeback_seconds: warn when the page cache holds more than this many seconds of unwritten data
+        """
+        self.directory = directory
+        self.bandwidth = bandwidth
+        self.interval = interval
+        self.warn_seconds = warn_seconds
+        self.headroom = headroom
+        self.writeback_seconds = writeback_seconds
+        self.last = None
+        self.rate = 0.0
+        self.free = shutil.disk_usage(directory).free
+        self.writeback = 0
+
+    def update(self, bytes_written, now=None):
+        """
+        :param bytes_written: total bytes written by the recorders so far
+        :param now: monotonic time, defaults to now
+        """
+        now = time.monotonic() if now is None else now
+        if self.last is None or bytes_written < self.last[1]:
+            self.last = (now, bytes_written)
+            return
+        last, last_bytes = self.last
+        if now - last >= self.interval:
+            self.rate = (bytes_written - last_bytes) / (now - last)
+            self.last = (now, bytes_written)
+            self.free = shutil.disk_usage(self.directory).free
+            self.writeback = writeback_bytes()
+
+    def remaining(self):
+        """
+        :return: estimated seconds of recording left at the current write rate, None if nothing is being written
+        """
+        if self.rate <= 0:
+            return None
+        return self.free / self.rate
+
+    def warnings(self):
+        warnings = []
+        remaining = self.remaining()
+        if remaining is not None and remaining < self.warn_seconds:
+            warnings += [f'DISK NEARLY FULL: {remaining / 60:.1f} min left']
+        if self.bandwidth is not None:
+            if self.rate > self.headroom * self.bandwidth:
+                warnings += [f'DISK TOO SLOW: writing {self.rate / 1e6:.1f} of {self.bandwidth / 1e6:.1f} MB/s']
+            if self.writeback > self.writeback_seconds * self.bandwidth:
+                warnings += [f'DISK FALLING BEHIND: {self.writeback / 1e6:.0f} MB waiting to be written']
+        return warnings
+
+    def text(self):
+        """
+        :return: list of lines describing the disk, for display
+        """
+        remaining = self.remaining()
+        remaining = f'{remaining / 3600:.1f} h left' if remaining is not None else 'time left unknown'
+        text = [f'disk {self.rate / 1e6:.1f} MB/s, {self.free / 1e9:.1f} GB free, {remaining}\n']
+        return text + [f'{warning}\n' for warning in self.warnings()]
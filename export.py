@@ -0,0 +1,416 @@
+"""
+Exports finished recordings to video or images, several at once in a process pool
+
+    python export.py --directory ~/Documents/ZED --format mp4 --processes 4
+
+Each recording is exported to a partial file or directory that is renamed into place when it is complete,
+so an interrupted export is simply run again, recordings that already have an export are skipped, and
+partial exports left by the interruption are redone.  A recording with no frames has nothing to export, it is
+marked with an empty {stem}.empty file in the output instead, so it is skipped too.
+"""
+import os
+import sys
+import glob
+import time
+import shutil
+import pathlib
+import argparse
+import queue
+from multiprocessing import Pool, Queue, Event
+import numpy as np
+from camera import SYNTHETIC_MAGIC, SYNTHETIC_HEADER, SYNTHETIC_RECORD, synthetic_pattern, synthetic_image
+from process import suppress_stdout_stderr
+
+RECORDING_DIR = f'{pathlib.Path.home()}/Documents/ZED'
+FORMATS = ['mp4', 'png', 'jpg', 'npy']
+SETTLE_SECONDS = 10.0  # recordings modified more recently than this are assumed to still be recording
+PROGRESS_INTERVAL = 0.25  # seconds between progress messages from each export
+
+
+class RecordingReader:
+    """
+    Reads the frames of a recording, for export
+    """
+    def frame_count(self):
+        raise NotImplementedError
+
+    def fps(self):
+        raise NotImplementedError
+
+    def frames(self):
+        """
+        :return: iterator of (frame number, camera timestamp in ns, (H, W, 3) BGR image)
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SvoReader(RecordingReader):
+    def __init__(self, filename):
+        """
+        Reads an SVO with the ZED SDK, as fast as it decodes
+        """
+        import pyzed.sl as sl
+        self.sl = sl
+        self.cam = sl.Camera()
+        init = sl.InitParameters()
+        init.set_from_svo_file(filename)
+        init.svo_real_time_mode = False
+        init.depth_mode = sl.DEPTH_MODE.NONE
+        err = self.cam.open(init)
+        if err != sl.ERROR_CODE.SUCCESS:
+            raise IOError(f'could not open {filename}: {err}')
+        self.runtime = sl.RuntimeParameters()
+        self.image = sl.Mat()
+
+    def frame_count(self):
+        return self.cam.get_svo_number_of_frames()
+
+    def fps(self):
+        return self.cam.get_camera_information().camera_configuration.fps
+
+    def frames(self):
+        while True:
+            err = self.cam.grab(self.runtime)
+            if err == self.sl.ERROR_CODE.END_OF_SVOFILE_REACHED:
+                return
+            if err != self.sl.ERROR_CODE.SUCCESS:
+                raise IOError(f'grab failed: {err}')
+            self.cam.retrieve_image(self.image, self.sl.VIEW.LEFT)
+            timestamp = self.cam.get_timestamp(self.sl.TIME_REFERENCE.IMAGE).get_nanoseconds()
+            yield self.cam.get_svo_position(), timestamp, self.image.get_data()[:, :, :3]
+
+    def close(self):
+        self.cam.close()
+
+
+class SyntheticReader(RecordingReader):
+    def __init__(self, filename):
+        """
+        Reads a recording written by camera.SyntheticCamera, regenerating each frame's image from its frame number
+        """
+        self.file = open(filename, 'rb')
+        magic, self.width, self.height, self.payload_bytes, self.frame_rate = \
+            SYNTHETIC_HEADER.unpack(self.file.read(SYNTHETIC_HEADER.size))
+        if magic != SYNTHETIC_MAGIC:
+            raise IOError(f'{filename} is not a synthetic recording')
+        self.record_size = SYNTHETIC_RECORD.size + self.payload_bytes
+        self.count = (os.path.getsize(filename) - SYNTHETIC_HEADER.size) // self.record_size
+        self.pattern = synthetic_pattern(self.width, self.height)
+
+    def frame_count(self):
+        return self.count
+
+    def fps(self):
+        return self.frame_rate
+
+    def frames(self):
+        for _ in range(self.count):
+            frame, timestamp = SYNTHETIC_RECORD.unpack(self.file.read(self.record_size)[:SYNTHETIC_RECORD.size])
+            yield frame, timestamp, synthetic_image(self.pattern, frame)[:, :, :3]
+
+    def close(self):
+        self.file.close()
+
+
+def open_reader(filename):
+    """
+    Opens a recording with the reader for its format, synthetic recordings are recognised by their magic
+    :return: RecordingReader
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(len(SYNTHETIC_MAGIC))
+    if magic == SYNTHETIC_MAGIC:
+        return SyntheticReader(filename)
+    return SvoReader(filename)
+
+
+READERS = {'auto': open_reader, 'svo': SvoReader, 'synthetic': SyntheticReader}
+
+
+def output_path(filename, output, format):
+    """
+    :return: where the export of filename goes, a file for mp4 and npy, a directory of images for png and jpg
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    if format in ('png', 'jpg'):
+        return f'{output}/{stem}'
+    return f'{output}/{stem}.{format}'
+
+
+def partial_path(filename, output, format):
+    """
+    :return: where the export of filename is written until it is complete
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    if format in ('png', 'jpg'):
+        return f'{output}/{stem}.partial'
+    return f'{output}/{stem}.partial.{format}'
+
+
+def empty_path(filename, output):
+    """
+    :return: where a recording with no frames is marked as having nothing to export
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return f'{output}/{stem}.empty'
+
+
+def _resize_npy(array, filename, count):
+    """
+    Copies the frames of an npy memmap into a new one of count frames, for a recording whose frame count was wrong
+    :return: the new memmap, in place of filename
+    """
+    resized = np.lib.format.open_memmap(f'{filename}.resize', mode='w+', dtype=array.dtype,
+                                        shape=(count,) + array.shape[1:])
+    kept = min(count, len(array))
+    resized[:kept] = array[:kept]
+    resized.flush()
+    os.replace(f'{filename}.resize', filename)
+    return resized
+
+
+def finished_recordings(directory, settle_seconds=SETTLE_SECONDS):
+    """
+    :return: sorted list of the recordings in directory that haven't been written to for settle_seconds
+    """
+    now = time.time()
+    return [filename for filename in sorted(glob.glob(f'{directory}/*.svo'))
+            if now - os.path.getmtime(filename) >= settle_seconds]
+
+
+def export_recording(filename, output, format, reader=open_reader, progress=None):
+    """
+    Exports one recording
+    :param filename: recording to export
+    :param output: directory to export to
+    :param format: one of FORMATS
+    :param reader: function that opens filename and returns a RecordingReader
+    :param progress: called with (frames exported, total frames) every PROGRESS_INTERVAL seconds
+    :return: number of frames exported, 0 for a recording with no frames, which is marked as empty, not exported
+    """
+    partial = partial_path(filename, output, format)
+    if os.path.isdir(partial):
+        shutil.rmtree(partial)
+    elif os.path.exists(partial):
+        os.remove(partial)
+
+    recording = reader(filename)
+    try:
+        total = recording.frame_count()
+        writer = None
+        exported = 0
+        next_progress = 0.0
+        if format in ('png', 'jpg'):
+            import cv2
+            os.makedirs(partial)
+        for frame, _, image in recording.frames():
+            if format == 'mp4':
+                if writer is None:
+                    import cv2
+                    height, width = image.shape[:2]
+                    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+                    writer = cv2.VideoWriter(partial, fourcc, recording.fps(), (width, height))
+                writer.write(np.ascontiguousarray(image))
+            elif format == 'npy':
+                if writer is None:
+                    writer = np.lib.format.open_memmap(partial, mode='w+', dtype=np.uint8,
+                                                       shape=(max(total, 1),) + image.shape)
+                elif exported == len(writer):
+                    # the recording has more frames than it said it had
+                    writer = _resize_npy(writer, partial, 2 * len(writer))
+                # stored RGB, like the preview
+                writer[exported] = image[:, :, ::-1]
+            else:
+                cv2.imwrite(f'{partial}/{frame:06d}.{format}', image)
+            exported += 1
+            if progress is not None and time.monotonic() >= next_progress:
+                next_progress = time.monotonic() + PROGRESS_INTERVAL
+                progress(exported, total)
+        if format == 'mp4' and writer is not None:
+            writer.release()
+        elif format == 'npy' and writer is not None:
+            if exported != len(writer):
+                writer = _resize_npy(writer, partial, exported)
+            writer.flush()
+            del writer
+    finally:
+        recording.close()
+    if exported == 0:
+        if os.path.isdir(partial):
+            shutil.rmtree(partial)
+        open(empty_path(filename, output), 'w').close()
+        return 0
+    os.replace(partial, output_path(filename, output, format))
+    return exported
+
+
+_progress = None
+_stop = None
+
+
+class _Stopped(Exception):
+    pass
+
+
+def _init_worker(progress, stop):
+    global _progress, _stop
+    _progress = progress
+    _stop = stop
+
+
+def _export_job(filename, output, format, reader):
+    def report(done, total):
+        if _stop.is_set():
+            # abandons the partial export, it's redone next time
+            raise _Stopped()
+        _progress.put(('progress', filename, done, total))
+
+    if _stop.is_set():
+        return
+    start = time.monotonic()
+    try:
+        frames = export_recording(filename, output, format, reader, progress=report)
+        _progress.put(('done' if frames > 0 else 'empty', filename, frames, time.monotonic() - start))
+    except _Stopped:
+        pass
+    except Exception as e:
+        _progress.put(('failed', filename, f'{type(e).__name__}: {e}', time.monotonic() - start))
+
+
+def run_export(directory, output, format='mp4', processes=None, reader=open_reader, settle_seconds=SETTLE_SECONDS,
+               progress=print, stop=None):
+    """
+    Exports every finished recording in directory that hasn't been exported, in a pool of processes
+    :param directory: directory of recordings
+    :param output: directory to export to
+    :param format: one of FORMATS
+    :param processes: size of the pool, defaults to half the cpus
+    :param reader: function that opens a recording and returns a RecordingReader
+    :param settle_seconds: recordings modified more recently than this are left for next time
+    :param progress: called with each progress message, which are
+        ('queued', [filenames to export], number of recordings skipped as already exported)
+        ('progress', filename, frames exported, total frames)
+        ('done', filename, frames exported, seconds)
+        ('empty', filename, 0, seconds) for a recording with no frames
+        ('failed', filename, error, seconds)
+    :param stop: function returning True to stop the export, exports in progress are abandoned and redone next time
+    :return: True if every queued recording was exported
+    """
+    os.makedirs(output, exist_ok=True)
+    recordings = finished_recordings(directory, settle_seconds)
+    pending = [filename for filename in recordings if not os.path.exists(output_path(filename, output, format))
+               and not os.path.exists(empty_path(filename, output))]
+    progress(('queued', pending, len(recordings) - len(pending)))
+    if not pending:
+        return True
+
+    processes = processes or max(1, os.cpu_count() // 2)
+    messages = Queue()
+    stopping = Event()
+    finished = {}
+    with Pool(min(processes, len(pending)), initializer=_init_worker, initargs=(messages, stopping)) as pool:
+        jobs = {filename: pool.apply_async(_export_job, (filename, output, format, reader)) for filename in pending}
+        while len(finished) < len(jobs):
+            if stop is not None and stop():
+                # the workers abandon their exports at their next progress message, and skip the rest, terminating
+                # the pool instead can deadlock its task handler
+                stopping.set()
+                break
+            try:
+                message = messages.get(timeout=0.1)
+            except queue.Empty:
+                # a job that returned has sent its last message, which may still be on its way, unless it raised
+                for filename, job in jobs.items():
+                    if filename not in finished and job.ready() and not job.successful():
+                        try:
+                            job.get()
+                        except Exception as e:
+                            message = ('failed', filename, f'{type(e).__name__}: {e}', 0.0)
+                            progress(message)
+                            finished[filename] = message[0]
+                continue
+            progress(message)
+            if message[0] in ('done', 'empty', 'failed'):
+                finished[message[1]] = message[0]
+        pool.close()
+        pool.join()
+    return not stopping.is_set() and all(kind != 'failed' for kind in finished.values())
+
+
+def export_main(transmit, stop_process, directory=RECORDING_DIR, output=None, format='mp4', processes=None,
+                reader=open_reader, settle_seconds=SETTLE_SECONDS):
+    """
+    Runs an export as a urwid_app.SubProcess, progress messages are sent down the pipe, see run_export
+    """
+    with suppress_stdout_stderr():
+        run_export(directory, output or f'{directory}/export', format=format, processes=processes, reader=reader,
+                   settle_seconds=settle_seconds, progress=transmit.send, stop=stop_process.is_set)
+
+
+class ExportProgress:
+    def __init__(self):
+        """
+        Folds export progress messages into the state of each recording, for display
+        """
+        self.files = {}
+        self.skipped = 0
+
+    def update(self, message):
+        kind, *values = message
+        if kind == 'queued':
+            pending, self.skipped = values
+            self.files = {filename: 'queued' for filename in pending}
+        elif kind == 'progress':
+            filename, done, total = values
+            self.files[filename] = f'{done} / {total} frames {100 * done / max(total, 1):.0f}%'
+        elif kind == 'done':
+            filename, frames, seconds = values
+            self.files[filename] = f'done, {frames} frames in {seconds:.1f} s'
+        elif kind == 'empty':
+            filename, _, _ = values
+            self.files[filename] = 'empty, no frames to export'
+        elif kind == 'failed':
+            filename, error, _ = values
+            self.files[filename] = f'FAILED {error}'
+        return self
+
+    def text(self):
+        """
+        :return: list of lines, one per recording, for display
+        """
+        done = sum(1 for state in self.files.values() if state.startswith('done'))
+        text = [f'exported {done} of {len(self.files)} recordings, {self.skipped} already exported\n']
+        return text + [f'{os.path.basename(filename)}: {state}\n' for filename, state in self.files.items()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='export recordings to video or images')
+    parser.add_argument('--directory', default=RECORDING_DIR, help='directory of recordings')
+    parser.add_argument('--output', default=None, help='directory to export to, defaults to {directory}/export')
+    parser.add_argument('--format', choices=FORMATS, default='mp4')
+    parser.add_argument('--processes', type=int, default=None, help='recordings to export at once')
+    parser.add_argument('--reader', choices=list(READERS), default='auto', help='recording format')
+    parser.add_argument('--settle_seconds', type=float, default=SETTLE_SECONDS,
+                        help='skip recordings modified more recently than this, they may still be recording')
+    args = parser.parse_args()
+
+    def report(message):
+        kind, filename, *values = message
+        if kind == 'queued':
+            print(f'exporting {len(filename)} recordings, {values[0]} already exported')
+        elif kind == 'progress':
+            print(f'{os.path.basename(filename)}: {values[0]} / {values[1]} frames')
+        elif kind == 'done':
+            print(f'{os.path.basename(filename)}: done, {values[0]} frames in {values[1]:.1f} s')
+        elif kind == 'empty':
+            print(f'{os.path.basename(filename)}: empty, no frames to export')
+        else:
+            print(f'{os.path.basename(filename)}: FAILED {values[0]}')
+
+    ok = run_export(args.directory, args.output or f'{args.directory}/export', format=args.format,
+                    processes=args.processes, reader=READERS[args.reader], settle_seconds=args.settle_seconds,
+                    progress=report)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,146 @@
+import os
+import glob
+import struct
+import numpy as np
+
+
+MAGIC = b'FIDX'
+VERSION = 1
+HEADER = struct.Struct('<4sII4x')  # magic, version, record size, padded to 16 bytes so records stay aligned
+DTYPE = np.dtype([('frame', '<u8'), ('timestamp', '<i8'), ('host', '<i8')])
+EXTENSION = 'frames'
+
+
+def index_filename(recording):
+    """
+    :param recording: filename of a recording, eg: 12.svo
+    :return: filename of its frame index, eg: 12.frames
+    """
+    return f'{os.path.splitext(recording)[0]}.{EXTENSION}'
+
+
+class FrameIndexWriter:
+    def __init__(self, filename, batch=256):
+        """
+        Writes a frame index, a sidecar to a recording holding the frame number, camera timestamp and host
+        monotonic time of every frame, as a 16 byte header followed by packed DTYPE records
+
+        Records are kept in a preallocated buffer and appended to the file a batch at a time, so recording a
+        frame doesn't touch the file.  If the recorder is killed, the frames since the last batch are lost.
+        :param filename: file to write
+        :param batch: records per write
+        """
+        self.file = open(filename, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, DTYPE.itemsize))
+        self.buffer = np.zeros(batch, dtype=DTYPE)
+        self.count = 0
+
+    def append(self, frame, timestamp, host):
+        """
+        :param frame: frame number
+        :param timestamp: camera timestamp in ns
+        :param host: time.monotonic_ns() when the frame was grabbed
+        """
+        self.buffer[self.count] = (frame, timestamp, host)
+        self.count += 1
+        if self.count == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if self.count > 0:
+            self.file.write(self.buffer[:self.count].tobytes())
+            self.file.flush()
+            self.count = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class FrameIndex:
+    def __init__(self, filename):
+        """
+        Memory maps a frame index written by FrameIndexWriter, records is a read only numpy structured array with
+        fields frame, timestamp and host, a record torn by a crash at the end of the file is ignored
+
+        Lookups are binary searches over a clock, camera 'timestamp' or 'host', which must be increasing
+        """
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            magic, version, size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or size != DTYPE.itemsize:
+            raise ValueError(f'{filename} is not a version {VERSION} frame index')
+        count = (os.path.getsize(filename) - HEADER.size) // DTYPE.itemsize
+        if count > 0:
+            self.records = np.memmap(filename, dtype=DTYPE, mode='r', offset=HEADER.size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def start(self, clock='timestamp'):
+        """
+        :return: time of the first frame, None if the index is empty
+        """
+        return int(self.records[clock][0]) if len(self) > 0 else None
+
+    def end(self, clock='timestamp'):
+        """
+        :return: time of the last frame, None if the index is empty
+        """
+        return int(self.records[clock][-1]) if len(self) > 0 else None
+
+    def covers(self, time, clock='timestamp'):
+        return len(self) > 0 and self.start(clock) <= time <= self.end(clock)
+
+    def nearest(self, times, clock='timestamp'):
+        """
+        :param times: time or array of times, in ns
+        :param clock: 'timestamp' or 'host'
+        :return: position in the index of the frame nearest each time, an int or an array like times
+        :raises ValueError: if the index has no frames, eg: the recording stopped before its first frame
+        """
+        if len(self) == 0:
+            raise ValueError('empty frame index')
+        clocks = self.records[clock]
+        times = np.asarray(times, dtype=np.int64)
+        if len(clocks) < 2:
+            positions = np.zeros(times.shape, dtype=np.intp)
+        else:
+            right = np.clip(np.searchsorted(clocks, times), 1, len(clocks) - 1)
+            left = right - 1
+            positions = np.where(times - clocks[left] <= clocks[right] - times, left, right)
+        return positions if positions.ndim > 0 else int(positions)
+
+    def nearest_frame(self, times, clock='timestamp'):
+        """
+        :return: frame number nearest each time, an int or an array like times
+        """
+        frames = self.records['frame'][self.nearest(times, clock)]
+        return frames if np.ndim(frames) > 0 else int(frames)
+
+    def between(self, start, end, clock='timestamp'):
+        """
+        :return: records of the frames with start <= time < end, a view into the index
+        """
+        clocks = self.records[clock]
+        return self.records[np.searchsorted(clocks, start):np.searchsorted(clocks, end)]
+
+    def close(self):
+        self.records = None
+
+
+def locate(directory, time, clock='timestamp'):
+    """
+    Finds the frame at a time across every recording in a directory, reading only the first and last record of
+    indexes that don't cover it
+    :return: list of (recording index filename, frame number) for each recording covering time
+    """
+    found = []
+    for filename in sorted(glob.glob(f'{directory}/*.{EXTENSION}')):
+        index = FrameIndex(filename)
+        if index.covers(time, clock):
+            found += [(filename, index.nearest_frame(time, clock))]
+        index.close()
+    return found
@@ -0,0 +1,423 @@
+"""
+Records without the urwid frontend, for rigs with no terminal attached
+
+    python headless.py --duration 3600 --min_free_gb 20 --interval 10
+    python headless.py --serials 1234 5678 --frames 100000 --profile hd1080
+    python headless.py --metrics_textfile /var/lib/node_exporter/textfile_collector/recorder.prom
+    python headless.py --pre_seconds 10 --post_seconds 30    # then kill -USR1 <pid> to keep an event
+    python headless.py --motion --motion_roi 0.25 0.25 0.75 0.75 --post_seconds 5
+    python headless.py --cpus 3 --fifo 50 --ioclass realtime    # then --jitter_report to compare with unpinned
+
+Recorders run in SubProcesses as they do under app.RecordingApp, and recording stops at the first stop
+condition met: the duration, every camera recording the frame count, the free space on the recording disk falling
+below the threshold, or the frontend receiving SIGINT, SIGTERM or SIGHUP.  In dashcam mode, SIGUSR1 triggers every
+recorder to keep the seconds before it, see dashcam.py, and each event is printed as it is flushed and closed.  With
+a motion.MotionDetector, motion triggers the recorders, and each prints a motion summary when it stops.  With a
+scheduling.Scheduling, each progress line has the scheduling each recorder runs with, and what wasn't permitted.
+
+Progress is printed to stdout as one JSON object per line, eg:
+
+    {"event": "started", "run_id": 12, "profile": "hd720", "directory": "/home/rig/Documents/ZED", ...}
+    {"event": "progress", "elapsed": 10.0, "frames": 600, "fps": 60.0, "bytes": 52428800, "free_bytes": ..., ...}
+    {"event": "flushed", "camera": "Recording", "stem": "12_event0001", "segments": 10, "bytes": ..., ...}
+    {"event": "stopped", "reason": "duration", "exit_code": 0, "elapsed": 3600.1, "frames": 216000, ...}
+
+Exit codes are
+    0   a stop condition was met
+    10  a camera didn't open, see main.EXIT_CAMERA_OPEN
+    11  recording couldn't be enabled, see main.EXIT_ENABLE_RECORDING
+    12  another camera failed to open, see main.EXIT_BARRIER
+    13  a recorder exited without being asked to
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+from multiprocessing import Barrier, connection
+from process import SubProcess
+from stats import GrabStats
+from disk import DiskMonitor
+from run_id import allocate_run_id
+from dashcam import DashcamProgress, POST_SECONDS
+from motion import MotionDetector, MOTION_PRE_SECONDS
+from scheduling import Scheduling, describe, jitter_report, IOPRIO_CLASSES
+from metrics import RecorderMetrics, MetricsServer, TextfileWriter, TEXTFILE_INTERVAL
+from profiles import load_profiles, profile_camera, synthetic_camera, PROFILES_FILE, DEFAULT_PROFILE
+from main import start_recording, RECORDING_DIR, INTERRUPT_SECONDS, KILL_SECONDS, EXIT_CAMERA_OPEN, \
+    EXIT_ENABLE_RECORDING, EXIT_BARRIER, METRICS_INTERVAL
+
+EXIT_OK = 0
+EXIT_RECORDER_DIED = 13
+POLL = 0.1  # most seconds between checks of the stop conditions
+STOP_SIGNALS = [signal.SIGINT, signal.SIGTERM, signal.SIGHUP]
+TRIGGER_SIGNAL = signal.SIGUSR1
+
+
+class HeadlessRecorder:
+    def __init__(self, profile, serials=None, cpus=None, segment_seconds=None, segment_bytes=None, duration=None,
+                 frames=None, min_free_bytes=None, interval=10.0, interrupt_seconds=INTERRUPT_SECONDS,
+                 kill_seconds=KILL_SECONDS, synthetic=False, output=None, metrics_port=None, metrics_textfile=None,
+                 metrics_interval=TEXTFILE_INTERVAL, pre_seconds=None, post_seconds=POST_SECONDS, ring_directory=None,
+                 motion=None, scheduling=None):
+        """
+        :param profile: profiles.Profile to record with
+        :param serials: serial numbers of the cameras to record, each in its own process, if None the first
+            camera found is recorded
+        :param cpus: list of cpu sets, one per camera, to pin each recorder to
+        :param segment_seconds: split recordings into segments of this many seconds
+        :param segment_bytes: split recordings into segments of this many bytes
+        :param duration: stop after this many seconds
+        :param frames: stop once every camera has recorded this many frames
+        :param min_free_bytes: stop when the recording disk has less than this many bytes free
+        :param interval: seconds between progress lines
+        :param interrupt_seconds: seconds a stopping recorder gets to finalize its recording before it is sent SIGINT
+        :param kill_seconds: seconds after SIGINT before a stopping recorder is sent SIGKILL
+        :param synthetic: if True, record from a SyntheticCamera of the profile's resolution instead of the ZED
+        :param output: file progress lines are written to, defaults to stdout
+        :param metrics_port: serve OpenMetrics on this local port, None to not serve them
+        :param metrics_textfile: write OpenMetrics to this file every metrics_interval seconds, None to not write them
+        :param pre_seconds: if set, record in dashcam mode, keeping this many seconds before each trigger
+        :param post_seconds: seconds to record after a trigger in dashcam mode
+        :param ring_directory: where recorders keep their ring in dashcam mode, defaults to dashcam.RING_DIR
+        :param motion: motion.MotionDetector, if set, motion triggers the recorders in dashcam mode
+        :param scheduling: scheduling.Scheduling to run the recorders with, each pinned to its cpus
+        """
+        self.profile = profile
+        self.serials = serials or [None]
+        self.cpus = cpus or [None] * len(self.serials)
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.duration = duration
+        self.frames = frames
+        self.min_free_bytes = min_free_bytes
+        self.interval = interval
+        self.interrupt_seconds = interrupt_seconds
+        self.kill_seconds = kill_seconds
+        self.synthetic = synthetic
+        self.output = output or sys.stdout
+        self.directory = profile.directory or RECORDING_DIR
+        self.cameras = ['Recording'] if serials is None else [f'Camera {serial}' for serial in serials]
+        self.recorders = {camera: SubProcess(start_recording, status=True, shared={'stats': GrabStats})
+                          for camera in self.cameras}
+        self.disk = None
+        self.run_id = None
+        self.started = None
+        self.reason = None
+        self.exit_code = EXIT_OK
+        self.last_progress = None
+        self.pre_seconds = MOTION_PRE_SECONDS if motion is not None and pre_seconds is None else pre_seconds
+        self.post_seconds = post_seconds
+        self.motion = motion
+        self.scheduling = scheduling or Scheduling()
+        self.ring_directory = ring_directory
+        self.dashcam = {camera: DashcamProgress() for camera in self.cameras}
+        self.triggered = False
+        self.metrics = RecorderMetrics()
+        self.metrics_server = MetricsServer(self.metrics.registry, metrics_port) if metrics_port else None
+        self.metrics_writer = TextfileWriter(self.metrics.registry, metrics_textfile, metrics_interval) \
+            if metrics_textfile else None
+
+    def emit(self, event, **fields):
+        """
+        prints a progress line
+        """
+        print(json.dumps({'event': event, **fields}), file=self.output, flush=True)
+
+    def signalled(self, signal_received, frame):
+        if self.reason is None:
+            self.reason = signal.Signals(signal_received).name
+
+    def trigger_signalled(self, signal_received, frame):
+        # the recorders are sent the trigger from the loop, not from the handler
+        self.triggered = True
+
+    def trigger(self):
+        """
+        triggers every recorder in dashcam mode
+        :return: the cameras triggered
+        """
+        if self.pre_seconds is None:
+            raise RuntimeError('not in dashcam mode')
+        requested = time.monotonic_ns()
+        cameras = [camera for camera, recorder in self.recorders.items() if recorder.is_alive()]
+        for camera in cameras:
+            self.recorders[camera].write_pipe(('trigger', requested))
+        return cameras
+
+    def read_dashcam(self):
+        """
+        reads the recorders' flush and event messages in dashcam mode
+        :return: list of progress lines, a dict per message
+        """
+        events = []
+        if self.pre_seconds is None:
+            return events
+        for camera, recorder in self.recorders.items():
+            for message in recorder.read_pipe():
+                self.dashcam[camera].update(message)
+                kind, *values = message
+                if kind == 'flushed':
+                    stem, segments, flushed_bytes, seconds, latency, peak = values
+                    events += [{'event': kind, 'camera': camera, 'stem': stem, 'segments': segments,
+                                'bytes': flushed_bytes, 'seconds': round(seconds, 3), 'flush_ms': round(latency, 3),
+                                'ring_peak_bytes': peak}]
+                elif kind == 'event_closed':
+                    stem, frames, closed_bytes = values
+                    events += [{'event': kind, 'camera': camera, 'stem': stem, 'frames': frames,
+                                'bytes': closed_bytes}]
+                elif kind == 'motion':
+                    events += [{'event': kind, 'camera': camera, **values[0]}]
+        return events
+
+    def camera(self, serial):
+        return synthetic_camera(self.profile) if self.synthetic else profile_camera(self.profile, serial)
+
+    def start(self):
+        """
+        starts a recorder per camera under a shared run id
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.disk = DiskMonitor(self.directory)
+        self.run_id = allocate_run_id(self.directory)
+        barrier = Barrier(len(self.cameras)) if len(self.cameras) > 1 else None
+        requested = time.monotonic_ns()
+        for camera, serial, cpus in zip(self.cameras, self.serials, self.cpus):
+            self.recorders[camera].fork(camera=self.camera(serial), directory=self.directory, run_id=self.run_id,
+                                        tag=serial, barrier=barrier, scheduling=self.scheduling.pinned(cpus),
+                                        segment_seconds=self.segment_seconds,
+                                        segment_bytes=self.segment_bytes, requested_ns=requested,
+                                        pre_seconds=self.pre_seconds, post_seconds=self.post_seconds,
+                                        ring_directory=self.ring_directory, motion=self.motion)
+        self.started = time.monotonic()
+        self.emit('started', run_id=self.run_id, profile=self.profile.name, directory=self.directory,
+                  cameras=self.cameras, pids=[self.recorders[camera].proc.pid for camera in self.cameras])
+
+    def camera_progress(self):
+        """
+        :return: dict of camera -> frames, bytes written, dropped and failed grabs
+        """
+        progress = {}
+        for camera, recorder in self.recorders.items():
+            status = recorder.read_status()
+            summary = recorder.blocks['stats'].summary()
+            progress[camera] = {'frames': status.frames, 'bytes': status.bytes_written,
+                                'dropped': summary['dropped'], 'failed': summary['failed']}
+            if self.pre_seconds is not None:
+                progress[camera]['dashcam'] = self.dashcam[camera].summary()
+            settings = recorder.read_scheduling()
+            if settings is not None:
+                progress[camera]['scheduling'] = describe(settings)
+                progress[camera]['not_permitted'] = recorder.scheduling.check(settings)
+        return progress
+
+    def progress(self, now):
+        cameras = self.camera_progress()
+        frames = min(camera['frames'] for camera in cameras.values())
+        last, last_frames = self.last_progress or (self.started, 0)
+        fps = (frames - last_frames) / (now - last) if now > last else 0.0
+        self.last_progress = (now, frames)
+        self.emit('progress', elapsed=round(now - self.started, 3), frames=frames, fps=round(fps, 2),
+                  bytes=sum(camera['bytes'] for camera in cameras.values()), free_bytes=self.disk.free,
+                  warnings=self.disk.warnings(), cameras=cameras)
+
+    def update_metrics(self, now=None):
+        for camera, recorder in self.recorders.items():
+            self.metrics.update(camera, recorder, now)
+        if self.disk is not None:
+            self.metrics.update_disk(self.disk)
+
+    def check(self, now):
+        """
+        :return: the stop condition that has been met, or None
+        """
+        if self.reason is not None:
+            return self.reason
+        failed = [recorder.proc.exitcode for recorder in self.recorders.values() if not recorder.is_alive()]
+        if failed:
+            # a camera that failed to open aborts the barrier the others wait on, so report the cause
+            causes = [code for code in failed if code in (EXIT_CAMERA_OPEN, EXIT_ENABLE_RECORDING)]
+            self.exit_code = min(causes) if causes else EXIT_BARRIER if EXIT_BARRIER in failed else EXIT_RECORDER_DIED
+            return 'recorder_exited'
+        statuses = [recorder.read_status() for recorder in self.recorders.values()]
+        self.disk.update(sum(status.bytes_written for status in statuses), now)
+        if self.duration is not None and now - self.started >= self.duration:
+            return 'duration'
+        if self.frames is not None and min(status.frames for status in statuses) >= self.frames:
+            return 'frames'
+        if self.min_free_bytes is not None and self.disk.free < self.min_free_bytes:
+            return 'disk_free'
+        return None
+
+    def wait(self, seconds):
+        """
+        waits for every recorder to exit, for at most seconds, None to wait forever
+        """
+        deadline = None if seconds is None else time.monotonic() + seconds
+        while True:
+            sentinels = [recorder.sentinel() for recorder in self.recorders.values() if not recorder.has_exited()]
+            if not sentinels:
+                return
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                return
+            connection.wait(sentinels, timeout)
+
+    def stop(self):
+        """
+        signals every recorder at once, so they stop together, then interrupts and kills those that don't
+        """
+        alive = [recorder for recorder in self.recorders.values() if recorder.is_alive()]
+        for recorder in alive:
+            recorder.stop(wait=False)
+        self.wait(self.interrupt_seconds)
+        for recorder in alive:
+            if not recorder.has_exited():
+                recorder.interrupt()
+        self.wait(self.kill_seconds)
+        for recorder in alive:
+            if not recorder.has_exited():
+                recorder.kill()
+        for recorder in alive:
+            recorder.proc.join()
+            if recorder.shutdown is not None:
+                recorder.shutdown.exited()
+
+    def run(self):
+        """
+        records until a stop condition is met
+        :return: exit code
+        """
+        self.start()
+        for signal_number in STOP_SIGNALS:
+            signal.signal(signal_number, self.signalled)
+        signal.signal(TRIGGER_SIGNAL, self.trigger_signalled)
+        next_progress = self.started + self.interval
+        next_metrics = self.started
+        try:
+            while True:
+                sentinels = [recorder.sentinel() for recorder in self.recorders.values()]
+                if self.pre_seconds is not None:
+                    sentinels += [recorder.fileno() for recorder in self.recorders.values()]
+                connection.wait(sentinels, POLL)
+                now = time.monotonic()
+                if self.triggered and self.pre_seconds is not None:
+                    self.triggered = False
+                    self.trigger()
+                for event in self.read_dashcam():
+                    self.emit(**event)
+                reason = self.check(now)
+                if reason is not None:
+                    break
+                if now >= next_progress:
+                    next_progress += self.interval
+                    self.progress(now)
+                if now >= next_metrics:
+                    next_metrics = now + METRICS_INTERVAL
+                    self.update_metrics(now)
+            self.progress(time.monotonic())
+            self.stop()
+            for event in self.read_dashcam():
+                self.emit(**event)
+            self.update_metrics()
+            cameras = self.camera_progress()
+            self.emit('stopped', reason=reason, exit_code=self.exit_code,
+                      elapsed=round(time.monotonic() - self.started, 3),
+                      frames=min(camera['frames'] for camera in cameras.values()),
+                      exit_codes={camera: recorder.proc.exitcode for camera, recorder in self.recorders.items()},
+                      shutdown={camera: recorder.shutdown.timings for camera, recorder in self.recorders.items()
+                                if recorder.shutdown is not None})
+        finally:
+            self.close()
+        return self.exit_code
+
+    def close(self):
+        """
+        releases the recorders' shared memory, their status can't be read after this, and stops exporting metrics
+        """
+        for recorder in self.recorders.values():
+            recorder.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        if self.metrics_writer is not None:
+            self.metrics_writer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='record without a terminal until a stop condition is met')
+    parser.add_argument('--serials', nargs='+', default=None,
+                        help='serial numbers of the cameras to record, defaults to the first camera found')
+    parser.add_argument('--cpus', nargs='+', default=None,
+                        help='comma separated cpus to pin each camera recorder to, eg: --cpus 2,3 4,5')
+    parser.add_argument('--profiles', default=PROFILES_FILE,
+                        help='JSON file of recording profiles, adding to and overriding the built in profiles')
+    parser.add_argument('--profile', default=DEFAULT_PROFILE, help='recording profile to record with')
+    parser.add_argument('--segment_minutes', type=float, default=None,
+                        help='split recordings into segments of this many minutes')
+    parser.add_argument('--segment_gb', type=float, default=None,
+                        help='split recordings into segments of this many gigabytes')
+    parser.add_argument('--duration', type=float, default=None, help='stop after this many seconds')
+    parser.add_argument('--frames', type=int, default=None, help='stop once every camera has this many frames')
+    parser.add_argument('--min_free_gb', type=float, default=None,
+                        help='stop when the recording disk has less than this many gigabytes free')
+    parser.add_argument('--interval', type=float, default=10.0, help='seconds between progress lines')
+    parser.add_argument('--interrupt_seconds', type=float, default=INTERRUPT_SECONDS,
+                        help='seconds a stopping recorder gets to finalize its recording before it is sent SIGINT')
+    parser.add_argument('--kill_seconds', type=float, default=KILL_SECONDS,
+                        help='seconds after SIGINT before a stopping recorder is killed')
+    parser.add_argument('--synthetic', action='store_true',
+                        help="record from a synthetic camera of the profile's resolution, for testing without a ZED")
+    parser.add_argument('--metrics_port', type=int, default=None,
+                        help='serve OpenMetrics of recorder health on this local port, eg: 9105')
+    parser.add_argument('--metrics_textfile', default=None,
+                        help='write OpenMetrics of recorder health to this file, for the node_exporter textfile '
+                             'collector')
+    parser.add_argument('--metrics_interval', type=float, default=TEXTFILE_INTERVAL,
+                        help='seconds between writes of the metrics textfile')
+    parser.add_argument('--pre_seconds', type=float, default=None,
+                        help='dashcam mode, keep only this many seconds before each trigger, sent with SIGUSR1')
+    parser.add_argument('--post_seconds', type=float, default=POST_SECONDS,
+                        help='seconds to record after a trigger in dashcam mode')
+    parser.add_argument('--ring_directory', default=None,
+                        help='where to keep the pre-trigger ring, defaults to tmpfs in /dev/shm')
+    parser.add_argument('--motion', action='store_true',
+                        help='record only around motion, in dashcam mode, see motion.py')
+    parser.add_argument('--motion_roi', type=float, nargs=4, default=None,
+                        help='region motion is looked for in, left top right bottom as fractions of the frame')
+    parser.add_argument('--motion_threshold', type=float, default=0.01,
+                        help='fraction of pixels that must change for motion, it stops below a quarter of this')
+    parser.add_argument('--motion_stride', type=int, default=2, help='frames grabbed per frame looked at for motion')
+    parser.add_argument('--nice', type=int, default=None,
+                        help='nice level of the recorders, negative to run ahead of other work, needs CAP_SYS_NICE')
+    parser.add_argument('--fifo', type=int, default=None,
+                        help='run the recorders SCHED_FIFO at this priority, 1 - 99, if permitted, else at --nice')
+    parser.add_argument('--ioclass', choices=IOPRIO_CLASSES[1:], default=None, help='I/O class of the recorders')
+    parser.add_argument('--iolevel', type=int, default=4, help='I/O priority of the recorders in their class, 0 - 7')
+    parser.add_argument('--jitter_report', action='store_true',
+                        help="print the frame intervals of the profile directory's recordings by scheduling, and exit")
+    args = parser.parse_args()
+    profiles = load_profiles(args.profiles)
+    if args.profile not in profiles:
+        parser.error(f'unknown profile {args.profile}, choose from {", ".join(profiles)}')
+    if args.jitter_report:
+        print(''.join(jitter_report(profiles[args.profile].directory or RECORDING_DIR)), end='')
+        sys.exit(EXIT_OK)
+    cpus = [{int(cpu) for cpu in cpu_set.split(',')} for cpu_set in args.cpus] if args.cpus else None
+
+    recorder = HeadlessRecorder(profiles[args.profile], serials=args.serials, cpus=cpus,
+                                segment_seconds=args.segment_minutes * 60 if args.segment_minutes else None,
+                                segment_bytes=int(args.segment_gb * 1e9) if args.segment_gb else None,
+                                duration=args.duration, frames=args.frames,
+                                min_free_bytes=int(args.min_free_gb * 1e9) if args.min_free_gb else None,
+                                interval=args.interval, interrupt_seconds=args.interrupt_seconds,
+                                kill_seconds=args.kill_seconds, synthetic=args.synthetic,
+                                metrics_port=args.metrics_port, metrics_textfile=args.metrics_textfile,
+                                metrics_interval=args.metrics_interval, pre_seconds=args.pre_seconds,
+                                post_seconds=args.post_seconds, ring_directory=args.ring_directory,
+                                motion=MotionDetector(roi=args.motion_roi, on_threshold=args.motion_threshold,
+                                                      off_threshold=args.motion_threshold / 4,
+                                                      stride=args.motion_stride) if args.motion else None,
+                                scheduling=Scheduling(nice=args.nice, fifo=args.fifo, ioclass=args.ioclass,
+                                                      iolevel=args.iolevel))
+    sys.exit(recorder.run())
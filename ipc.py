@@ -0,0 +1,145 @@
+import time
+import struct
+from multiprocessing import shared_memory
+import numpy as np
+
+
+BATCH_HEADER = struct.Struct('<HI')  # message type id, number of messages in the batch
+REGISTRY = {}
+
+
+class MessageType:
+    def __init__(self, type_id, fields):
+        """
+        A fixed layout binary message, packed little endian with no padding
+        :param type_id: number identifying the type on the wire, 0 - 65535
+        :param fields: list of (name, struct format character) pairs, eg: [('frames', 'Q'), ('timestamp', 'q')]
+        """
+        self.type_id = type_id
+        self.struct = struct.Struct('<' + ''.join(code for _, code in fields))
+        self.dtype = np.dtype([(name, f'<{code}') for name, code in fields])
+        self.size = self.struct.size
+        REGISTRY[type_id] = self
+
+
+FRAME = MessageType(1, [('frames', 'Q'), ('timestamp', 'q')])
+
+
+class BatchWriter:
+    def __init__(self, transmit, message_type, batch=64, max_delay=0.01):
+        """
+        Packs messages of one type into a buffer and sends them as a single write, when the batch is full or the
+        oldest message has waited max_delay seconds.  Messages still in the buffer when the sender goes quiet are
+        only sent on the next send, call flush() before blocking or exiting.
+        :param transmit: the multiprocess Pipe main(transmit, stop_process) was given
+        :param message_type: MessageType to send
+        :param batch: most messages per write
+        :param max_delay: most seconds a message waits in the buffer, 0 to send every message immediately
+        """
+        self.transmit = transmit
+        self.type = message_type
+        self.batch = batch
+        self.max_delay = max_delay
+        self.buffer = bytearray(BATCH_HEADER.size + batch * message_type.size)
+        self.count = 0
+        self.oldest = 0.0
+
+    def send(self, *values):
+        self.type.struct.pack_into(self.buffer, BATCH_HEADER.size + self.count * self.type.size, *values)
+        self.count += 1
+        if self.count == 1:
+            self.oldest = time.monotonic()
+        if self.count == self.batch or time.monotonic() - self.oldest >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        if self.count > 0:
+            BATCH_HEADER.pack_into(self.buffer, 0, self.type.type_id, self.count)
+            self.transmit.send_bytes(self.buffer, 0, BATCH_HEADER.size + self.count * self.type.size)
+            self.count = 0
+
+
+def read_messages(recv):
+    """
+    Reads every batch waiting on the pipe
+    :param recv: end of the multiprocess Pipe to read from
+    :return: dict of type id -> numpy structured array of the messages received, in order
+    """
+    batches = {}
+    while recv.poll():
+        data = recv.recv_bytes()
+        type_id, count = BATCH_HEADER.unpack_from(data)
+        message_type = REGISTRY[type_id]
+        batch = np.frombuffer(data, dtype=message_type.dtype, count=count, offset=BATCH_HEADER.size)
+        batches.setdefault(type_id, []).append(batch)
+    return {type_id: np.concatenate(batch) for type_id, batch in batches.items()}
+
+
+class MessageRing:
+    """
+    Single producer, single consumer ring of fixed layout messages in shared memory
+
+    The writer owns the write count and the reader owns the read count, so neither ever waits on a lock.
+    When the ring is full, send drops the message and returns False rather than block the writer.
+    """
+    HEADER = 2  # uint64 counts of messages written and messages read
+
+    def __init__(self, message_type, capacity=4096, name=None):
+        """
+        :param message_type: MessageType carried by the ring
+        :param capacity: number of messages the ring holds
+        :param name: name of an existing ring to attach to, if None a new ring is created
+        """
+        self.type = message_type
+        self.capacity = capacity
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=8 * self.HEADER + capacity * message_type.size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        # the counts are aligned uint64 so each is written in a single store, struct.pack_into writes them a
+        # byte at a time and the other process can read a torn count
+        self.counts = np.ndarray((self.HEADER,), dtype=np.uint64, buffer=self.shm.buf)
+        self.records = np.ndarray((capacity,), dtype=message_type.dtype, buffer=self.shm.buf,
+                                  offset=self.counts.nbytes)
+        self.dropped = 0
+
+    def __getstate__(self):
+        return {'type_id': self.type.type_id, 'capacity': self.capacity, 'name': self.shm.name}
+
+    def __setstate__(self, state):
+        self.__init__(REGISTRY[state['type_id']], state['capacity'], state['name'])
+
+    def send(self, *values):
+        """
+        :return: False if the ring was full and the message was dropped
+        """
+        written, read = self.counts.tolist()
+        if written - read >= self.capacity:
+            self.dropped += 1
+            return False
+        self.records[written % self.capacity] = values
+        self.counts[0] = written + 1
+        return True
+
+    def receive(self):
+        """
+        :return: numpy structured array of every message waiting in the ring, in order
+        """
+        written, read = self.counts.tolist()
+        start, end = read % self.capacity, written % self.capacity
+        if written == read:
+            messages = self.records[:0].copy()
+        elif start < end:
+            messages = self.records[start:end].copy()
+        else:
+            messages = np.concatenate([self.records[start:], self.records[:end]])
+        self.counts[1] = written
+        return messages
+
+    def close(self):
+        # the numpy views must be released before the shared memory can be
+        self.counts, self.records = None, None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
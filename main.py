@@ -1,107 +1,325 @@
 import sys
-from signal import signal, SIGINT
+import argparse
+import time
+from threading import BrokenBarrierError
+from signal import signal, SIGINT, SIGTERM, SIGHUP, SIGUSR1
 import pathlib
-from pathlib import Path
-from urwid_app import UrwidFrontend, suppress_stdout_stderr
+from process import suppress_stdout_stderr
+from camera import ZedCamera, SUCCESS
+from scheduling import Scheduling, current, IOPRIO_CLASSES
+from segments import Segments
+from run_id import allocate_run_id
+from frame_index import FrameIndexWriter, index_filename
+from export import FORMATS
+from profiles import load_profiles, PROFILES_FILE, DEFAULT_PROFILE
+from dashcam import Dashcam, POST_SECONDS
+from motion import MotionDetector, MOTION_PRE_SECONDS
+from metrics import TEXTFILE_INTERVAL
 
-def _counter():
+RECORDING_DIR = f'{pathlib.Path.home()}/Documents/ZED'
+STAT_INTERVAL = 30  # frames between checks of the recording size on disk
+PREVIEW_HEIGHT, PREVIEW_WIDTH = 36, 64
+PREVIEW_FPS = 4
+PREFLIGHT_BYTES = 256 * 2 ** 20  # bytes written to measure the disk's sustained write bandwidth
+BARRIER_TIMEOUT = 30.0  # seconds to wait for all cameras to open before giving up
+STANDBY_POLL = 0.05  # seconds between checks of the stop event while waiting in standby
+STALL_SECONDS = 5.0  # seconds without a new frame before a recorder is killed and restarted
+INTERRUPT_SECONDS = 30.0  # seconds a stopping recorder gets to finalize its recording before it is sent SIGINT
+KILL_SECONDS = 10.0  # seconds after SIGINT before a stopping recorder is killed
+INDEX_BATCH = 256  # frames per write to the frame index
+READ_BUDGET = 0.005  # most seconds a heartbeat spends reading a subprocess pipe
+METRICS_INTERVAL = 1.0  # seconds between updates of the metrics from the recorders' telemetry
+
+# exit codes of a recorder that fails, so the frontend can tell why
+EXIT_CAMERA_OPEN = 10  # the camera didn't open
+EXIT_ENABLE_RECORDING = 11  # recording couldn't be enabled, eg: the directory is missing or not writable
+EXIT_BARRIER = 12  # another camera failed to open, or didn't open within BARRIER_TIMEOUT
+
+
+def _counter(directory=None):
     """
     counter to keep track of run id
-    creates a file .run_id in the current directory which stores the most recent id
+    allocates the next id from the .run_id file in the recording directory, see run_id.allocate_run_id
+    """
+    return allocate_run_id(directory or RECORDING_DIR)
+
+
+def start_recording(transmit, event, camera=None, directory=None, status=None, preview=None, stats=None,
+                    run_id=None, tag=None, barrier=None, segment_seconds=None, segment_bytes=None,
+                    standby=False, requested_ns=None, index=True, pre_seconds=None, post_seconds=POST_SECONDS,
+                    ring_directory=None, motion=None):
+    """
+    Records from a camera until the event is set
+    :param transmit: multiprocess Pipe to the frontend, the frame count is sent every frame if there is no status block
+    :param event: multiprocess Event, set to stop recording
+    :param camera: CameraBackend to record from, defaults to the ZED camera
+    :param directory: directory to write recordings to, defaults to ~/Documents/ZED
+    :param status: StatusBlock to publish the recorder state to
+    :param preview: FrameRing to write downscaled preview frames to
+    :param stats: GrabStats to record grab timing to, a summary is written to {stem}.stats.json on exit
+    :param run_id: run id to record under, if None a new one is allocated
+    :param tag: appended to the run id to name the recording {run_id}_{tag}.svo, eg: the camera serial number
+    :param barrier: multiprocess Barrier shared with other recorders, recording starts when all cameras are open
+    :param segment_seconds: if set, roll over to a new segment file {stem}-{n:04d}.svo after this many seconds
+    :param segment_bytes: if set, roll over to a new segment file after this many bytes
+    :param standby: if True, open the camera then wait for ('start', run_id, requested_ns) to be sent down the
+        pipe before recording, so recording starts without waiting for the camera to open
+    :param requested_ns: time.monotonic_ns() when the recording was requested, to measure time to first frame
+    :param index: if True, write a frame index next to each recording file, {stem}.frames, see frame_index.py
+    :param pre_seconds: if set, record in dashcam mode, keeping only this many seconds in a ring until a trigger
+        is sent down the pipe, or SIGUSR1, see dashcam.py, segment_seconds and segment_bytes are ignored
+    :param post_seconds: seconds to record after a trigger in dashcam mode
+    :param ring_directory: where to keep the ring in dashcam mode, defaults to dashcam.RING_DIR
+    :param motion: motion.MotionDetector, if set, motion triggers recording in dashcam mode, keeping
+        MOTION_PRE_SECONDS before it if no pre_seconds is given, a summary is written to {stem}.motion.json on exit
     """
-    home = pathlib.Path.home()
-    run_id_pid = Path(f'{home}/Documents/ZED/.run_id')
-    count = 1
-    if run_id_pid.exists():
-        with run_id_pid.open('r+') as f:
-            last_id = int(f.readline())
-            last_id += 1
-            count = last_id
-            f.seek(0)
-            f.write(str(last_id))
-    else:
-        with run_id_pid.open('w+') as f:
-            f.write(str(count))
-    return count
-
-
-def start_recording(transmit, event):
+    if motion is not None and pre_seconds is None:
+        pre_seconds = MOTION_PRE_SECONDS
     with suppress_stdout_stderr():
-        import pyzed.sl as sl
-        cam = sl.Camera()
+        cam = camera if camera is not None else ZedCamera()
+        directory = directory or RECORDING_DIR
 
-        def handler(signal_received, frame):
+        frames_recorded = 0
+        stem = None
+        segments = None
+        dashcam = None
+        writer = None
+
+        def finish():
             cam.disable_recording()
+            if writer is not None:
+                writer.close()
+            if segments is not None:
+                segments.close(cam.bytes_written())
+            if dashcam is not None:
+                for message in dashcam.close(cam.bytes_written()):
+                    if status is not None:
+                        transmit.send(message)
+                if motion is not None and stem is not None:
+                    summary = motion.write_summary(f'{directory}/{stem}.motion.json', dashcam, frames_recorded)
+                    if status is not None:
+                        transmit.send(('motion', summary))
             cam.close()
+            if stats is not None and stem is not None:
+                stats.write_summary(f'{directory}/{stem}.stats.json', scheduling=current())
             sys.exit(0)
 
-        signal(SIGINT, handler)
+        def fail(code):
+            # release the other recorders waiting on the barrier
+            if barrier is not None:
+                barrier.abort()
+            exit(code)
 
-        frames_recorded = 0
-        home = pathlib.Path.home()
-        counter = _counter()
+        def handler(signal_received, frame):
+            finish()
+
+        def trigger(signal_received, frame):
+            if dashcam is not None:
+                dashcam.trigger()
 
-        filename = f'{home}/Documents/ZED/{counter}.svo'
+        # a service manager or closed terminal signals the whole process group, finalize the recording for those too
+        for signal_number in (SIGINT, SIGTERM, SIGHUP):
+            signal(signal_number, handler)
+        signal(SIGUSR1, trigger)
 
-        init = sl.InitParameters()
-        init.camera_resolution = sl.RESOLUTION.HD720
-        init.depth_mode = sl.DEPTH_MODE.NONE
+        err = cam.open()
+        if err != SUCCESS:
+            fail(EXIT_CAMERA_OPEN)
 
-        status = cam.open(init)
-        if status != sl.ERROR_CODE.SUCCESS:
-            exit(1)
+        if stats is not None:
+            stats.set_period(int(1e9 / cam.fps()) if cam.fps() > 0 else 0)
 
-        recording_param = sl.RecordingParameters(filename, sl.SVO_COMPRESSION_MODE.H264)
-        err = cam.enable_recording(recording_param)
-        if err != sl.ERROR_CODE.SUCCESS:
-            exit(1)
+        if standby:
+            # the camera is open, wait to be told to record
+            while not transmit.poll(STANDBY_POLL):
+                if event.wait(timeout=0):
+                    finish()
+            _, run_id, requested_ns = transmit.recv()
 
-        runtime = sl.RuntimeParameters()
+        counter = run_id if run_id is not None else _counter(directory)
+        stem = f'{counter}_{tag}' if tag is not None else f'{counter}'
 
+        filename = f'{directory}/{stem}.svo'
+        if pre_seconds is not None:
+            dashcam = Dashcam(directory, stem, pre_seconds, post_seconds=post_seconds, ring_directory=ring_directory)
+            filename = dashcam.open(1)
+        elif segment_seconds is not None or segment_bytes is not None:
+            segments = Segments(directory, stem, max_seconds=segment_seconds, max_bytes=segment_bytes)
+            filename = segments.open(1)
+
+        err = cam.enable_recording(filename)
+        if err != SUCCESS:
+            fail(EXIT_ENABLE_RECORDING)
+        if index:
+            writer = FrameIndexWriter(index_filename(filename), batch=INDEX_BATCH)
+
+        if barrier is not None:
+            try:
+                barrier.wait(BARRIER_TIMEOUT)
+            except BrokenBarrierError:
+                cam.disable_recording()
+                cam.close()
+                exit(EXIT_BARRIER)
+
+        bytes_written = 0
         while True:
-            if cam.grab(runtime) == sl.ERROR_CODE.SUCCESS:
+            start = time.perf_counter_ns()
+            err = cam.grab()
+            if stats is not None:
+                stats.record_grab(time.perf_counter_ns() - start, err)
+            if err == SUCCESS:
                 frames_recorded += 1
+                if frames_recorded == 1 and stats is not None and requested_ns is not None:
+                    stats.set_start_latency(time.monotonic_ns() - requested_ns)
+                if stats is not None or segments is not None or dashcam is not None or writer is not None:
+                    timestamp = cam.timestamp()
+                    if stats is not None:
+                        stats.record_frame(timestamp)
+                    if segments is not None:
+                        segments.frame(frames_recorded, timestamp)
+                    if dashcam is not None:
+                        dashcam.frame(frames_recorded, timestamp)
+                    if writer is not None:
+                        writer.append(frames_recorded, timestamp, time.monotonic_ns())
+                if frames_recorded % STAT_INTERVAL == 0:
+                    bytes_written = cam.bytes_written()
+                if segments is not None and segments.due(bytes_written):
+                    # rotate between two grabs, so the next frame grabbed is the first of the new segment, frames the
+                    # camera captures while the files are swapped are lost, the manifest records the gap
+                    cam.disable_recording()
+                    segments.close(cam.bytes_written())
+                    filename = segments.open(frames_recorded + 1)
+                    err = cam.enable_recording(filename)
+                    if err != SUCCESS:
+                        fail(EXIT_ENABLE_RECORDING)
+                    if writer is not None:
+                        writer.close()
+                        writer = FrameIndexWriter(index_filename(filename), batch=INDEX_BATCH)
+                    bytes_written = 0
+                if motion is not None and frames_recorded % motion.stride == 0:
+                    start = time.perf_counter_ns()
+                    if motion.update(cam.retrieve_image()):
+                        dashcam.trigger()
+                    motion.account(time.perf_counter_ns() - start)
+                if dashcam is not None:
+                    while status is not None and transmit.poll():
+                        message = transmit.recv()
+                        if message[0] == 'trigger':
+                            dashcam.trigger(message[1])
+                    if dashcam.due():
+                        # the frame index is closed before rotating, the ring's files may be moved with their index
+                        cam.disable_recording()
+                        if writer is not None:
+                            writer.close()
+                        filename, message = dashcam.rotate(frames_recorded + 1, cam.bytes_written())
+                        err = cam.enable_recording(filename)
+                        if err != SUCCESS:
+                            fail(EXIT_ENABLE_RECORDING)
+                        if index:
+                            writer = FrameIndexWriter(index_filename(filename), batch=INDEX_BATCH)
+                        if message is not None and status is not None:
+                            transmit.send(message)
+                        bytes_written = 0
+                    for message in dashcam.poll():
+                        if status is not None:
+                            transmit.send(message)
+                if preview is not None and frames_recorded % preview.stride == 0:
+                    start = time.perf_counter_ns()
+                    preview.write(cam.retrieve_image())
+                    preview.account(time.perf_counter_ns() - start)
+            if status is not None:
+                total_bytes = bytes_written + (segments.closed_bytes if segments is not None else 0)
+                if dashcam is not None:
+                    total_bytes = dashcam.kept_bytes(bytes_written)
+                status.publish(frames_recorded, time.monotonic_ns(), total_bytes, err)
+            elif err == SUCCESS:
                 transmit.send(frames_recorded)
 
             if event.wait(timeout=0):
-                cam.disable_recording()
-                cam.close()
-                sys.exit(0)
+                finish()
 
 
 if __name__ == "__main__":
+    # the frontends are only imported to run them, so recorders can be run without urwid, see headless.py
+    from app import RecordingApp, AsyncioRecordingApp
 
-    class RecordingApp(UrwidFrontend):
-        def __init__(self):
-            super().__init__('SVO Recorder')
-            choices = ['Stop Recording']
-            self.add_subprocess('Recording', start_recording, choices)
-
-        def handle_button(self, button, choice):
-
-            if choice == 'Recording':
-                self.main.original_widget = self.subprocess_menu['Recording'].menu()
-                self.subprocess['Recording'].fork()
-
-            if choice == 'Stop Recording' or choice == 'Return to Main':
-                self.subprocess['Recording'].stop()
-                self.main.original_widget = self.main_menu.menu()
-
-            super().handle_button(button, choice)
-
-        def heartbeat(self):
-            """
-            heartbeat that runs 24 times per second
-            """
-
-            # read from the process
-            self.subprocess_menu['Recording'].item.append(self.subprocess['Recording'].read_pipe())
+    parser = argparse.ArgumentParser(description='SVO recorder')
+    parser.add_argument('--serials', nargs='+', default=None,
+                        help='serial numbers of the cameras to record, defaults to the first camera found')
+    parser.add_argument('--cpus', nargs='+', default=None,
+                        help='comma separated cpus to pin each camera recorder to, eg: --cpus 2,3 4,5')
+    parser.add_argument('--segment_minutes', type=float, default=None,
+                        help='split recordings into segments of this many minutes')
+    parser.add_argument('--segment_gb', type=float, default=None,
+                        help='split recordings into segments of this many gigabytes')
+    parser.add_argument('--preflight_mb', type=float, default=PREFLIGHT_BYTES / 2 ** 20,
+                        help='megabytes to write when measuring disk bandwidth before the first recording, 0 to skip')
+    parser.add_argument('--standby', action='store_true',
+                        help='open the cameras ahead of time, so recording starts as soon as it is requested')
+    parser.add_argument('--stall_seconds', type=float, default=STALL_SECONDS,
+                        help='restart a recorder that records no frames for this many seconds, 0 to never restart')
+    parser.add_argument('--interrupt_seconds', type=float, default=INTERRUPT_SECONDS,
+                        help='seconds a stopping recorder gets to finalize its recording before it is sent SIGINT')
+    parser.add_argument('--kill_seconds', type=float, default=KILL_SECONDS,
+                        help='seconds after SIGINT before a stopping recorder is killed')
+    parser.add_argument('--export_format', choices=FORMATS, default='mp4',
+                        help='format the Export menu exports recordings to')
+    parser.add_argument('--export_processes', type=int, default=None,
+                        help='recordings to export at once, defaults to half the cpus')
+    parser.add_argument('--replay', default=None,
+                        help='recording the Replay menu plays back, defaults to the most recent recording')
+    parser.add_argument('--profiles', default=PROFILES_FILE,
+                        help='JSON file of recording profiles, adding to and overriding the built in profiles')
+    parser.add_argument('--profile', default=DEFAULT_PROFILE,
+                        help='recording profile to start with, others can be chosen from the Profiles menu')
+    parser.add_argument('--metrics_port', type=int, default=None,
+                        help='serve OpenMetrics of recorder health on this local port, eg: 9105')
+    parser.add_argument('--metrics_textfile', default=None,
+                        help='write OpenMetrics of recorder health to this file, for the node_exporter textfile '
+                             'collector')
+    parser.add_argument('--metrics_interval', type=float, default=TEXTFILE_INTERVAL,
+                        help='seconds between writes of the metrics textfile')
+    parser.add_argument('--pre_seconds', type=float, default=None,
+                        help='dashcam mode, keep only this many seconds before a trigger, from the Trigger button')
+    parser.add_argument('--post_seconds', type=float, default=POST_SECONDS,
+                        help='seconds to record after a trigger in dashcam mode')
+    parser.add_argument('--ring_directory', default=None,
+                        help='where to keep the pre-trigger ring, defaults to tmpfs in /dev/shm')
+    parser.add_argument('--motion', action='store_true',
+                        help='record only around motion, in dashcam mode, see motion.py')
+    parser.add_argument('--motion_roi', type=float, nargs=4, default=None,
+                        help='region motion is looked for in, left top right bottom as fractions of the frame')
+    parser.add_argument('--motion_threshold', type=float, default=0.01,
+                        help='fraction of pixels that must change for motion, it stops below a quarter of this')
+    parser.add_argument('--motion_stride', type=int, default=2, help='frames grabbed per frame looked at for motion')
+    parser.add_argument('--nice', type=int, default=None,
+                        help='nice level of the recorders, negative to run ahead of other work, needs CAP_SYS_NICE')
+    parser.add_argument('--fifo', type=int, default=None,
+                        help='run the recorders SCHED_FIFO at this priority, 1 - 99, if permitted, else at --nice')
+    parser.add_argument('--ioclass', choices=IOPRIO_CLASSES[1:], default=None, help='I/O class of the recorders')
+    parser.add_argument('--iolevel', type=int, default=4, help='I/O priority of the recorders in their class, 0 - 7')
+    parser.add_argument('--asyncio', action='store_true',
+                        help='run the frontend on an asyncio event loop')
+    args = parser.parse_args()
+    cpus = [{int(cpu) for cpu in cpu_set.split(',')} for cpu_set in args.cpus] if args.cpus else None
+    segment_seconds = args.segment_minutes * 60 if args.segment_minutes else None
+    segment_bytes = int(args.segment_gb * 1e9) if args.segment_gb else None
+    profiles = load_profiles(args.profiles)
+    if args.profile not in profiles:
+        parser.error(f'unknown profile {args.profile}, choose from {", ".join(profiles)}')
 
-            # display it
-            item = self.subprocess_menu['Recording'].item
-            self.subprocess_menu['Recording'].update(['Recording...\n', f'{item} frames\n', ])
-            self.loop.draw_screen()
-            super().heartbeat()
+    motion = MotionDetector(roi=args.motion_roi, on_threshold=args.motion_threshold,
+                            off_threshold=args.motion_threshold / 4, stride=args.motion_stride) if args.motion else None
 
-    app = RecordingApp()
-    app.run()
\ No newline at end of file
+    app_class = AsyncioRecordingApp if args.asyncio else RecordingApp
+    app = app_class(serials=args.serials, cpus=cpus, segment_seconds=segment_seconds, segment_bytes=segment_bytes,
+                    preflight_bytes=int(args.preflight_mb * 2 ** 20), standby=args.standby,
+                    stall_seconds=args.stall_seconds or None, interrupt_seconds=args.interrupt_seconds,
+                    kill_seconds=args.kill_seconds, export_format=args.export_format,
+                    export_processes=args.export_processes, replay=args.replay,
+                    profiles=profiles, profile=args.profile, metrics_port=args.metrics_port,
+                    metrics_textfile=args.metrics_textfile, metrics_interval=args.metrics_interval,
+                    pre_seconds=args.pre_seconds, post_seconds=args.post_seconds, ring_directory=args.ring_directory,
+                    motion=motion, scheduling=Scheduling(nice=args.nice, fifo=args.fifo, ioclass=args.ioclass,
+                                                         iolevel=args.iolevel))
+    app.run()
@@ -0,0 +1,287 @@
+"""
+Recorder health metrics, kept in a registry in the frontend process and rendered in the OpenMetrics text format
+
+The registry is fed from what the frontend already reads each heartbeat, the recorders' StatusBlocks and GrabStats
+in shared memory, the disk monitor and the watchdog, so metrics add no IPC to the recorders.  It can be scraped
+from a local HTTP endpoint, and written to a file for node_exporter's textfile collector, eg:
+
+    python main.py --metrics_port 9105 --metrics_textfile /var/lib/node_exporter/textfile_collector/recorder.prom
+"""
+import os
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from stats import BINS, bin_value
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+TEXTFILE_INTERVAL = 15.0  # seconds between writes of the textfile
+LATENCY_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0]  # seconds
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra is not None else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    def __init__(self, name, kind, help, buckets=None):
+        """
+        A metric family, its samples are kept per set of labels
+        :param name: metric name, without the _total suffix for a counter
+        :param kind: 'counter', 'gauge' or 'histogram'
+        :param help: one line description
+        :param buckets: upper bounds of a histogram's buckets, +Inf is added
+        """
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.buckets = list(buckets or []) + [float('inf')] if kind == 'histogram' else None
+        self.samples = {}  # sorted label items -> value, or for a histogram [bucket counts, sum]
+
+    def set(self, value, **labels):
+        self.samples[tuple(sorted(labels.items()))] = value
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.samples[key] = self.samples.get(key, 0) + amount
+
+    def add(self, counts, total, **labels):
+        """
+        Adds observations to a histogram
+        :param counts: observations in each bucket, not cumulative, one more than buckets for +Inf
+        :param total: sum of the observations
+        """
+        key = tuple(sorted(labels.items()))
+        sample = self.samples.setdefault(key, [np.zeros(len(self.buckets), dtype=np.int64), 0.0])
+        sample[0] += counts
+        sample[1] += total
+
+    def render(self):
+        """
+        :return: list of lines in the OpenMetrics text format
+        """
+        lines = [f'# TYPE {self.name} {self.kind}', f'# HELP {self.name} {_escape(self.help)}']
+        for labels, value in sorted(self.samples.items()):
+            if self.kind == 'counter':
+                lines += [f'{self.name}_total{_labels(labels)} {_number(value)}']
+            elif self.kind == 'gauge':
+                lines += [f'{self.name}{_labels(labels)} {_number(value)}']
+            else:
+                counts, total = value
+                for bound, count in zip(self.buckets, np.cumsum(counts).tolist()):
+                    lines += [f'{self.name}_bucket{_labels(labels, ("le", _number(float(bound))))} {count}']
+                lines += [f'{self.name}_count{_labels(labels)} {int(counts.sum())}',
+                          f'{self.name}_sum{_labels(labels)} {_number(float(total))}']
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        """
+        Metrics by name, updates and renders hold the lock, as the HTTP endpoint renders from its own thread
+        """
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def metric(self, name, kind, help, buckets=None):
+        if name not in self.metrics:
+            self.metrics[name] = Metric(name, kind, help, buckets)
+        return self.metrics[name]
+
+    def counter(self, name, help):
+        return self.metric(name, 'counter', help)
+
+    def gauge(self, name, help):
+        return self.metric(name, 'gauge', help)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self.metric(name, 'histogram', help, buckets)
+
+    def render(self):
+        """
+        :return: every metric in the OpenMetrics text format
+        """
+        with self.lock:
+            lines = [line for metric in self.metrics.values() for line in metric.render()]
+        return '\n'.join(lines + ['# EOF']) + '\n'
+
+    def write_textfile(self, filename):
+        """
+        Writes the metrics to filename atomically, so a collector never reads a partial file
+        """
+        temp = f'{filename}.tmp'
+        with open(temp, 'w') as f:
+            f.write(self.render())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, filename)
+
+
+def _bucket_of_bins(buckets, unit):
+    """
+    :return: for each GrabStats bin, the index of the first bucket its whole range fits in, so a bin straddling a
+        bucket bound is counted in the bucket above
+    """
+    upper = np.array([bin_value(index + 1) for index in range(BINS - 1)] + [np.inf]) * unit
+    return np.searchsorted(np.array(buckets + [np.inf]), upper, side='left')
+
+
+class RecorderMetrics:
+    def __init__(self, registry=None, buckets=LATENCY_BUCKETS):
+        """
+        Mirrors the recorders' telemetry into a registry
+
+        The recorders' counters start from zero each time a recorder is forked, so they are added to the registry
+        as the change since the last update, which keeps the exported counters increasing across restarts.
+        """
+        self.registry = registry or Registry()
+        registry = self.registry
+        self.up = registry.gauge('recorder_up', 'recorder process is running')
+        self.frames = registry.counter('recorder_frames', 'frames recorded')
+        self.dropped = registry.counter('recorder_dropped_frames', 'frames the camera dropped, from timestamp gaps')
+        self.failed = registry.counter('recorder_failed_grabs', 'grabs that returned an error')
+        self.bytes = registry.counter('recorder_written_bytes', 'bytes of recordings written')
+        self.fps = registry.gauge('recorder_fps', 'frames recorded a second, over about the last second')
+        self.backlog = registry.gauge('recorder_pipe_backlog_bytes', 'bytes sent by the recorder not yet read')
+        self.latency = registry.histogram('recorder_grab_latency_seconds', 'time grab took', buckets)
+        self.interval = registry.histogram('recorder_frame_interval_seconds', 'time between camera timestamps',
+                                           buckets)
+        self.restarts = registry.counter('recorder_restarts', 'recorders restarted after stalling')
+        self.seconds_lost = registry.gauge('recorder_seconds_lost', 'seconds not recorded because of restarts')
+        self.disk_free = registry.gauge('recorder_disk_free_bytes', 'free space on the recording disk')
+        self.disk_rate = registry.gauge('recorder_disk_write_bytes_per_second', 'rate recordings are written at')
+        self.bins = _bucket_of_bins(buckets, 1e-6)  # GrabStats bins are microseconds
+        self.midpoints = np.array([(bin_value(index) + bin_value(index + 1)) / 2 for index in range(BINS)]) * 1e-6
+        self.last = {}  # (camera, field) -> counter value at the last update
+        self.rates = {}  # camera -> (monotonic time, frames) the fps was last measured from
+
+    def delta(self, camera, field, value):
+        last = self.last.get((camera, field), 0)
+        self.last[(camera, field)] = value
+        if value < last:
+            # the recorder was restarted, and its counters with it
+            return value
+        return value - last
+
+    def histogram(self, metric, camera, field, bins):
+        bins = bins.copy()
+        last = self.last.get((camera, field))
+        self.last[(camera, field)] = bins
+        counts = bins if last is None or (bins < last).any() else bins - last
+        buckets = np.bincount(self.bins, weights=counts, minlength=len(metric.buckets)).astype(np.int64)
+        metric.add(buckets, float(np.dot(counts, self.midpoints)), camera=camera)
+
+    def update(self, camera, subprocess, now=None):
+        """
+        Call each heartbeat with each recorder
+        :param camera: name of the recorder, the camera label of its metrics
+        :param subprocess: urwid_app.SubProcess running the recorder
+        :param now: monotonic time, defaults to now
+        """
+        now = time.monotonic() if now is None else now
+        status = subprocess.read_status()
+        stats = subprocess.blocks.get('stats')
+        with self.registry.lock:
+            self.up.set(int(subprocess.is_alive()), camera=camera)
+            self.backlog.set(subprocess.backlog(), camera=camera)
+            if status is not None:
+                self.frames.inc(self.delta(camera, 'frames', status.frames), camera=camera)
+                self.bytes.inc(self.delta(camera, 'bytes', status.bytes_written), camera=camera)
+                last, last_frames = self.rates.get(camera, (now, status.frames))
+                if status.frames < last_frames:
+                    last, last_frames = now, status.frames
+                if now - last >= 1.0:
+                    self.fps.set((status.frames - last_frames) / (now - last), camera=camera)
+                    last, last_frames = now, status.frames
+                self.rates[camera] = (last, last_frames)
+            if stats is not None:
+                # the counters, not stats.summary(), which works out percentiles the metrics don't need
+                _, dropped, failed = stats.counters[:3].tolist()
+                self.dropped.inc(self.delta(camera, 'dropped', dropped), camera=camera)
+                self.failed.inc(self.delta(camera, 'failed', failed), camera=camera)
+                self.histogram(self.latency, camera, 'latency', stats.latency)
+                self.histogram(self.interval, camera, 'interval', stats.interval)
+
+    def update_disk(self, disk):
+        """
+        :param disk: disk.DiskMonitor of the recording directory
+        """
+        with self.registry.lock:
+            self.disk_free.set(disk.free)
+            self.disk_rate.set(disk.rate)
+
+    def update_watchdog(self, watchdog):
+        """
+        :param watchdog: watchdog.Watchdog supervising the recorders
+        """
+        with self.registry.lock:
+            self.restarts.inc(self.delta(None, 'restarts', watchdog.restarts))
+            self.seconds_lost.set(watchdog.seconds_lost())
+
+
+class MetricsServer:
+    def __init__(self, registry, port, host='127.0.0.1'):
+        """
+        Serves the registry over HTTP from a background thread, at any path, eg: http://127.0.0.1:9105/metrics
+        :param port: port to listen on, 0 for any free port, see self.port
+        :param host: address to listen on, defaults to local connections only
+        """
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TextfileWriter:
+    def __init__(self, registry, filename, interval=TEXTFILE_INTERVAL):
+        """
+        Writes the registry to filename every interval seconds from a background thread, atomically
+        """
+        self.registry = registry
+        self.filename = filename
+        self.interval = interval
+        self.closing = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.closing.wait(self.interval):
+            self.registry.write_textfile(self.filename)
+
+    def close(self):
+        """
+        stops the thread, and writes the metrics one last time
+        """
+        self.closing.set()
+        self.thread.join()
+        self.registry.write_textfile(self.filename)
@@ -0,0 +1,128 @@
+"""
+Motion triggered recording, for long unattended sessions where most of the footage is static
+
+The recorder runs in dashcam mode, see dashcam.py, and a MotionDetector looks at every stride'th frame.  Frames are
+downsampled by strided slicing to about MOTION_WIDTH pixels wide and converted to grey, and the motion score is the
+fraction of pixels in the region of interest whose grey level changed by more than pixel_delta since the last frame
+looked at.  Motion turns on after on_count scores in a row above on_threshold, and off after off_count scores in a
+row below off_threshold, and while it is on the recorder triggers the dashcam, so an event keeps the seconds
+before the motion started and carries on for post_seconds after it stopped.
+
+Like the preview, the detector measures what it costs the grab loop, and doubles its stride whenever a frame takes
+longer than budget_ns, so it never limits the frame rate.  The recorder writes {stem}.motion.json when it stops,
+with the detector's counts and the fraction of frames and bytes kept.
+"""
+import json
+import numpy as np
+
+MOTION_WIDTH = 160  # frames are downsampled to about this many pixels wide
+MOTION_PRE_SECONDS = 2.0  # seconds before motion kept, when no pre_seconds is given
+
+
+class MotionDetector:
+    def __init__(self, roi=None, on_threshold=0.01, off_threshold=0.0025, pixel_delta=12, on_count=2, off_count=4,
+                 stride=2, width=MOTION_WIDTH, budget_ns=2000000):
+        """
+        :param roi: (left, top, right, bottom) region of interest as fractions of the frame, None for all of it
+        :param on_threshold: fraction of the region's pixels that must change to count towards motion on
+        :param off_threshold: fraction of changed pixels below which a score counts towards motion off
+        :param pixel_delta: change in grey level, 0 - 255, for a pixel to count as changed
+        :param on_count: scores in a row above on_threshold to turn motion on
+        :param off_count: scores in a row below off_threshold to turn motion off
+        :param stride: frames grabbed per frame looked at
+        :param width: frames are downsampled to about this many pixels wide
+        :param budget_ns: most time a frame may take out of the grab loop before the stride is doubled
+        """
+        if off_threshold > on_threshold:
+            raise ValueError('off_threshold must not be more than on_threshold')
+        self.roi = roi
+        self.on_threshold = on_threshold
+        self.off_threshold = off_threshold
+        self.pixel_delta = pixel_delta
+        self.on_count = on_count
+        self.off_count = off_count
+        self.stride = stride
+        self.width = width
+        self.budget_ns = budget_ns
+        self.previous = None
+        self.moving = False
+        self.run = 0  # scores in a row counting towards the other state
+        self.score = 0.0
+        self.analysed = 0
+        self.analysed_moving = 0
+        self.episodes = 0
+        self.max_cost = 0
+        self.total_cost = 0
+
+    def grey(self, image):
+        """
+        :param image: (H, W, 3 or 4) uint8 BGR(A) frame
+        :return: (h, w) int16 view of the region of interest, downsampled, grey levels 0 - 1020
+        """
+        step = max(1, image.shape[1] // self.width)
+        small = image[::step, ::step]
+        if self.roi is not None:
+            height, width = small.shape[:2]
+            left, top, right, bottom = self.roi
+            small = small[int(top * height):max(int(bottom * height), int(top * height) + 1),
+                          int(left * width):max(int(right * width), int(left * width) + 1)]
+        # b + 2g + r, a cheap luma that stays in integers
+        green = small[:, :, 1].astype(np.int16)
+        return small[:, :, 0] + 2 * green + small[:, :, 2]
+
+    def update(self, image):
+        """
+        Scores a frame against the last one looked at, and moves the motion state on
+        :param image: (H, W, 3 or 4) uint8 BGR(A) frame
+        :return: True while there is motion
+        """
+        grey = self.grey(image)
+        if self.previous is not None and self.previous.shape == grey.shape:
+            changed = np.count_nonzero(np.abs(grey - self.previous) > 4 * self.pixel_delta)
+            self.score = float(changed) / grey.size
+            if self.moving:
+                self.run = self.run + 1 if self.score < self.off_threshold else 0
+                if self.run >= self.off_count:
+                    self.moving, self.run = False, 0
+            else:
+                self.run = self.run + 1 if self.score > self.on_threshold else 0
+                if self.run >= self.on_count:
+                    self.moving, self.run = True, 0
+                    self.episodes += 1
+        self.previous = grey
+        self.analysed += 1
+        self.analysed_moving += self.moving
+        return self.moving
+
+    def account(self, cost_ns):
+        """
+        Records what the last frame cost the grab loop, and backs off if it went over budget
+        """
+        self.max_cost = max(self.max_cost, cost_ns)
+        self.total_cost += cost_ns
+        if cost_ns > self.budget_ns:
+            self.stride *= 2
+
+    def summary(self):
+        """
+        :return: dict of frames looked at, the fraction with motion, motion episodes, the stride and the cost in ms
+        """
+        return {'analysed': self.analysed, 'moving_fraction': self.analysed_moving / max(self.analysed, 1),
+                'episodes': self.episodes, 'stride': self.stride,
+                'cost_mean_ms': self.total_cost / max(self.analysed, 1) / 1e6, 'cost_max_ms': self.max_cost / 1e6}
+
+    def write_summary(self, filename, dashcam, frames):
+        """
+        Writes the detector's summary, with the fraction of frames recorded and the storage saved
+        :param dashcam: dashcam.Dashcam the recorder kept events with
+        :param frames: frames grabbed
+        :return: the summary written
+        """
+        summary = self.summary()
+        summary.update({'frames': frames, 'frames_kept': dashcam.kept_frames,
+                        'recorded_fraction': dashcam.kept_frames / max(frames, 1),
+                        'bytes_written': dashcam.written_bytes, 'bytes_kept': dashcam.closed_bytes,
+                        'storage_saved': 1 - dashcam.closed_bytes / max(dashcam.written_bytes, 1)})
+        with open(filename, 'w') as f:
+            json.dump(summary, f, indent=2)
+        return summary
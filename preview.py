@@ -0,0 +1,137 @@
+import struct
+from multiprocessing import shared_memory
+import numpy as np
+
+
+def downscale(image, height, width):
+    """
+    Nearest neighbour downscale by strided slicing, returns a view, no pixels are copied
+    :param image: (H, W, C) array
+    :return: (height, width, C) view of image, smaller if image is, as it isn't scaled up
+    """
+    step_y = max(1, image.shape[0] // height)
+    step_x = max(1, image.shape[1] // width)
+    return image[:step_y * height:step_y, :step_x * width:step_x]
+
+
+class FrameRing:
+    """
+    Fixed size ring of small RGB frames in shared memory, written by the recorder and read by the frontend
+
+    The writer never waits, when the reader falls behind old slots are overwritten.  Each slot carries its own
+    sequence number, odd while the slot is being written, so the reader can detect a torn read and retry.  Like
+    status.StatusBlock this relies on x86 keeping stores in order, on ARM a preview can rarely be torn, which only
+    shows as a glitch in one preview frame, so the slots aren't checksummed.
+
+    The writer measures what each preview costs the grab loop, and if a preview takes longer than budget_ns,
+    doubles the number of frames between previews.
+    """
+    HEADER = struct.Struct('<QQQQQ')  # frames written, stride, last cost ns, max cost ns, total cost ns
+    SEQUENCE = struct.Struct('<Q')
+    RETRIES = 10
+
+    def __init__(self, height=36, width=64, slots=4, stride=6, budget_ns=2000000, name=None):
+        """
+        :param height: preview height in pixels
+        :param width: preview width in pixels
+        :param slots: number of frames in the ring
+        :param stride: frames grabbed per preview written
+        :param budget_ns: most time a preview may take out of the grab loop before the stride is increased
+        :param name: name of an existing ring to attach to, if None a new ring is created
+        """
+        self.height = height
+        self.width = width
+        self.slots = slots
+        self.budget_ns = budget_ns
+        self.frame_bytes = height * width * 3
+        self.slot_size = self.SEQUENCE.size + self.frame_bytes
+        size = self.HEADER.size + slots * self.slot_size
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.HEADER.pack_into(self.shm.buf, 0, 0, stride, 0, 0, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.frames = [np.ndarray((height, width, 3), dtype=np.uint8, buffer=self.shm.buf,
+                                  offset=self.offset(i) + self.SEQUENCE.size) for i in range(slots)]
+        self.written, self.stride, self.last_cost, self.max_cost, self.total_cost = \
+            self.HEADER.unpack_from(self.shm.buf, 0)
+
+    def __getstate__(self):
+        return {'height': self.height, 'width': self.width, 'slots': self.slots, 'budget_ns': self.budget_ns,
+                'name': self.shm.name}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def offset(self, slot):
+        return self.HEADER.size + slot * self.slot_size
+
+    def write(self, image):
+        """
+        Downscales a BGR or BGRA image into the next slot, called from the recorder
+        :param image: (H, W, 3 or 4) uint8 array in BGR(A) order
+        """
+        slot = self.written % self.slots
+        offset = self.offset(slot)
+        sequence, = self.SEQUENCE.unpack_from(self.shm.buf, offset)
+        self.SEQUENCE.pack_into(self.shm.buf, offset, sequence + 1)
+        small = downscale(image, self.height, self.width)[:, :, 2::-1]
+        frame = self.frames[slot]
+        if small.shape[:2] != frame.shape[:2]:
+            # an image smaller than the preview is shown at its own size, in the top left
+            frame[:] = 0
+            frame = frame[:small.shape[0], :small.shape[1]]
+        np.copyto(frame, small)
+        self.SEQUENCE.pack_into(self.shm.buf, offset, sequence + 2)
+        self.written += 1
+        self.publish()
+
+    def account(self, cost_ns):
+        """
+        Records what the last preview cost the grab loop, and backs off if it went over budget
+        """
+        self.last_cost = cost_ns
+        self.max_cost = max(self.max_cost, cost_ns)
+        self.total_cost += cost_ns
+        if cost_ns > self.budget_ns:
+            self.stride *= 2
+        self.publish()
+
+    def publish(self):
+        self.HEADER.pack_into(self.shm.buf, 0, self.written, self.stride, self.last_cost, self.max_cost,
+                              self.total_cost)
+
+    def stats(self):
+        """
+        :return: frames written, stride, last cost ns, max cost ns, mean cost ns
+        """
+        written, stride, last_cost, max_cost, total_cost = self.HEADER.unpack_from(self.shm.buf, 0)
+        return written, stride, last_cost, max_cost, total_cost // max(written, 1)
+
+    def latest(self):
+        """
+        Copies out the newest frame, called from the frontend
+        :return: (height, width, 3) RGB array, or None if nothing has been written or every read was torn
+        """
+        for _ in range(self.RETRIES):
+            written = self.HEADER.unpack_from(self.shm.buf, 0)[0]
+            if written == 0:
+                return None
+            slot = (written - 1) % self.slots
+            offset = self.offset(slot)
+            start, = self.SEQUENCE.unpack_from(self.shm.buf, offset)
+            if start % 2 == 1:
+                continue
+            frame = self.frames[slot].copy()
+            end, = self.SEQUENCE.unpack_from(self.shm.buf, offset)
+            if start == end:
+                return frame
+        return None
+
+    def close(self):
+        # the numpy views must be released before the shared memory can be
+        self.frames = []
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
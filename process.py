@@ -0,0 +1,333 @@
+import os
+import sys
+import time
+import fcntl
+import signal
+import termios
+from array import array
+from functools import partial
+from multiprocessing import Process, Pipe, Event, connection
+from status import StatusBlock
+from ipc import read_messages
+from scheduling import current
+
+
+class suppress_stdout_stderr(object):
+    """
+    Supresses the stdout and stderr by piping them to dev null...
+    The same place I send bad faith replies to my tweets
+    """
+    def __enter__(self):
+        self.outnull_file = open(os.devnull, 'w')
+        self.errnull_file = open(os.devnull, 'w')
+
+        self.old_stdout_fileno_undup = sys.stdout.fileno()
+        self.old_stderr_fileno_undup = sys.stderr.fileno()
+
+        self.old_stdout_fileno = os.dup(sys.stdout.fileno())
+        self.old_stderr_fileno = os.dup(sys.stderr.fileno())
+
+        self.old_stdout = sys.stdout
+        self.old_stderr = sys.stderr
+
+        os.dup2(self.outnull_file.fileno(), self.old_stdout_fileno_undup)
+        os.dup2(self.errnull_file.fileno(), self.old_stderr_fileno_undup)
+
+        sys.stdout = self.outnull_file
+        sys.stderr = self.errnull_file
+        return self
+
+    def __exit__(self, *_):
+        sys.stdout = self.old_stdout
+        sys.stderr = self.old_stderr
+
+        os.dup2(self.old_stdout_fileno, self.old_stdout_fileno_undup)
+        os.dup2(self.old_stderr_fileno, self.old_stderr_fileno_undup)
+
+        os.close(self.old_stdout_fileno)
+        os.close(self.old_stderr_fileno)
+
+        self.outnull_file.close()
+        self.errnull_file.close()
+
+
+def _append(item, message):
+    item.append(message)
+    return item
+
+
+def _latest(item, message):
+    return message
+
+
+def _scheduled(scheduling, main, *args, **kwargs):
+    # nothing to report the warnings to yet, what the process got can be read with SubProcess.read_scheduling
+    scheduling.apply()
+    return main(*args, **kwargs)
+
+
+class Shutdown:
+    """
+    Times the phases of stopping a subprocess, it is asked to exit by setting its event, then interrupted with
+    SIGINT, then killed with SIGKILL, each phase lasts until the next begins or the process exits
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phase = 'event'
+        self.phase_started = self.started
+        self.timings = {}
+        self.finished = None
+
+    def escalate(self, phase):
+        """
+        :param phase: 'interrupt' or 'kill'
+        """
+        now = time.monotonic()
+        self.timings[self.phase] = now - self.phase_started
+        self.phase, self.phase_started = phase, now
+
+    def exited(self):
+        self.finished = time.monotonic()
+        self.timings[self.phase] = self.finished - self.phase_started
+        self.timings['total'] = self.finished - self.started
+        self.phase = 'exited'
+
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def text(self):
+        """
+        :return: the current phase and how long it has taken, for display
+        """
+        if self.phase == 'exited':
+            timings = ', '.join(f'{phase} {seconds:.1f} s' for phase, seconds in self.timings.items())
+            return f'stopped: {timings}'
+        return f'finalizing: waiting on {self.phase} {time.monotonic() - self.phase_started:.1f} s, ' \
+               f'{self.elapsed():.1f} s total'
+
+
+class SubProcess:
+    def __init__(self, main, status=False, on_fork=None, shared=None):
+        """
+        Handles forking, stopping and communication with a subprocess
+        :param main: subprocess method to run method signature is
+
+            def main(transmit, stop_process):
+                transmit: is a multiprocess Pipe to send data to parent process
+                stop_process: is multiprocess Event to set when you want the process to exit
+
+        :param status: if True, a StatusBlock is created on each fork and passed to main as main(..., status=block)
+        :param on_fork: called with no arguments after the process starts
+        :param shared: dict of keyword -> factory for shared memory blocks, each fork a new block is created
+            with the factory and passed to main as main(..., keyword=block), blocks need close() and unlink()
+        """
+        self.main = main
+        self.on_fork = on_fork
+        self.recv, self.transmit = None, None
+        self.stop_process = None
+        self.proc = None
+        self.shutdown = None
+        self.scheduling = None
+        self.shared = dict(shared or {})
+        if status:
+            self.shared['status'] = StatusBlock
+        self.blocks = {}
+
+    @property
+    def status_block(self):
+        return self.blocks.get('status')
+
+    def fork(self, scheduling=None, **kwargs):
+        """
+        Forks and starts the subprocess
+        :param scheduling: scheduling.Scheduling to run this run with, cpus, priority and I/O priority, applied in
+            the process before main is called, None to inherit the frontend's
+        :param kwargs: extra keyword arguments to pass to main for this run
+        """
+        self.recv, self.transmit = Pipe(duplex=True)
+        self.stop_process = Event()
+        self.shutdown = None
+        self.close()
+        self.blocks = {keyword: factory() for keyword, factory in self.shared.items()}
+        kwargs.update(self.blocks)
+        self.scheduling = scheduling
+        target = self.main if scheduling is None else partial(_scheduled, scheduling, self.main)
+        self.proc = Process(target=target, args=(self.transmit, self.stop_process), kwargs=kwargs)
+        self.proc.start()
+        if self.on_fork is not None:
+            self.on_fork()
+
+    def fileno(self):
+        """
+        :return: file descriptor that becomes readable when the process sends data, or None if not forked
+        """
+        if self.recv is None:
+            return None
+        return self.recv.fileno()
+
+    def write_pipe(self, item):
+        if self.recv is not None:
+            self.recv.send(item)
+
+    def read_pipe(self, max_messages=None, max_seconds=None, reduce=None, initial=None):
+        """
+        Reads data sent by the process
+
+        The budget bounds the work done in one call, so a heartbeat stays short however far the process has got
+        ahead, anything left in the pipe is read on the next call.  Reducing folds messages as they are read,
+        so a backlog never builds up a list.
+
+        :param max_messages: most messages to read, None for no limit
+        :param max_seconds: stop reading after this many seconds, None for no limit
+        :param reduce: None to return a list of the messages read, 'latest' to return only the newest message,
+            or a function reduce(accumulator, message) -> accumulator to fold the messages into running aggregates
+        :param initial: value to start from when reducing, eg: the aggregate returned by the last call
+        :return: list of messages, or the reduced value, initial if nothing was read
+        """
+        if reduce is None:
+            item = []
+            reduce = _append
+        elif reduce == 'latest':
+            item = initial
+            reduce = _latest
+        else:
+            item = initial
+        if self.recv is None:
+            return item
+        count = 0
+        deadline = None if max_seconds is None else time.monotonic() + max_seconds
+        try:
+            while self.recv.poll():
+                item = reduce(item, self.recv.recv())
+                count += 1
+                if max_messages is not None and count >= max_messages:
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+        except (EOFError, OSError):
+            # the process closed its end of the pipe
+            pass
+        return item
+
+    def pending(self):
+        """
+        :return: True if the process has sent data that hasn't been read
+        """
+        if self.recv is None:
+            return False
+        try:
+            return self.recv.poll()
+        except (EOFError, OSError):
+            return False
+
+    def backlog(self):
+        """
+        :return: bytes the process has sent that haven't been read yet, 0 if not forked
+        """
+        if self.recv is None:
+            return 0
+        size = array('i', [0])
+        try:
+            fcntl.ioctl(self.recv.fileno(), termios.FIONREAD, size)
+        except OSError:
+            return 0
+        return size[0]
+
+    def read_messages(self):
+        """
+        Reads binary message batches the process sent with ipc.BatchWriter
+        :return: dict of message type id -> numpy structured array of messages
+        """
+        if self.recv is None:
+            return {}
+        try:
+            return read_messages(self.recv)
+        except EOFError:
+            return {}
+
+    def read_status(self):
+        """
+        Reads the latest snapshot the process published to its StatusBlock
+        :return: Status, or None if the process has no status block
+        """
+        if self.status_block is None:
+            return None
+        return self.status_block.read()
+
+    def read_scheduling(self):
+        """
+        :return: dict of the scheduling the process runs with, see scheduling.current, None if it isn't running
+        """
+        if not self.is_alive():
+            return None
+        return current(self.proc.pid)
+
+    def stop(self, wait=True):
+        """
+        Sets the event to tell the process to exit.
+        note: this is co-operative multi-tasking, the process must respect the flag or this won't work!
+        :param wait: if True, wait for the process to exit, set False to signal several processes before joining,
+            or to stop asynchronously, see UrwidFrontend.stop_subprocess
+        """
+        if self.shutdown is not None and self.shutdown.phase == 'exited':
+            # stopped already, keep the timings of that stop
+            return
+        if self.shutdown is None:
+            if not self.is_alive():
+                return
+            self.shutdown = Shutdown()
+        self.stop_process.set()
+        if wait:
+            self.proc.join()
+            self.shutdown.exited()
+
+    def interrupt(self):
+        """
+        Sends SIGINT, for a process that hasn't seen the stop event
+        """
+        if self.is_alive():
+            if self.shutdown is not None:
+                self.shutdown.escalate('interrupt')
+            os.kill(self.proc.pid, signal.SIGINT)
+
+    def sentinel(self):
+        """
+        :return: file descriptor that becomes readable when the process exits, or None if not forked
+        """
+        if self.proc is None:
+            return None
+        return self.proc.sentinel
+
+    def kill(self, wait=True):
+        """
+        Kills the process with SIGKILL, for a process that has stopped responding
+        :param wait: if True, wait for the process to exit
+        """
+        if self.proc is not None:
+            if self.shutdown is not None and self.is_alive():
+                self.shutdown.escalate('kill')
+            self.proc.kill()
+            if wait:
+                self.proc.join()
+
+    def has_exited(self):
+        """
+        :return: True if the process has exited, going by its sentinel, which is readable a moment before is_alive()
+            turns False
+        """
+        return self.proc is not None and bool(connection.wait([self.proc.sentinel], 0))
+
+    def is_alive(self):
+        if self.proc is not None:
+            return self.proc.is_alive()
+        else:
+            return False
+
+    def close(self):
+        """
+        Releases the shared memory blocks, the last snapshot can't be read after this
+        """
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
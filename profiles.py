@@ -0,0 +1,100 @@
+"""
+Named recording profiles, the camera resolution, frame rate, SVO compression mode and output directory to record with
+
+Built in profiles can be overridden, and new ones added, in a JSON config file of name -> profile fields, eg:
+
+    {
+        "rig_a": {"resolution": "HD1080", "fps": 30, "compression": "H265", "directory": "/mnt/ssd/ZED"},
+        "hd720": {"fps": 30}
+    }
+
+fields left out of a profile take the values of the built in profile of the same name, or the defaults.
+"""
+import os
+import json
+import pathlib
+from collections import namedtuple
+from camera import ZedCamera, SyntheticCamera
+
+PROFILES_FILE = f'{pathlib.Path.home()}/.config/recorder/profiles.json'
+DEFAULT_PROFILE = 'hd720'
+
+# names of sl.RESOLUTION and sl.SVO_COMPRESSION_MODE members, and the size of a frame at each resolution
+RESOLUTIONS = {'HD2K': (2208, 1242), 'HD1080': (1920, 1080), 'HD720': (1280, 720), 'VGA': (672, 376)}
+COMPRESSIONS = ['LOSSLESS', 'H264', 'H265', 'H264_LOSSLESS', 'H265_LOSSLESS']
+
+# rough size of an encoded frame relative to the raw BGR frame, so a synthetic recording writes about as much as
+# the ZED's encoder would, only the ZED camera measures the real cost of each compression mode
+SYNTHETIC_COMPRESSION = {'LOSSLESS': 0.5, 'H264': 0.01, 'H265': 0.007, 'H264_LOSSLESS': 0.4, 'H265_LOSSLESS': 0.35}
+
+# fps 0 is the camera's default for the resolution, directory None is the default recording directory
+Profile = namedtuple('Profile', ['name', 'resolution', 'fps', 'compression', 'directory'],
+                     defaults=['HD720', 0, 'H264', None])
+
+PROFILES = {
+    # the settings the recorder had before profiles
+    'hd720': Profile('hd720', 'HD720', 0, 'H264'),
+    'hd720_h265': Profile('hd720_h265', 'HD720', 60, 'H265'),
+    'hd1080': Profile('hd1080', 'HD1080', 30, 'H264'),
+    'hd2k': Profile('hd2k', 'HD2K', 15, 'H265'),
+    'vga': Profile('vga', 'VGA', 100, 'H264'),
+    'lossless': Profile('lossless', 'HD720', 30, 'LOSSLESS'),
+}
+
+
+def check_profile(profile):
+    """
+    raises ValueError if the profile names a resolution or compression mode the SDK doesn't have
+    """
+    if profile.resolution not in RESOLUTIONS:
+        raise ValueError(f'profile {profile.name}: resolution {profile.resolution} is not one of {list(RESOLUTIONS)}')
+    if profile.compression not in COMPRESSIONS:
+        raise ValueError(f'profile {profile.name}: compression {profile.compression} is not one of {COMPRESSIONS}')
+    if profile.fps < 0:
+        raise ValueError(f'profile {profile.name}: fps must be 0 or more')
+    return profile
+
+
+def load_profiles(filename=PROFILES_FILE):
+    """
+    :param filename: JSON config file of profiles, if it doesn't exist only the built in profiles are returned
+    :return: dict of name -> Profile, the built in profiles updated from the config file
+    """
+    profiles = dict(PROFILES)
+    if filename is None or not os.path.exists(filename):
+        return profiles
+    with open(filename) as f:
+        config = json.load(f)
+    for name, fields in config.items():
+        unknown = set(fields) - set(Profile._fields)
+        if unknown:
+            raise ValueError(f'profile {name}: unknown fields {sorted(unknown)} in {filename}')
+        base = profiles.get(name, Profile(name))
+        profiles[name] = check_profile(base._replace(name=name, **fields))
+    return profiles
+
+
+def profile_camera(profile, serial=None):
+    """
+    :return: ZedCamera that records with the profile's settings
+    """
+    return ZedCamera(serial, resolution=profile.resolution, fps=profile.fps, compression=profile.compression)
+
+
+def synthetic_camera(profile, fps=30.0):
+    """
+    :param fps: frame rate for a profile that uses the camera default
+    :return: SyntheticCamera with the profile's frame size and rate, writing about as much as the ZED would
+    """
+    width, height = RESOLUTIONS[profile.resolution]
+    return SyntheticCamera(width=width, height=height, fps=profile.fps or fps,
+                           payload_bytes=int(width * height * 3 * SYNTHETIC_COMPRESSION[profile.compression]))
+
+
+def profile_text(profile):
+    """
+    :return: one line description of a profile, for display
+    """
+    fps = f'{profile.fps} fps' if profile.fps > 0 else 'default fps'
+    directory = f' to {profile.directory}' if profile.directory else ''
+    return f'{profile.name}: {profile.resolution} {fps} {profile.compression}{directory}'
@@ -0,0 +1,214 @@
+"""
+Plays an existing recording back through the recorder's SubProcess pipeline, as if it were a live camera, so the
+status block, grab stats and preview the frontend reads are the same as when recording
+
+Frames are paced by their recorded timestamps in real time mode, or returned as fast as they decode in max speed
+mode, which measures the decode rate.  A synthetic recording replayed in a loop makes a repeatable load for the
+frontend that needs neither a camera nor the ZED SDK.
+"""
+import os
+import sys
+import glob
+import time
+from signal import signal, SIGINT
+from camera import CameraBackend, SUCCESS
+from export import open_reader
+from process import suppress_stdout_stderr
+
+END_OF_RECORDING = -1  # error code grab returns once the last frame has been replayed
+
+
+def latest_recording(directory):
+    """
+    :return: the most recently modified recording in directory, or None if there are none
+    """
+    recordings = glob.glob(f'{directory}/*.svo')
+    return max(recordings, key=os.path.getmtime) if recordings else None
+
+
+class ReplayCamera(CameraBackend):
+    def __init__(self, filename, realtime=True, loop=False, reader=open_reader):
+        """
+        A recording played back as a camera, each grab returns the next frame of the recording
+        :param filename: recording to replay
+        :param realtime: if True, frames are returned at the times they were recorded, else as fast as they decode
+        :param loop: if True, the recording starts over from the first frame when it ends, and timestamps carry on
+            increasing by one frame period across the join, else grab returns END_OF_RECORDING
+        :param reader: function that opens filename and returns an export.RecordingReader
+        """
+        self.filename = filename
+        self.realtime = realtime
+        self.loop = loop
+        self.reader = reader
+        self.recording = None
+        self.frames = None
+        self.period = 0
+        self.offset = 0
+        self.rewound = False
+        self.start = None  # (first timestamp, monotonic ns it was replayed at), the real time pacing reference
+        self.frame = 0
+        self.position = 0
+        self.last_timestamp = 0
+        self.image = None
+
+    def open(self):
+        """
+        raises IOError if the recording can't be read
+        """
+        self.recording = self.reader(self.filename)
+        self.frames = self.recording.frames()
+        self.period = int(1e9 / self.recording.fps()) if self.recording.fps() > 0 else 0
+        return SUCCESS
+
+    def frame_count(self):
+        return self.recording.frame_count()
+
+    def rewind(self):
+        self.recording.close()
+        self.recording = self.reader(self.filename)
+        self.frames = self.recording.frames()
+        self.rewound = True
+
+    def grab(self):
+        try:
+            position, timestamp, image = next(self.frames)
+        except StopIteration:
+            if not self.loop or self.frame == 0:
+                return END_OF_RECORDING
+            self.rewind()
+            position, timestamp, image = next(self.frames)
+        if self.rewound:
+            self.offset = self.last_timestamp + self.period - timestamp
+            self.rewound = False
+        timestamp += self.offset
+
+        if self.start is None:
+            self.start = (timestamp, time.monotonic_ns())
+        if self.realtime:
+            first, started = self.start
+            delay = started + timestamp - first - time.monotonic_ns()
+            if delay > 0:
+                time.sleep(delay / 1e9)
+
+        self.frame += 1
+        self.position = position
+        self.last_timestamp = timestamp
+        self.image = image
+        return SUCCESS
+
+    def timestamp(self):
+        return self.last_timestamp
+
+    def fps(self):
+        return self.recording.fps() if self.recording is not None else 0
+
+    def retrieve_image(self):
+        """
+        :return: (H, W, 3) uint8 BGR image of the last grabbed frame, only valid until the next grab
+        """
+        return self.image
+
+    def bytes_written(self):
+        return 0
+
+    def close(self):
+        if self.recording is not None:
+            self.recording.close()
+            self.recording = None
+
+
+def replay_main(transmit, event, filename=None, realtime=True, loop=False, reader=open_reader, status=None,
+                preview=None, stats=None):
+    """
+    Replays a recording until it ends or the event is set, publishing to the same blocks as main.start_recording
+    Messages sent down the pipe are
+        ('opened', filename, frames in the recording, recorded fps, realtime)
+        ('finished', frames replayed, seconds, frames/s)
+        ('failed', filename, error)
+    :param transmit: multiprocess Pipe to the frontend
+    :param event: multiprocess Event, set to stop replaying
+    :param filename: recording to replay
+    :param realtime: if True, replay at the recorded frame rate, else as fast as frames decode
+    :param loop: if True, replay the recording over and over until the event is set
+    :param reader: function that opens filename and returns an export.RecordingReader
+    :param status: StatusBlock to publish the replay state to
+    :param preview: FrameRing to write downscaled preview frames to
+    :param stats: GrabStats to record the time to decode (and in real time mode, wait for) each frame to
+    """
+    with suppress_stdout_stderr():
+        cam = ReplayCamera(filename, realtime=realtime, loop=loop, reader=reader)
+
+        def handler(signal_received, frame):
+            cam.close()
+            sys.exit(0)
+
+        signal(SIGINT, handler)
+
+        try:
+            cam.open()
+        except Exception as e:
+            transmit.send(('failed', filename, f'{type(e).__name__}: {e}'))
+            exit(1)
+        transmit.send(('opened', filename, cam.frame_count(), cam.fps(), realtime))
+        if stats is not None:
+            stats.set_period(cam.period)
+
+        frames_replayed = 0
+        begin = time.monotonic()
+        while not event.wait(timeout=0):
+            start = time.perf_counter_ns()
+            err = cam.grab()
+            if err == END_OF_RECORDING:
+                break
+            if stats is not None:
+                stats.record_grab(time.perf_counter_ns() - start, err)
+                stats.record_frame(cam.timestamp())
+            frames_replayed += 1
+            if preview is not None and frames_replayed % preview.stride == 0:
+                start = time.perf_counter_ns()
+                preview.write(cam.retrieve_image())
+                preview.account(time.perf_counter_ns() - start)
+            if status is not None:
+                status.publish(frames_replayed, time.monotonic_ns(), 0, err)
+        seconds = time.monotonic() - begin
+        transmit.send(('finished', frames_replayed, seconds, frames_replayed / seconds if seconds > 0 else 0.0))
+        cam.close()
+
+
+class ReplayProgress:
+    def __init__(self):
+        """
+        Folds replay messages into the state of the replay, for display
+        """
+        self.filename = None
+        self.total = 0
+        self.fps = 0.0
+        self.realtime = True
+        self.finished = None
+        self.error = None
+
+    def update(self, message):
+        kind, *values = message
+        if kind == 'opened':
+            self.filename, self.total, self.fps, self.realtime = values
+        elif kind == 'finished':
+            self.finished = values
+        elif kind == 'failed':
+            self.filename, self.error = values
+        return self
+
+    def text(self):
+        """
+        :return: list of lines describing the recording and, once it has finished, the decode rate, for display
+        """
+        if self.error is not None:
+            return [f'{os.path.basename(self.filename)}: FAILED {self.error}\n']
+        if self.filename is None:
+            return []
+        mode = 'real time' if self.realtime else 'max speed'
+        text = [f'Replaying {os.path.basename(self.filename)} at {mode}, {self.total} frames recorded at '
+                f'{self.fps:.0f} fps\n']
+        if self.finished is not None:
+            frames, seconds, fps = self.finished
+            text += [f'finished, {frames} frames in {seconds:.1f} s, {fps:.1f} frames/s\n']
+        return text
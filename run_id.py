@@ -0,0 +1,66 @@
+import os
+import re
+import fcntl
+
+
+STATE = '.run_id'
+LOCK = '.run_id.lock'
+RECORDING = re.compile(r'^(\d+)[._-]')
+
+
+def _recover(directory):
+    """
+    :return: the highest run id used by a recording in directory, 0 if there are none
+    """
+    last = 0
+    for name in os.listdir(directory):
+        match = RECORDING.match(name)
+        if match:
+            last = max(last, int(match.group(1)))
+    return last
+
+
+def current_run_id(directory):
+    """
+    Reads the most recently allocated run id without taking the lock, the state file is only ever replaced
+    atomically, so a reader sees either the old or the new id
+    :return: last allocated run id, or None if none has been allocated or the state file is corrupt
+    """
+    try:
+        with open(f'{directory}/{STATE}') as f:
+            return int(f.readline())
+    except (OSError, ValueError):
+        return None
+
+
+def allocate_run_id(directory):
+    """
+    Allocates the next run id in directory, safe to call from many processes at once
+
+    Allocation holds an exclusive flock on .run_id.lock while it reads .run_id and writes the next id to a
+    temporary file that is fsynced and renamed over it, so a crash leaves either the old or the new id.
+    If .run_id is missing or corrupt, the next id is recovered from the recordings in the directory.
+    :return: the allocated run id
+    """
+    fd = os.open(f'{directory}/{LOCK}', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        last = current_run_id(directory)
+        if last is None:
+            last = _recover(directory)
+        count = last + 1
+
+        temp = f'{directory}/{STATE}.{os.getpid()}.tmp'
+        with open(temp, 'w') as f:
+            f.write(str(count))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, f'{directory}/{STATE}')
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    finally:
+        os.close(fd)
+    return count
@@ -0,0 +1,215 @@
+"""
+CPU and I/O scheduling of the recorders, for rigs where they share cores with other work
+
+A Scheduling is applied in a subprocess as it starts, before its main runs, see SubProcess.fork, so every thread the
+camera SDK starts later inherits it.  It can pin the process to a set of cpus, change its nice level, run it under
+SCHED_FIFO ahead of every normal process, and set its I/O priority.  Raising the priority needs CAP_SYS_NICE or an
+rtprio limit, and realtime I/O needs CAP_SYS_ADMIN, so a setting that isn't permitted is skipped and the process
+records anyway, a SCHED_FIFO that isn't permitted falls back to the nice level.  What a process actually runs with
+is read back from outside it with current(pid), and check says how it differs from what was asked for.
+
+The recorder writes the scheduling it ran with and its frame interval histogram into {stem}.stats.json, and
+jitter_report compares the interval distributions of the recordings in a directory, grouped by scheduling, eg:
+
+    python headless.py --duration 600 --cpus 3                  # pinned
+    python headless.py --duration 600                           # not pinned
+    python headless.py --jitter_report
+"""
+import os
+import glob
+import json
+import ctypes
+import platform
+import numpy as np
+from stats import BINS, SUB_BINS, bin_index, bin_value, percentile
+
+IOPRIO_CLASSES = ['none', 'realtime', 'best-effort', 'idle']  # indexed by the kernel's class number
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+_IOPRIO_SYSCALLS = {'x86_64': (251, 252), 'aarch64': (30, 31), 'armv7l': (314, 315), 'i686': (289, 290)}  # set, get
+_libc = None
+POLICIES = {os.SCHED_OTHER: 'other', os.SCHED_FIFO: 'fifo', os.SCHED_RR: 'rr', os.SCHED_BATCH: 'batch',
+            os.SCHED_IDLE: 'idle'}
+
+
+def _ioprio(call, pid, value=None):
+    """
+    calls ioprio_set, call 0, or ioprio_get, call 1, which python doesn't wrap
+    """
+    numbers = _IOPRIO_SYSCALLS.get(platform.machine())
+    if numbers is None:
+        raise OSError(38, f'ioprio syscalls not known on {platform.machine()}')
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    args = (IOPRIO_WHO_PROCESS, pid) if value is None else (IOPRIO_WHO_PROCESS, pid, value)
+    result = _libc.syscall(numbers[call], *args)
+    if result < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+    return result
+
+
+def current(pid=0):
+    """
+    :param pid: process to read, 0 for this one
+    :return: dict of the cpus, scheduling policy, fifo priority, nice level, and I/O class and level the process
+        runs with, None for any that can't be read
+    """
+    settings = {'cpus': None, 'policy': None, 'fifo': None, 'nice': None, 'ioclass': None, 'iolevel': None}
+    try:
+        settings['cpus'] = sorted(os.sched_getaffinity(pid))
+        policy = os.sched_getscheduler(pid)
+        settings['policy'] = POLICIES.get(policy, str(policy))
+        if policy in (os.SCHED_FIFO, os.SCHED_RR):
+            settings['fifo'] = os.sched_getparam(pid).sched_priority
+        settings['nice'] = os.getpriority(os.PRIO_PROCESS, pid)
+    except OSError:
+        # the process has exited
+        return settings
+    try:
+        value = _ioprio(1, pid)
+        settings['ioclass'] = IOPRIO_CLASSES[value >> IOPRIO_CLASS_SHIFT]
+        settings['iolevel'] = value & ((1 << IOPRIO_CLASS_SHIFT) - 1)
+    except OSError:
+        pass
+    return settings
+
+
+def describe(settings):
+    """
+    :param settings: dict from current
+    :return: one line summary, eg: 'cpus 2,3 fifo 50 nice 0 io best-effort 0'
+    """
+    if not settings:
+        return 'unknown'
+    cpus = ','.join(str(cpu) for cpu in settings['cpus']) if settings.get('cpus') else 'any'
+    policy = f'fifo {settings["fifo"]}' if settings.get('fifo') else settings.get('policy') or 'other'
+    io = 'io default'
+    if settings.get('ioclass') not in (None, 'none'):
+        io = f'io {settings["ioclass"]} {settings["iolevel"]}'
+    return f'cpus {cpus} {policy} nice {settings.get("nice")} {io}'
+
+
+class Scheduling:
+    def __init__(self, cpus=None, nice=None, fifo=None, ioclass=None, iolevel=4):
+        """
+        Scheduling of a process, settings left None are inherited from the frontend
+        :param cpus: set of cpus to pin the process to
+        :param nice: nice level, -20 to 19, negative to run ahead of other processes
+        :param fifo: SCHED_FIFO priority 1 - 99, the process runs whenever it is ready, until it blocks
+        :param ioclass: I/O scheduling class, 'realtime', 'best-effort' or 'idle'
+        :param iolevel: priority within the I/O class, 0 highest to 7 lowest
+        """
+        if ioclass is not None and ioclass not in IOPRIO_CLASSES[1:]:
+            raise ValueError(f'ioclass must be one of {", ".join(IOPRIO_CLASSES[1:])}')
+        if fifo is not None and not 1 <= fifo <= 99:
+            raise ValueError('fifo priority must be 1 - 99')
+        self.cpus = set(cpus) if cpus is not None else None
+        self.nice = nice
+        self.fifo = fifo
+        self.ioclass = ioclass
+        self.iolevel = iolevel
+
+    def pinned(self, cpus):
+        """
+        :return: a copy pinned to cpus, eg: for each camera's recorder, None to keep these cpus
+        """
+        return Scheduling(self.cpus if cpus is None else cpus, self.nice, self.fifo, self.ioclass, self.iolevel)
+
+    def apply(self):
+        """
+        Applies the scheduling to the calling thread, and the threads it starts after, call in the new process
+        :return: list of the settings that weren't permitted, as text
+        """
+        warnings = []
+        if self.cpus is not None:
+            try:
+                os.sched_setaffinity(0, self.cpus)
+            except OSError as e:
+                warnings += [f'cpus {",".join(str(cpu) for cpu in sorted(self.cpus))}: {e.strerror}']
+        fifo = False
+        if self.fifo is not None:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.fifo))
+                fifo = True
+            except OSError as e:
+                warnings += [f'fifo {self.fifo}: {e.strerror}']
+        if self.nice is not None and not fifo:
+            try:
+                os.setpriority(os.PRIO_PROCESS, 0, self.nice)
+            except OSError as e:
+                warnings += [f'nice {self.nice}: {e.strerror}']
+        if self.ioclass is not None:
+            try:
+                _ioprio(0, 0, IOPRIO_CLASSES.index(self.ioclass) << IOPRIO_CLASS_SHIFT | self.iolevel)
+            except OSError as e:
+                warnings += [f'io {self.ioclass} {self.iolevel}: {e.strerror}']
+        return warnings
+
+    def check(self, settings):
+        """
+        :param settings: dict from current, of a process this was applied to
+        :return: list of the settings the process isn't running with, as text, empty if it got them all
+        """
+        if settings['policy'] is None:
+            return []
+        missing = []
+        if self.cpus is not None and set(settings['cpus']) != self.cpus:
+            missing += [f'cpus {",".join(str(cpu) for cpu in sorted(self.cpus))}']
+        if self.fifo is not None and settings['fifo'] != self.fifo:
+            missing += [f'fifo {self.fifo}']
+        if self.nice is not None and settings['fifo'] is None and settings['nice'] != self.nice:
+            missing += [f'nice {self.nice}']
+        if self.ioclass is not None and settings['ioclass'] is not None and \
+                (settings['ioclass'], settings['iolevel']) != (self.ioclass, self.iolevel):
+            missing += [f'io {self.ioclass} {self.iolevel}']
+        return missing
+
+
+def jitter(summaries):
+    """
+    Pools the frame interval histograms of recordings
+    :param summaries: GrabStats summaries as written to {stem}.stats.json, with their interval_bins
+    :return: dict of recordings, frames, dropped frames, and interval percentiles and max in ms
+    """
+    bins = np.zeros(BINS, dtype=np.int64)
+    for summary in summaries:
+        # recordings from before the bins were made finer have 8 a power of two
+        sub_bins = summary.get('sub_bins', 8)
+        for index, count in summary.get('interval_bins', {}).items():
+            index = int(index)
+            if sub_bins != SUB_BINS:
+                index = bin_index(bin_value(index, sub_bins))
+            bins[index] += count
+    return {'recordings': len(summaries), 'frames': sum(summary['frames'] for summary in summaries),
+            'dropped': sum(summary['dropped'] for summary in summaries),
+            'p50_ms': percentile(bins, 50) / 1e3, 'p90_ms': percentile(bins, 90) / 1e3,
+            'p99_ms': percentile(bins, 99) / 1e3, 'p999_ms': percentile(bins, 99.9) / 1e3,
+            'max_ms': max((summary['interval_max_ms'] for summary in summaries), default=0.0)}
+
+
+def jitter_report(directory):
+    """
+    Compares the frame interval distributions of the recordings in a directory, grouped by the scheduling they
+    were recorded with, recordings from before their scheduling was written are grouped as unknown
+    :return: list of lines of a table, for display
+    """
+    groups = {}
+    for filename in sorted(glob.glob(f'{directory}/*.stats.json')):
+        try:
+            with open(filename) as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        groups.setdefault(describe(summary.get('scheduling')), []).append(summary)
+    if not groups:
+        return [f'no recordings in {directory}\n']
+    lines = [f'{"scheduling":<44} {"recs":>5} {"frames":>9} {"dropped":>8} {"p50":>6} {"p90":>6} {"p99":>6} '
+             f'{"p99.9":>6} {"max ms":>7}\n']
+    for name, summaries in sorted(groups.items()):
+        pooled = jitter(summaries)
+        lines += [f'{name:<44} {pooled["recordings"]:>5} {pooled["frames"]:>9} {pooled["dropped"]:>8} '
+                  f'{pooled["p50_ms"]:>6.1f} {pooled["p90_ms"]:>6.1f} {pooled["p99_ms"]:>6.1f} '
+                  f'{pooled["p999_ms"]:>6.1f} {pooled["max_ms"]:>7.1f}\n']
+    return lines
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+
+
+class Segments:
+    def __init__(self, directory, stem, max_seconds=None, max_bytes=None, extension='svo'):
+        """
+        Splits a recording into segment files {stem}-{n:04d}.svo, rolling over every max_seconds or max_bytes,
+        whichever comes first, and keeps a manifest {stem}.manifest.json of the segments, their frame ranges and
+        camera timestamps.  The manifest is rewritten atomically each time a segment opens or closes, so closed
+        segments can be picked up by other processes while the recording continues.  Frames the camera captures while
+        the files are swapped aren't recorded, each segment after the first has a gap_ns, the camera time from the
+        last frame of the segment before it to its first frame, to compare with the frame interval.
+        :param directory: directory to write segments to
+        :param stem: name of the recording
+        :param max_seconds: roll over to a new segment after this many seconds, None for no limit
+        :param max_bytes: roll over to a new segment after this many bytes, None for no limit
+        """
+        self.directory = directory
+        self.stem = stem
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.segments = []
+        self.started = None
+        self.closed_bytes = 0
+
+    @property
+    def manifest(self):
+        return f'{self.directory}/{self.stem}.manifest.json'
+
+    def filename(self, index=None):
+        """
+        :param index: segment number, defaults to the current segment
+        """
+        index = len(self.segments) - 1 if index is None else index
+        return f'{self.directory}/{self.stem}-{index:04d}.{self.extension}'
+
+    def open(self, first_frame):
+        """
+        Starts a new segment
+        :param first_frame: number of the first frame that will be recorded into it
+        :return: filename of the new segment
+        """
+        self.segments += [{'file': os.path.basename(self.filename(len(self.segments))), 'first_frame': first_frame,
+                           'last_frame': None, 'start_timestamp': None, 'end_timestamp': None, 'gap_ns': None,
+                           'bytes': None, 'closed': False}]
+        self.started = time.monotonic()
+        self.write_manifest()
+        return self.filename()
+
+    def frame(self, frame, timestamp):
+        """
+        Records a grabbed frame, called every frame
+        :param frame: frame number
+        :param timestamp: camera timestamp of the frame
+        """
+        segment = self.segments[-1]
+        if segment['start_timestamp'] is None:
+            segment['start_timestamp'] = timestamp
+            if len(self.segments) > 1 and self.segments[-2]['end_timestamp'] is not None:
+                segment['gap_ns'] = timestamp - self.segments[-2]['end_timestamp']
+        segment['last_frame'] = frame
+        segment['end_timestamp'] = timestamp
+
+    def due(self, bytes_written):
+        """
+        :param bytes_written: size of the current segment
+        :return: True if the current segment should be closed
+        """
+        if self.max_seconds is not None and time.monotonic() - self.started >= self.max_seconds:
+            return True
+        return self.max_bytes is not None and bytes_written >= self.max_bytes
+
+    def close(self, bytes_written):
+        """
+        Closes the current segment
+        :param bytes_written: final size of the segment
+        """
+        segment = self.segments[-1]
+        segment['bytes'] = bytes_written
+        segment['closed'] = True
+        self.closed_bytes += bytes_written
+        self.write_manifest()
+
+    def write_manifest(self):
+        temp = f'{self.manifest}.tmp'
+        with open(temp, 'w') as f:
+            json.dump({'stem': self.stem, 'segments': self.segments}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.manifest)
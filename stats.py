@@ -0,0 +1,176 @@
+import json
+from multiprocessing import shared_memory
+import numpy as np
+
+
+SUB_BINS = 64
+BINS = 22 * SUB_BINS  # the top bin starts at about 133 s
+
+
+def bin_index(value, sub_bins=SUB_BINS):
+    """
+    Log-linear histogram bin of a non negative integer, bins are exact below 2 * sub_bins, and above that each
+    power of two is split into sub_bins bins, so with 64 the relative error of a bin is at most 1.6%, eg: 256 us
+    at a 60 fps frame interval
+    :param sub_bins: bins per power of two, a power of two, other than SUB_BINS for histograms written before it
+        changed
+    """
+    if value < 2 * sub_bins:
+        return value
+    shift = value.bit_length() - sub_bins.bit_length()
+    return min(sub_bins * shift + (value >> shift), BINS - 1)
+
+
+def bin_value(index, sub_bins=SUB_BINS):
+    """
+    :return: the lowest value that falls in bin index
+    """
+    if index < 2 * sub_bins:
+        return index
+    shift = index // sub_bins - 1
+    return (sub_bins + index % sub_bins) << shift
+
+
+def percentile(histogram, q):
+    """
+    :param histogram: array of bin counts
+    :param q: percentile in the range 0 - 100
+    :return: lower edge of the bin containing the q'th percentile, 0 if the histogram is empty
+    """
+    total = histogram.sum()
+    if total == 0:
+        return 0
+    index = int(np.searchsorted(np.cumsum(histogram), q / 100 * total))
+    return bin_value(min(index, BINS - 1))
+
+
+class GrabStats:
+    """
+    Timing of the grab loop, kept in shared memory so the frontend can read it live
+
+    Grab latency and the interval between camera timestamps are kept in fixed size microsecond histograms
+    that are preallocated, so recording a frame only increments counters.  A frame interval longer than
+    1.5 camera periods is counted as dropped frames, and failed grabs are counted by error code.
+
+    The frontend reads the counters while the recorder writes them without locking, so a live summary can
+    be off by the frame being recorded as it is read.
+    """
+    COUNTERS = ['frames', 'dropped', 'failed', 'latency_max', 'interval_max', 'period', 'last_timestamp',
+                'first_timestamp', 'start_latency']
+    ERROR_SLOTS = 16
+
+    def __init__(self, name=None):
+        """
+        :param name: name of an existing block to attach to, if None a new block is created
+        """
+        size = 8 * (len(self.COUNTERS) + 2 * BINS + 2 * self.ERROR_SLOTS)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.counters = np.ndarray((len(self.COUNTERS),), dtype=np.int64, buffer=self.shm.buf)
+        offset = self.counters.nbytes
+        self.latency = np.ndarray((BINS,), dtype=np.int64, buffer=self.shm.buf, offset=offset)
+        offset += self.latency.nbytes
+        self.interval = np.ndarray((BINS,), dtype=np.int64, buffer=self.shm.buf, offset=offset)
+        offset += self.interval.nbytes
+        self.errors = np.ndarray((self.ERROR_SLOTS, 2), dtype=np.int64, buffer=self.shm.buf, offset=offset)
+        self.frames, self.interval_max, self.period, self.last_timestamp = (int(self.counters[index])
+                                                                            for index in (0, 4, 5, 6))
+
+    def __getstate__(self):
+        return {'name': self.shm.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'])
+
+    def set_period(self, period_ns):
+        """
+        :param period_ns: expected time between frames, used to detect dropped frames
+        """
+        self.counters[5] = self.period = period_ns
+
+    def set_start_latency(self, latency_ns):
+        """
+        :param latency_ns: time from the recording being requested to the first recorded frame
+        """
+        self.counters[8] = latency_ns
+
+    def record_grab(self, latency_ns, err):
+        """
+        Records a call to grab, called from the recorder
+        :param latency_ns: time the call took
+        :param err: error code the call returned
+        """
+        self.latency[bin_index(latency_ns // 1000)] += 1
+        if latency_ns > self.counters[3]:
+            self.counters[3] = latency_ns
+        if err != 0:
+            self.counters[2] += 1
+            for slot in range(self.ERROR_SLOTS):
+                if self.errors[slot, 1] == 0 or self.errors[slot, 0] == err:
+                    self.errors[slot, 0] = err
+                    self.errors[slot, 1] += 1
+                    break
+
+    def record_frame(self, timestamp_ns):
+        """
+        Records a successfully grabbed frame, called from the recorder
+        :param timestamp_ns: camera timestamp of the frame
+        """
+        # this is the only writer, so it keeps its own copies of the counters it reads, and only writes the block
+        counters = self.counters
+        self.frames += 1
+        counters[0] = self.frames
+        last, self.last_timestamp = self.last_timestamp, timestamp_ns
+        counters[6] = timestamp_ns
+        if self.frames == 1:
+            counters[7] = timestamp_ns
+            return
+        interval = timestamp_ns - last
+        self.interval[bin_index(max(interval, 0) // 1000)] += 1
+        if interval > self.interval_max:
+            self.interval_max = counters[4] = interval
+        if self.period > 0 and interval * 2 > self.period * 3:
+            counters[1] += round(interval / self.period) - 1
+
+    def summary(self):
+        """
+        :return: dict of frame and drop counts, latency and interval percentiles in ms, failures by error code,
+            the camera timestamp of the first frame, and the time from the recording being requested to the first
+            recorded frame
+        """
+        frames, dropped, failed, latency_max, interval_max, period, _, first, start = self.counters.tolist()
+        return {
+            'frames': frames,
+            'dropped': dropped,
+            'failed': failed,
+            'period_ms': period / 1e6,
+            'latency_p50_ms': percentile(self.latency, 50) / 1e3,
+            'latency_p99_ms': percentile(self.latency, 99) / 1e3,
+            'latency_max_ms': latency_max / 1e6,
+            'interval_p50_ms': percentile(self.interval, 50) / 1e3,
+            'interval_p99_ms': percentile(self.interval, 99) / 1e3,
+            'interval_max_ms': interval_max / 1e6,
+            'errors': {str(code): count for code, count in self.errors.tolist() if count > 0},
+            'first_timestamp': first,
+            'start_latency_ms': start / 1e6,
+        }
+
+    def write_summary(self, filename, **extra):
+        """
+        Writes the summary, with the non zero bins of the interval histogram and their SUB_BINS, for comparing
+        recordings' jitter
+        :param extra: fields to add, eg: the scheduling the recorder ran with
+        """
+        bins = {str(index): count for index, count in enumerate(self.interval.tolist()) if count > 0}
+        with open(filename, 'w') as f:
+            json.dump({**self.summary(), 'interval_bins': bins, 'sub_bins': SUB_BINS, **extra}, f, indent=2)
+
+    def close(self):
+        # the numpy views must be released before the shared memory can be
+        self.counters, self.latency, self.interval, self.errors = None, None, None, None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
@@ -0,0 +1,97 @@
+import zlib
+import struct
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+
+Status = namedtuple('Status', ['frames', 'timestamp', 'bytes_written', 'error'])
+
+
+class StatusBlock:
+    """
+    Live status of a recorder, published by the subprocess into shared memory and read by the frontend
+
+    The block is a seqlock, the writer makes the sequence number odd, writes the fields, then makes it
+    even again.  A reader retries if it sees an odd sequence, or if the sequence changed while it was reading.
+    The writer never waits on the reader, and the reader always gets the latest snapshot in O(1).
+
+    Python can't put memory barriers between the writes, so the sequence alone relies on the cpu keeping stores
+    in order, as x86 does.  On ARM, eg: a Jetson, a reader can see the new sequence with some of the old fields,
+    so the fields carry a crc32 that the reader checks too, and retries on a mismatch.
+
+    There must only ever be one writer.
+    """
+    SEQUENCE = struct.Struct('<Q')
+    FIELDS = struct.Struct('<QqQq')  # frames, timestamp (monotonic ns of last grab), bytes_written, error
+    CHECKSUM = struct.Struct('<I')  # crc32 of the packed fields
+    SIZE = SEQUENCE.size + FIELDS.size + CHECKSUM.size
+    RETRIES = 100
+
+    def __init__(self, name=None):
+        """
+        :param name: name of an existing block to attach to, if None a new block is created
+        """
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.SIZE)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.sequence = 0
+        self.last = Status(0, 0, 0, 0)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __getstate__(self):
+        return {'name': self.shm.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'])
+
+    def publish(self, frames, timestamp, bytes_written, error):
+        """
+        Writes a new snapshot, called from the recorder
+        """
+        buf = self.shm.buf
+        self.sequence += 1
+        self.SEQUENCE.pack_into(buf, 0, self.sequence)
+        self.FIELDS.pack_into(buf, self.SEQUENCE.size, frames, timestamp, bytes_written, error)
+        fields = buf[self.SEQUENCE.size:self.SEQUENCE.size + self.FIELDS.size]
+        self.CHECKSUM.pack_into(buf, self.SEQUENCE.size + self.FIELDS.size, zlib.crc32(fields))
+        fields.release()
+        self.sequence += 1
+        self.SEQUENCE.pack_into(buf, 0, self.sequence)
+
+    def published(self):
+        """
+        :return: True once the writer has published a snapshot, eg: False for a recorder waiting in standby
+        """
+        sequence, = self.SEQUENCE.unpack_from(self.shm.buf, 0)
+        return sequence > 0
+
+    def read(self):
+        """
+        Reads the latest snapshot, if the writer is mid update for every retry, returns the previous snapshot
+        :return: Status
+        """
+        buf = self.shm.buf
+        for _ in range(self.RETRIES):
+            start, = self.SEQUENCE.unpack_from(buf, 0)
+            if start == 0:
+                # nothing published yet
+                break
+            if start % 2 == 1:
+                continue
+            fields = bytes(buf[self.SEQUENCE.size:self.SEQUENCE.size + self.FIELDS.size])
+            checksum, = self.CHECKSUM.unpack_from(buf, self.SEQUENCE.size + self.FIELDS.size)
+            end, = self.SEQUENCE.unpack_from(buf, 0)
+            if start == end and zlib.crc32(fields) == checksum:
+                self.last = Status(*self.FIELDS.unpack(fields))
+                break
+        return self.last
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
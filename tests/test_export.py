@@ -0,0 +1,24 @@
+from export import ExportProgress
+
+
+def test_every_message_kind():
+    progress = ExportProgress()
+    progress.update(('queued', ['1.svo', '2.svo', '3.svo', '4.svo'], 2))
+    assert progress.skipped == 2
+    assert set(progress.files.values()) == {'queued'}
+
+    progress.update(('progress', '1.svo', 30, 60))
+    assert progress.files['1.svo'] == '30 / 60 frames 50%'
+    progress.update(('done', '1.svo', 60, 1.5))
+    assert progress.files['1.svo'] == 'done, 60 frames in 1.5 s'
+    progress.update(('empty', '2.svo', 0, 0.01))
+    assert progress.files['2.svo'] == 'empty, no frames to export'
+    progress.update(('failed', '3.svo', 'OSError: disk full', 0.5))
+    assert progress.files['3.svo'] == 'FAILED OSError: disk full'
+    assert progress.files['4.svo'] == 'queued'
+
+    text = progress.text()
+    assert text[0] == 'exported 1 of 4 recordings, 2 already exported\n'
+    assert text[1:] == ['1.svo: done, 60 frames in 1.5 s\n', '2.svo: empty, no frames to export\n',
+                        '3.svo: FAILED OSError: disk full\n', '4.svo: queued\n']
+
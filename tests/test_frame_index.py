@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from frame_index import FrameIndexWriter, FrameIndex
+
+
+def _index(path, timestamps):
+    writer = FrameIndexWriter(str(path), batch=4)
+    for frame, timestamp in enumerate(timestamps, 1):
+        writer.append(frame, timestamp, timestamp + 5)
+    writer.close()
+    return FrameIndex(str(path))
+
+
+def test_nearest_on_empty_index_raises(tmp_path):
+    index = _index(tmp_path / '1.frames', [])
+    assert len(index) == 0
+    with pytest.raises(ValueError, match='empty frame index'):
+        index.nearest(0)
+    with pytest.raises(ValueError):
+        index.nearest_frame([0, 1])
+
+
+def test_nearest_single_frame(tmp_path):
+    index = _index(tmp_path / '1.frames', [1000])
+    assert index.nearest(0) == 0
+    assert list(index.nearest([0, 5000])) == [0, 0]
+
+
+def test_nearest(tmp_path):
+    index = _index(tmp_path / '1.frames', range(0, 100, 10))
+    assert index.nearest(14) == 1
+    assert index.nearest(15) == 1  # ties go to the earlier frame
+    assert index.nearest(16) == 2
+    assert list(index.nearest(np.array([-50, 0, 26, 1000]))) == [0, 0, 3, 9]
+    assert index.nearest_frame(26) == 4
+    assert index.nearest(26, clock='host') == 2
@@ -0,0 +1,43 @@
+from multiprocessing import Event
+import pytest
+from process import SubProcess
+
+
+def _send(transmit, stop_process, count, sent):
+    for i in range(count):
+        transmit.send(i)
+    sent.set()
+    stop_process.wait()
+
+
+@pytest.fixture
+def sender():
+    sent = Event()
+    process = SubProcess(_send)
+    process.fork(count=100, sent=sent)
+    assert sent.wait(10)
+    yield process
+    process.stop()
+    process.close()
+
+
+def _sum(total, message):
+    return total + message
+
+
+def test_message_budget(sender):
+    assert sender.read_pipe(max_messages=10) == list(range(10))
+    # a spent time budget still reads one message, so the pipe always drains
+    assert sender.read_pipe(max_seconds=0) == [10]
+    assert sender.read_pipe(max_messages=5, reduce='latest') == 15
+    assert sender.read_pipe() == list(range(16, 100))
+    assert sender.read_pipe() == []
+
+
+def test_reduce(sender):
+    total = sender.read_pipe(max_messages=40, reduce=_sum, initial=0)
+    assert total == sum(range(40))
+    total = sender.read_pipe(reduce=_sum, initial=total)
+    assert total == sum(range(100))
+    assert sender.read_pipe(reduce=_sum, initial=total) == total
+    assert sender.read_pipe(reduce='latest', initial='nothing') == 'nothing'
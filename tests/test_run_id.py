@@ -0,0 +1,29 @@
+from multiprocessing import Pool
+from run_id import allocate_run_id, current_run_id, STATE
+
+
+def _allocate(directory, count):
+    return [allocate_run_id(directory) for _ in range(count)]
+
+
+def test_parallel_allocations_are_unique_and_consecutive(tmp_path):
+    with Pool(8) as pool:
+        batches = pool.starmap(_allocate, [(str(tmp_path), 50)] * 8)
+    ids = [run_id for batch in batches for run_id in batch]
+    assert sorted(ids) == list(range(1, 401))
+    assert current_run_id(str(tmp_path)) == 400
+
+
+def test_missing_state_starts_at_one(tmp_path):
+    assert allocate_run_id(str(tmp_path)) == 1
+
+
+def test_corrupt_state_recovers_from_recordings(tmp_path):
+    (tmp_path / '7.svo').touch()
+    (tmp_path / '12_Camera 1.svo').touch()
+    (tmp_path / STATE).write_text('')
+    assert current_run_id(str(tmp_path)) is None
+    assert allocate_run_id(str(tmp_path)) == 13
+    (tmp_path / STATE).write_text('garbage\n')
+    assert allocate_run_id(str(tmp_path)) == 13
+    assert allocate_run_id(str(tmp_path)) == 14
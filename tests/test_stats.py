@@ -0,0 +1,26 @@
+import pytest
+from stats import GrabStats, bin_index, bin_value, BINS
+
+
+@pytest.mark.parametrize('sub_bins', [8, 64])
+def test_bins_hold_their_values(sub_bins):
+    for value in list(range(5000)) + [16667, 100000, 2 ** 26]:
+        index = bin_index(value, sub_bins)
+        assert bin_value(index, sub_bins) <= value < bin_value(index + 1, sub_bins)
+    assert bin_index(10 ** 12) == BINS - 1
+
+
+def test_record_frame():
+    stats = GrabStats()
+    stats.set_period(10_000_000)
+    for timestamp in [0, 10_000_000, 20_200_000, 29_900_000, 60_000_000]:
+        stats.record_frame(timestamp)
+    summary = stats.summary()
+    assert (summary['frames'], summary['dropped'], summary['interval_max_ms']) == (5, 2, 30.1)
+    # within 1.6% of the 10 ms frame interval
+    assert 9.84 <= summary['interval_p50_ms'] <= 10.0
+    attached = GrabStats(stats.shm.name)
+    assert attached.summary() == summary
+    attached.close()
+    stats.close()
+    stats.unlink()
@@ -0,0 +1,81 @@
+import zlib
+import threading
+import pytest
+from status import StatusBlock, Status
+
+
+@pytest.fixture
+def block():
+    block = StatusBlock()
+    yield block
+    block.close()
+    block.unlink()
+
+
+def test_read_latest(block):
+    assert not block.published()
+    block.publish(3, 100, 4096, 0)
+    assert block.published()
+    assert StatusBlock(block.name).read() == Status(3, 100, 4096, 0)
+
+
+def _write_fields(block, *fields):
+    packed = StatusBlock.FIELDS.pack(*fields)
+    offset = StatusBlock.SEQUENCE.size
+    block.shm.buf[offset:offset + len(packed)] = packed
+    StatusBlock.CHECKSUM.pack_into(block.shm.buf, offset + len(packed), zlib.crc32(packed))
+
+
+def test_mid_update_returns_previous_snapshot(block):
+    reader = StatusBlock(block.name)
+    block.publish(1, 10, 100, 0)
+    assert reader.read().frames == 1
+
+    # the writer is part way through an update, the sequence is odd
+    StatusBlock.SEQUENCE.pack_into(block.shm.buf, 0, block.sequence + 1)
+    _write_fields(block, 2, 20, 0, 0)
+    assert reader.read() == Status(1, 10, 100, 0)
+
+    StatusBlock.SEQUENCE.pack_into(block.shm.buf, 0, block.sequence + 2)
+    assert reader.read() == Status(2, 20, 0, 0)
+    reader.close()
+
+
+def test_fields_seen_out_of_order_return_previous_snapshot(block):
+    reader = StatusBlock(block.name)
+    block.publish(1, 10, 100, 0)
+    assert reader.read().frames == 1
+
+    # on a weakly ordered cpu, the new even sequence and some of the new fields can be seen before the rest
+    block.publish(2, 20, 200, 0)
+    StatusBlock.FIELDS.pack_into(block.shm.buf, StatusBlock.SEQUENCE.size, 2, 20, 100, 0)
+    assert reader.read() == Status(1, 10, 100, 0)
+    reader.close()
+
+
+def test_unpublished_block_reads_zeros(block):
+    reader = StatusBlock(block.name)
+    assert reader.read() == Status(0, 0, 0, 0)
+    reader.close()
+
+
+def test_reads_are_never_torn(block):
+    reader = StatusBlock(block.name)
+    done = threading.Event()
+
+    def write():
+        i = 0
+        while not done.is_set():
+            i += 1
+            block.publish(i, i, i, i)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        for _ in range(20000):
+            status = reader.read()
+            assert status.frames == status.timestamp == status.bytes_written == status.error
+    finally:
+        done.set()
+        writer.join()
+        reader.close()
@@ -1,104 +1,9 @@
-import os
-import sys
-from multiprocessing import Process, Pipe, Event
+import time
+from functools import partial
 from collections import deque
 import urwid
-
-
-class suppress_stdout_stderr(object):
-    """
-    Supresses the stdout and stderr by piping them to dev null...
-    The same place I send bad faith replies to my tweets
-    """
-    def __enter__(self):
-        self.outnull_file = open(os.devnull, 'w')
-        self.errnull_file = open(os.devnull, 'w')
-
-        self.old_stdout_fileno_undup = sys.stdout.fileno()
-        self.old_stderr_fileno_undup = sys.stderr.fileno()
-
-        self.old_stdout_fileno = os.dup(sys.stdout.fileno())
-        self.old_stderr_fileno = os.dup(sys.stderr.fileno())
-
-        self.old_stdout = sys.stdout
-        self.old_stderr = sys.stderr
-
-        os.dup2(self.outnull_file.fileno(), self.old_stdout_fileno_undup)
-        os.dup2(self.errnull_file.fileno(), self.old_stderr_fileno_undup)
-
-        sys.stdout = self.outnull_file
-        sys.stderr = self.errnull_file
-        return self
-
-    def __exit__(self, *_):
-        sys.stdout = self.old_stdout
-        sys.stderr = self.old_stderr
-
-        os.dup2(self.old_stdout_fileno, self.old_stdout_fileno_undup)
-        os.dup2(self.old_stderr_fileno, self.old_stderr_fileno_undup)
-
-        os.close(self.old_stdout_fileno)
-        os.close(self.old_stderr_fileno)
-
-        self.outnull_file.close()
-        self.errnull_file.close()
-
-
-class SubProcess:
-    def __init__(self, main):
-        """
-        Handles forking, stopping and communication with a subprocess
-        :param main: subprocess method to run method signature is
-
-            def main(transmit, stop_process):
-                transmit: is a multiprocess Pipe to send data to parent process
-                stop_process: is multiprocess Event to set when you want the process to exit
-        """
-        self.main = main
-        self.recv, self.transmit = None, None
-        self.stop_process = None
-        self.proc = None
-
-    def fork(self):
-        """
-        Forks and starts the subprocess
-        """
-        self.recv, self.transmit = Pipe(duplex=True)
-        self.stop_process = Event()
-        self.proc = Process(target=self.main, args=(self.transmit, self.stop_process))
-        self.proc.start()
-
-    def write_pipe(self, item):
-        if self.recv is not None:
-            self.recv.send(item)
-
-    def read_pipe(self):
-        """
-        Reads data sent by the process into a list and returns it
-        :return:
-        """
-        item = []
-        if self.recv is not None:
-            try:
-                while self.recv.poll():
-                    item += [self.recv.recv()]
-            except:
-                pass
-        return item
-
-    def stop(self):
-        """
-        Sets the event to tell the process to exit.
-        note: this is co-operative multi-tasking, the process must respect the flag or this won't work!
-        """
-        self.stop_process.set()
-        self.proc.join()
-
-    def is_alive(self):
-        if self.proc is not None:
-            return self.proc.is_alive()
-        else:
-            return False
+import numpy as np
+from process import SubProcess, suppress_stdout_stderr
 
 
 class MainMenu:
@@ -116,17 +21,70 @@ class MainMenu:
         return urwid.ListBox(urwid.SimpleFocusListWalker(body))
 
 
+def rgb_to_256(frame):
+    """
+    Quantizes an RGB image to the 6x6x6 colour cube of a 256 colour terminal
+    :param frame: (H, W, 3) uint8 array
+    :return: (H, W) array of terminal colour numbers
+    """
+    cube = frame.astype(np.uint16) * 6 // 256
+    return 16 + 36 * cube[:, :, 0] + 6 * cube[:, :, 1] + cube[:, :, 2]
+
+
+_attr_cache = {}
+
+
+def half_block_markup(frame):
+    """
+    Renders an RGB image as urwid text markup, two pixels per character cell using the upper half block
+    with the top pixel as the foreground colour and the bottom pixel as the background
+    :param frame: (H, W, 3) uint8 array
+    :return: urwid markup, a list of (AttrSpec, text) and newlines
+    """
+    codes = rgb_to_256(frame)
+    if codes.shape[0] % 2 == 1:
+        codes = np.concatenate([codes, codes[-1:]])
+    markup = []
+    for top, bottom in zip(codes[0::2].tolist(), codes[1::2].tolist()):
+        run, count = None, 0
+        for cell in zip(top, bottom):
+            if cell != run and count > 0:
+                markup.append((_attr(run), '\N{UPPER HALF BLOCK}' * count))
+                count = 0
+            run = cell
+            count += 1
+        markup.append((_attr(run), '\N{UPPER HALF BLOCK}' * count))
+        markup.append('\n')
+    return markup[:-1]
+
+
+def _attr(cell):
+    if cell not in _attr_cache:
+        _attr_cache[cell] = urwid.AttrSpec(f'h{cell[0]}', f'h{cell[1]}', 256)
+    return _attr_cache[cell]
+
+
 class SubprocessMenu:
-    def __init__(self, choices, handle_button):
+    def __init__(self, choices, handle_button, preview=False):
+        """
+        :param choices: buttons to show under the display text
+        :param handle_button: called with the button and choice on click
+        :param preview: if True, an image preview is shown under the display text, set it with update_preview
+        """
         self.choices = choices
         self.choices += ['Return to Main']
         self.handle_button = handle_button
         self.display_text = urwid.Text('Waiting ...')
+        self.preview = preview
+        self.preview_text = urwid.Text('', wrap='clip')
         self.item = deque(maxlen=10)
 
     def menu(self):
         self.display_text = urwid.Text('Subprocess stopped ...')
         body = [self.display_text, urwid.Divider()]
+        if self.preview:
+            self.preview_text = urwid.Text('', wrap='clip')
+            body += [self.preview_text, urwid.Divider()]
 
         for c in self.choices:
             button = urwid.Button(c)
@@ -137,39 +95,91 @@ class SubprocessMenu:
     def update(self, text):
         self.display_text.set_text(text)
 
+    def update_preview(self, frame):
+        """
+        :param frame: (H, W, 3) RGB uint8 array
+        """
+        self.preview_text.set_text(half_block_markup(frame))
+
 
 class UrwidFrontend:
-    def __init__(self, title):
+    def __init__(self, title, screen=None, max_fps=24, status_fps=None, idle_fps=2, colors=None):
         """
         Urwid frontend to control the subprocess and display it's output
+
+        The heartbeat is event driven, it runs when a subprocess sends data down its pipe, and is polled at
+        status_fps while a subprocess is publishing to its status block, and at idle_fps while one with a status
+        block is running but has published nothing yet, eg: a recorder in standby.  Wakeups are coalesced so the
+        heartbeat never runs more than max_fps times a second, and when nothing is running the frontend sleeps.
+
+        :param title: title of the main menu
+        :param screen: urwid display to draw on, defaults to the terminal
+        :param max_fps: maximum number of heartbeats (and redraws) per second
+        :param status_fps: rate to poll status blocks at, defaults to max_fps
+        :param idle_fps: rate to poll status blocks nothing has been published to, to notice recording start
+        :param colors: number of terminal colours to use, eg: 256 for image previews, defaults to the screen default
         """
         self.title = title
         self.subprocess_menu = {}
         self.subprocess = {}
         main_menu_choices = ['Quit']
-        self.main_menu = MainMenu(self.title, main_menu_choices, self.handle_button)
-        self.event_loop = urwid.SelectEventLoop()
+        self.main_menu = MainMenu(self.title, main_menu_choices, self.button_pressed)
+        self.event_loop = self.make_event_loop()
+        self.min_interval = 1 / max_fps
+        self.status_interval = 1 / (status_fps or max_fps)
+        self.idle_interval = 1 / idle_fps
+        self.watches = {}
+        self.alarm = None
+        self.last_beat = 0.0
+        self.stopping = {}  # name -> (sentinel watch, escalation alarm, on_stopped)
 
         # start the heartbeat
-        self.event_loop.alarm(0, self.heartbeat)
+        self.wake()
         self.main = urwid.Padding(self.main_menu.menu(), left=2, right=2)
         self.top = urwid.Overlay(self.main, urwid.SolidFill(u'\N{MEDIUM SHADE}'),
                                  align='center', width=('relative', 60),
                                  valign='middle', height=('relative', 60),
                                  min_width=20, min_height=9)
 
-        self.loop = urwid.MainLoop(self.top, palette=[('reversed', 'standout', ''), ], event_loop=self.event_loop)
+        self.loop = urwid.MainLoop(self.top, palette=[('reversed', 'standout', ''), ], event_loop=self.event_loop,
+                                   screen=screen)
+        if colors is not None:
+            self.loop.screen.set_terminal_properties(colors=colors)
+
+    def make_event_loop(self):
+        """
+        :return: the urwid event loop to run the frontend on
+        """
+        return urwid.SelectEventLoop()
+
+    def add_subprocess(self, name, subprocess_main, choices, status=False, shared=None, preview=False):
+        """
+        :param name: name of the subprocess, and the main menu entry of its submenu
+        :param choices: buttons of the submenu, if None the subprocess gets no menu, see add_menu
+        """
+        self.subprocess[name] = SubProcess(subprocess_main, status=status, on_fork=partial(self.forked, name),
+                                           shared=shared)
+        if choices is not None:
+            self.add_menu(name, choices, preview=preview)
 
-    def add_subprocess(self, name, subprocess_main, choices):
-        self.subprocess[name] = SubProcess(subprocess_main)
-        self.subprocess_menu[name] = SubprocessMenu(choices, self.handle_button)
+    def add_menu(self, name, choices, preview=False):
+        """
+        Adds a submenu to the main menu, for controlling several subprocesses from one menu
+        """
+        self.subprocess_menu[name] = SubprocessMenu(choices, self.button_pressed, preview=preview)
         main_menu_choices = [f'{key}' for key in self.subprocess_menu] + ['Quit']
-        self.main_menu = MainMenu(self.title, main_menu_choices, self.handle_button)
+        self.main_menu = MainMenu(self.title, main_menu_choices, self.button_pressed)
         self.main.original_widget = self.main_menu.menu()
 
     def exit_program(self, button):
         raise urwid.ExitMainLoop()
 
+    def button_pressed(self, button, choice):
+        """
+        menu buttons call this, override handle_button to act on them
+        """
+        self.handle_button(button, choice)
+
     def handle_button(self, button, choice):
         if choice == 'Quit':
             self.exit_program(button)
@@ -177,12 +187,136 @@ class UrwidFrontend:
         if choice == 'Return to Main':
             self.main.original_widget = self.main_menu.menu()
 
+    def forked(self, name):
+        """
+        watch the pipe of a newly forked subprocess
+        """
+        self.unwatch(name)
+        self.watch(name)
+        self.wake()
+
+    def stop_subprocess(self, name, on_stopped=None, interrupt_after=30.0, kill_after=10.0):
+        """
+        Stops a subprocess without blocking the event loop, the process is asked to exit by setting its event,
+        after interrupt_after seconds it is sent SIGINT, and kill_after seconds after that SIGKILL.  The time
+        spent in each phase is kept in subprocess.shutdown, and shown by subprocess.shutdown.text() as it goes.
+        :param name: name of the subprocess
+        :param on_stopped: called with the name once the process has exited, from the event loop
+        :param interrupt_after: seconds to wait for the process to see its event before sending SIGINT, None to wait
+            forever
+        :param kill_after: seconds to wait after SIGINT before sending SIGKILL, None to wait forever
+        """
+        subprocess = self.subprocess[name]
+        if name in self.stopping:
+            return
+        if subprocess.proc is None or not subprocess.is_alive():
+            # never forked, or exited already, there is nothing to stop
+            if on_stopped is not None:
+                on_stopped(name)
+            return
+        subprocess.stop(wait=False)
+        if not subprocess.is_alive():
+            self.stopped(name, on_stopped)
+            return
+        watch = self.event_loop.watch_file(subprocess.sentinel(), partial(self.stopped, name, on_stopped))
+        alarm = None
+        if interrupt_after is not None:
+            alarm = self.event_loop.alarm(interrupt_after, partial(self.escalate, name, kill_after))
+        self.stopping[name] = (watch, alarm, on_stopped)
+        self.wake()
+
+    def escalate(self, name, kill_after):
+        """
+        the process ignored its event, interrupt it, and if it has been interrupted already, kill it
+        """
+        watch, _, on_stopped = self.stopping[name]
+        subprocess = self.subprocess[name]
+        alarm = None
+        if subprocess.shutdown.phase == 'event':
+            subprocess.interrupt()
+            if kill_after is not None:
+                alarm = self.event_loop.alarm(kill_after, partial(self.escalate, name, kill_after))
+        else:
+            subprocess.kill(wait=False)
+        self.stopping[name] = (watch, alarm, on_stopped)
+        self.wake()
+
+    def stopped(self, name, on_stopped):
+        """
+        the process has exited
+        """
+        if name in self.stopping:
+            watch, alarm, _ = self.stopping.pop(name)
+            self.event_loop.remove_watch_file(watch)
+            if alarm is not None:
+                self.event_loop.remove_alarm(alarm)
+        subprocess = self.subprocess[name]
+        subprocess.proc.join()
+        if subprocess.shutdown is not None and subprocess.shutdown.phase != 'exited':
+            subprocess.shutdown.exited()
+        self.wake()
+        if on_stopped is not None:
+            on_stopped(name)
+
+    def watch(self, name):
+        fd = self.subprocess[name].fileno()
+        if name not in self.watches and fd is not None:
+            self.watches[name] = self.event_loop.watch_file(fd, partial(self.readable, name))
+
+    def unwatch(self, name):
+        if name in self.watches:
+            self.event_loop.remove_watch_file(self.watches.pop(name))
+
+    def readable(self, name):
+        """
+        the pipe has data, stop watching it until the heartbeat has run, so a busy pipe can't wake us more
+        than max_fps times a second
+        """
+        self.unwatch(name)
+        self.wake()
+
+    def wake(self, delay=0.0):
+        """
+        schedule a heartbeat in delay seconds, or at the end of the current rate limit interval if that is later
+        if a heartbeat is already scheduled, this does nothing
+        """
+        if self.alarm is not None:
+            return
+        delay = max(delay, self.last_beat + self.min_interval - time.monotonic(), 0.0)
+        self.alarm = self.event_loop.alarm(delay, self.beat)
+
+    def beat(self):
+        self.alarm = None
+        self.last_beat = time.monotonic()
+        self.heartbeat()
+
     def heartbeat(self):
         # set the next beat
-        self.event_loop.alarm(1 / 24, self.heartbeat)
+        polling = None
+        for name, subprocess in self.subprocess.items():
+            if subprocess.is_alive():
+                self.watch(name)
+                if subprocess.status_block is not None:
+                    published = subprocess.status_block.published()
+                    interval = self.status_interval if published else self.idle_interval
+                    polling = interval if polling is None else min(polling, interval)
+            elif subprocess.pending():
+                # keep reading what the process sent before it exited, a budgeted read may have left some
+                self.watch(name)
+            else:
+                self.unwatch(name)
+        if self.stopping:
+            # keep the finalizing progress moving too
+            polling = self.status_interval
+        if polling is not None:
+            self.wake(polling)
 
     def run(self):
-        self.loop.run()
+        try:
+            self.loop.run()
+        finally:
+            for subprocess in self.subprocess.values():
+                subprocess.close()
 
 
 if __name__ == "__main__":
@@ -227,10 +361,8 @@ if __name__ == "__main__":
                 self.loop.draw_screen()
 
             if choice == 'Stop Subprocess':
-                self.subprocess['Subprocess'].stop()
-                item = self.subprocess_menu['Subprocess'].item
-                self.subprocess_menu['Subprocess'].update(['Subprocess stopping\n', f'{item}\n', ])
-                self.loop.draw_screen()
+                # the subprocess only checks its event every 2 seconds, so stop without waiting on it
+                self.stop_subprocess('Subprocess', interrupt_after=5.0, kill_after=5.0)
 
             if choice == 'Yup':
                 self.subprocess['Subprocess'].write_pipe('Yup')
@@ -242,16 +374,20 @@ if __name__ == "__main__":
 
         def heartbeat(self):
             """
-            heartbeat that runs 24 times per second
+            heartbeat that runs when the subprocess sends data
             """
 
-            # read from the process
-            self.subprocess_menu['Subprocess'].item.append(self.subprocess['Subprocess'].read_pipe())
+            # read from the process, at most a display's worth per beat
+            item = self.subprocess_menu['Subprocess'].item
+            item.extend(self.subprocess['Subprocess'].read_pipe(max_messages=item.maxlen, max_seconds=0.01))
 
             # display it
-            item = self.subprocess_menu['Subprocess'].item
             alive = self.subprocess['Subprocess'].is_alive()
-            self.subprocess_menu['Subprocess'].update([f'Subprocess {alive}\n', f'{item}\n', ])
+            text = [f'Subprocess {alive}\n', f'{item}\n']
+            shutdown = self.subprocess['Subprocess'].shutdown
+            if shutdown is not None:
+                text += [f'{shutdown.text()}\n']
+            self.subprocess_menu['Subprocess'].update(text)
             self.loop.draw_screen()
             super().heartbeat()
 
@@ -0,0 +1,119 @@
+import os
+import json
+import time
+
+
+class Watchdog:
+    """
+    Supervises recorders from the frontend, a recorder has stalled when its StatusBlock frame count hasn't
+    moved for stall_seconds, eg: grab is hung on a USB hiccup or an SDK deadlock, and the process is still alive.
+
+    The frontend kills a stalled recorder and restarts it under a new run id.  The gap, from the last frame
+    of the stalled recording to the first frame of its restart, is kept in the session metadata
+    {run_id}.session.json, which is rewritten atomically on every restart, so it survives the frontend crashing.
+    The time each recorder took to shut down at the end of the session is kept there too.
+    """
+    def __init__(self, directory, run_id, stall_seconds=5.0):
+        """
+        :param directory: directory recordings are written to
+        :param run_id: run id the session started with, names the session metadata
+        :param stall_seconds: seconds without a new frame before a recorder counts as stalled, None to never stall
+        """
+        self.directory = directory
+        self.run_id = run_id
+        self.stall_seconds = stall_seconds
+        self.progress = {}  # name -> (frames, monotonic time the frame count last changed)
+        self.runs = [run_id]
+        self.gaps = []
+        self.open_gaps = {}  # name -> gap waiting for the restarted recorder's first frame
+        self.shutdowns = {}  # name -> seconds spent in each phase of stopping, see process.Shutdown
+
+    @property
+    def filename(self):
+        return f'{self.directory}/{self.run_id}.session.json'
+
+    @property
+    def restarts(self):
+        return len(self.gaps)
+
+    def seconds_lost(self, now=None):
+        """
+        :return: total seconds not recorded, gaps still waiting on a first frame count up to now
+        """
+        now = time.monotonic() if now is None else now
+        lost = sum(gap['seconds'] for gap in self.gaps if gap['seconds'] is not None)
+        return lost + sum(now - gap['last_frame_time'] for gap in self.open_gaps.values())
+
+    def stalled(self, name, status, now=None):
+        """
+        Call every heartbeat with the latest status of each recorder
+        :param name: name of the recorder
+        :param status: latest Status the recorder published, None if it has none
+        :param now: monotonic time, defaults to now
+        :return: True if the recorder has not recorded a frame for stall_seconds
+        """
+        now = time.monotonic() if now is None else now
+        if status is None or status.timestamp == 0:
+            # the recorder hasn't started grabbing yet
+            return False
+        frames, changed = self.progress.get(name, (None, now))
+        if status.frames != frames:
+            self.progress[name] = (status.frames, now)
+            if status.frames > 0 and name in self.open_gaps:
+                self.close_gap(name, now)
+            return False
+        return self.stall_seconds is not None and now - changed >= self.stall_seconds
+
+    def restarted(self, name, run_id, frames, summary=None, now=None):
+        """
+        Call after killing a stalled recorder and starting its replacement
+        :param name: name of the recorder
+        :param run_id: run id the replacement records under
+        :param frames: frames the stalled recorder recorded
+        :param summary: GrabStats summary of the stalled recording
+        :param now: monotonic time, defaults to now
+        """
+        now = time.monotonic() if now is None else now
+        _, changed = self.progress.pop(name, (None, now))
+        gap = {'recorder': name, 'run_id': self.runs[-1], 'restart_run_id': run_id, 'frames': frames,
+               'stalled_at': time.time() - (now - changed), 'restarted_at': time.time(), 'seconds': None,
+               'last_frame_time': changed, 'stats': summary}
+        self.gaps += [gap]
+        self.open_gaps[name] = gap
+        if run_id not in self.runs:
+            self.runs += [run_id]
+        self.write()
+
+    def stopped(self, name, timings):
+        """
+        Call when a recorder has stopped at the end of the session
+        :param name: name of the recorder
+        :param timings: dict of shutdown phase -> seconds
+        """
+        self.shutdowns[name] = timings
+        self.write()
+
+    def close_gap(self, name, now):
+        gap = self.open_gaps.pop(name)
+        gap['seconds'] = now - gap['last_frame_time']
+        self.write()
+
+    def text(self):
+        """
+        :return: list of lines describing the restarts, for display
+        """
+        if self.restarts == 0:
+            return []
+        return [f'{self.restarts} restarts after stalls, {self.seconds_lost():.1f} s lost\n']
+
+    def write(self):
+        gaps = [{key: value for key, value in gap.items() if key != 'last_frame_time'} for gap in self.gaps]
+        session = {'run_id': self.run_id, 'runs': self.runs, 'stall_seconds': self.stall_seconds,
+                   'restarts': self.restarts, 'seconds_lost': self.seconds_lost(), 'gaps': gaps,
+                   'shutdowns': self.shutdowns}
+        temp = f'{self.filename}.tmp'
+        with open(temp, 'w') as f:
+            json.dump(session, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.filename)